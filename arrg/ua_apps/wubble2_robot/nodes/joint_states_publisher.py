@@ -36,6 +36,9 @@ import rospy
 from sensor_msgs.msg import JointState as JointState
 from dynamixel_hardware_interface.msg import JointState as DynamixelJointState
 
+from wubble_controllers.joint_state_aggregator import JointStateAggregator
+from wubble_controllers.joint_state_aggregator import POLICY_RATE
+
 class JointStatesPublisher():
     def __init__(self):
         rospy.init_node('wubble_joint_states_publisher', anonymous=True)
@@ -53,51 +56,46 @@ class JointStatesPublisher():
                             'head_tilt_controller',
                             'neck_tilt_controller')
                             
-        self.joint_states = {'base_caster_support_joint': DynamixelJointState(name='base_caster_support_joint', position=0.0, velocity=0.0, load=0.0),
-                             'caster_wheel_joint': DynamixelJointState(name='caster_wheel_joint', position=0.0, velocity=0.0, load=0.0),
-                             'base_link_left_wheel_joint': DynamixelJointState(name='base_link_left_wheel_joint', position=0.0, velocity=0.0, load=0.0),
-                             'base_link_right_wheel_joint': DynamixelJointState(name='base_link_right_wheel_joint', position=0.0, velocity=0.0, load=0.0)}
-                             
-        for controller in self.controllers:
-            joint_name = rospy.get_param(controller + '/joint')
-            self.joint_states[joint_name] = DynamixelJointState(name=joint_name)
-            
-        # Start controller state subscribers
-        [rospy.Subscriber(c + '/state', DynamixelJointState, self.controller_state_handler) for c in self.controllers]
-        [rospy.wait_for_message(c + '/state', DynamixelJointState) for c in self.controllers]
+        self.static_joints = ('base_caster_support_joint',
+                              'caster_wheel_joint',
+                              'base_link_left_wheel_joint',
+                              'base_link_right_wheel_joint')
+                              
+        joint_names = [rospy.get_param(controller + '/joint') for controller in self.controllers]
+        
+        publish_rate = rospy.get_param('~rate', 100)
+        publish_policy = rospy.get_param('~publish_policy', POLICY_RATE)
+        self.stale_timeout = rospy.get_param('~stale_timeout', 1.0)
         
         # Start publisher
         self.joint_states_pub = rospy.Publisher('joint_states', JointState)
+        self.aggregator = JointStateAggregator(self.joint_states_pub, self.static_joints, joint_names, publish_policy, 1.0 / publish_rate)
+        self.stale = set()
+        
+        # Start controller state subscribers
+        [rospy.Subscriber(c + '/state', DynamixelJointState, self.controller_state_handler) for c in self.controllers]
+        [rospy.wait_for_message(c + '/state', DynamixelJointState) for c in self.controllers]
         
-        publish_rate = rospy.get_param('~rate', 100)
         r = rospy.Rate(publish_rate)
         
         while not rospy.is_shutdown():
-            self.publish_joint_states()
+            self.aggregator.tick()
+            self.check_stale()
             r.sleep()
 
     def controller_state_handler(self, msg):
-        state = self.joint_states[msg.name]
-        state.position = msg.position
-        state.velocity = msg.velocity
-        state.load = msg.load
+        self.aggregator.update(msg.name, msg.position, msg.velocity, msg.load, msg.header.stamp)
 
-    def publish_joint_states(self):
-        # Construct message & publish joint states
-        msg = JointState()
+    def check_stale(self):
+        stale = set(self.aggregator.stale_joints(self.stale_timeout))
         
-        for joint, state in self.joint_states.items():
-            msg.name.append(joint)
-            msg.position.append(state.position)
-            msg.velocity.append(state.velocity)
-            msg.effort.append(state.load)
-            
-        msg.header.stamp = rospy.Time.now()
-        self.joint_states_pub.publish(msg)
+        if stale != self.stale:
+            if stale - self.stale: rospy.logwarn('No state updates for more than %.1fs from %s' % (self.stale_timeout, ', '.join(sorted(stale - self.stale))))
+            if self.stale - stale: rospy.loginfo('State updates resumed from %s' % ', '.join(sorted(self.stale - stale)))
+            self.stale = stale
 
 if __name__ == '__main__':
     try:
         s = JointStatesPublisher()
         rospy.spin()
     except rospy.ROSInterruptException: pass
-
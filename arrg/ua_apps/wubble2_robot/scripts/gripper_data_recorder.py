@@ -37,6 +37,8 @@ from dynamixel_msgs.msg import JointState
 from std_srvs.srv import Empty
 from std_msgs.msg import Float64
 
+from wubble2_robot.sensor_log import SensorLogWriter
+
 if __name__ == '__main__':
     attribute_names = ['left_pressure', 'right_pressure', 'total_pressure',
                        'left_position', 'right_position',
@@ -47,37 +49,47 @@ if __name__ == '__main__':
                        'left_ground_dist', 'right_ground_dist',
                        'has_grip']
                        
-    attribute_types = ['C#'] * len(attribute_names)
-    attribute_types[-1] = 'cD#'
-    
-    data = [0.0] * len(attribute_names)
-    data[-1] = False  # no grip by default
+    has_grip = False  # no grip by default
     save = False
     
     rospy.init_node('gripper_data_collection', anonymous=True)
     
-    def  process_float64_msgs(msg, idx):
-        data[idx] = msg.data
-        
-    def process_joint_state(msg, idxs):
-        data[idxs[0]] = msg.current_pos
-        data[idxs[1]] = msg.load
-        data[idxs[2]] = msg.velocity
-        data[idxs[3]] = msg.goal_pos
-        
-    rospy.Subscriber('/left_finger_pressure', Float64, process_float64_msgs, 0)
-    rospy.Subscriber('/right_finger_pressure', Float64, process_float64_msgs, 1)
-    rospy.Subscriber('/total_pressure', Float64, process_float64_msgs, 2)
-    rospy.Subscriber('/gripper_opening', Float64, process_float64_msgs, 7)
-    rospy.Subscriber('/gripper_distance_sensor', Float64, process_float64_msgs, 8)
-    rospy.Subscriber('/left_finger_controller/state', JointState, process_joint_state, [3,5,9,11])
-    rospy.Subscriber('/right_finger_controller/state', JointState, process_joint_state, [4,6,10,12])
-    rospy.Subscriber('/left_finger_ground_distance', Float64, process_float64_msgs, 13)
-    rospy.Subscriber('/right_finger_ground_distance', Float64, process_float64_msgs, 14)
+    # every message is logged as it arrives, stamped with its own header
+    # stamp or, for plain Float64 messages, the time it was received
+    stamp = rospy.Time.now().to_sec()
+    log = SensorLogWriter('/tmp/%d%s' % (stamp, '.dat'), attribute_names)
+    rospy.on_shutdown(log.close)
+    
+    def  process_float64_msgs(msg, name):
+        if save:
+            log.write(name, rospy.Time.now(), msg.data)
+            
+    def process_joint_state(msg, names):
+        if save:
+            stamp = msg.header.stamp
+            if stamp.is_zero(): stamp = rospy.Time.now()
+            log.write(names[0], stamp, msg.current_pos)
+            log.write(names[1], stamp, msg.load)
+            log.write(names[2], stamp, msg.velocity)
+            log.write(names[3], stamp, msg.goal_pos)
+            
+    rospy.Subscriber('/left_finger_pressure', Float64, process_float64_msgs, 'left_pressure')
+    rospy.Subscriber('/right_finger_pressure', Float64, process_float64_msgs, 'right_pressure')
+    rospy.Subscriber('/total_pressure', Float64, process_float64_msgs, 'total_pressure')
+    rospy.Subscriber('/gripper_opening', Float64, process_float64_msgs, 'gripper_opening')
+    rospy.Subscriber('/gripper_distance_sensor', Float64, process_float64_msgs, 'ir_distance')
+    rospy.Subscriber('/left_finger_controller/state', JointState, process_joint_state,
+                     ['left_position', 'left_load', 'left_velocity', 'left_goal'])
+    rospy.Subscriber('/right_finger_controller/state', JointState, process_joint_state,
+                     ['right_position', 'right_load', 'right_velocity', 'right_goal'])
+    rospy.Subscriber('/left_finger_ground_distance', Float64, process_float64_msgs, 'left_ground_dist')
+    rospy.Subscriber('/right_finger_ground_distance', Float64, process_float64_msgs, 'right_ground_dist')
     
     def process_trigger(req):
-        data[-1] = not data[-1]
-        rospy.loginfo('Gripper %s holding %s' % ('IS' if data[-1] else 'IS NOT', 'SOMETHING' if data[-1] else 'ANYTHING'))
+        global has_grip
+        has_grip = not has_grip
+        if save: log.write('has_grip', rospy.Time.now(), has_grip)
+        rospy.loginfo('Gripper %s holding %s' % ('IS' if has_grip else 'IS NOT', 'SOMETHING' if has_grip else 'ANYTHING'))
         return []
         
     rospy.Service('/has_grip_trigger', Empty, process_trigger)
@@ -85,26 +97,12 @@ if __name__ == '__main__':
     def process_start_stop(req):
         global save
         save = not save
+        # has_grip only changes on a trigger, record where it stands
+        if save: log.write('has_grip', rospy.Time.now(), has_grip)
         rospy.loginfo('Gripper data collection is %s' % ('STARTED' if save else 'STOPPED'))
         return []
         
     rospy.Service('/trigger_gripper_data_collection', Empty, process_start_stop)
     
-    stamp = rospy.Time.now().to_sec()
-    f = open('/tmp/%d%s' % (stamp, '.txt'), 'w')
-    tmp = ['%s%s' % (attr_type,attr_name) for (attr_type,attr_name) in zip(attribute_types,attribute_names)]
-    header = '\t'.join(tmp)
-    f.write(header)
-    f.write('\n')
+    rospy.spin()
     
-    rate = rospy.Rate(10)
-    while not rospy.is_shutdown():
-        if save:
-            sample = '\t'.join(map(str, data))
-            f.write(sample)
-            f.write('\n')
-            f.flush()
-        rate.sleep()
-        
-    f.close()
-
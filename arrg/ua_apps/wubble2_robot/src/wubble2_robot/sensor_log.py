@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2010, Antons Rebguns
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Willow Garage, Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 'AS IS'
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import struct
+import threading
+from Queue import Queue, Empty
+
+import numpy
+
+
+MAGIC = 'SENSORLOG1\n'
+
+# one record per logged value, stamps are nanoseconds
+RECORD_DTYPE = numpy.dtype([('stamp', numpy.int64),
+                            ('channel', numpy.uint16),
+                            ('value', numpy.float64)])
+
+
+def header_size(channels):
+    # magic, length of the channel list, the channel list, then padding so
+    # that the records start on an 8 byte boundary
+    size = len(MAGIC) + 4 + len('\n'.join(channels))
+    return (size + 7) // 8 * 8
+
+
+class SensorLogWriter():
+    """
+    Logs (stamp, channel, value) records of a fixed list of channels to a
+    binary file.
+
+    write() only puts the record on a queue, a background thread batches
+    queued records into a numpy array and appends them to the file, so the
+    subscriber callbacks calling write() never wait on the disk. At most
+    buffer_size records are written at a time.
+    """
+    def __init__(self, fname, channels, buffer_size=1024):
+        self.fname = fname
+        self.channels = list(channels)
+        self.index = dict((name, idx) for idx, name in enumerate(self.channels))
+        self.buffer_size = buffer_size
+        self.queue = Queue()
+        self.count = 0
+
+        names = '\n'.join(self.channels)
+        header = MAGIC + struct.pack('<I', len(names)) + names
+        header += '\0' * (header_size(self.channels) - len(header))
+
+        self.file = open(fname, 'wb')
+        self.file.write(header)
+        self.file.flush()
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, channel, stamp, value):
+        """
+        Logs value of channel, stamp is a rospy.Time or nanoseconds.
+        """
+        if not isinstance(stamp, (int, long)): stamp = stamp.to_nsec()
+        self.queue.put((stamp, self.index[channel], value))
+
+    def run(self):
+        done = False
+
+        while not done:
+            batch = [self.queue.get()]
+
+            try:
+                while len(batch) < self.buffer_size:
+                    batch.append(self.queue.get_nowait())
+            except Empty:
+                pass
+
+            if batch[-1] is None:
+                batch.pop()
+                done = True
+
+            if batch:
+                numpy.array(batch, dtype=RECORD_DTYPE).tofile(self.file)
+                self.file.flush()
+                self.count += len(batch)
+
+        self.file.close()
+
+    def close(self):
+        """
+        Writes out everything logged so far and closes the file.
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+
+def read_records(fname):
+    """
+    Returns the channel names and a read only memmap of all records of a
+    sensor log, in the order they were logged.
+    """
+    f = open(fname, 'rb')
+    try:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a sensor log' % fname)
+        length, = struct.unpack('<I', f.read(4))
+        names = f.read(length)
+    finally:
+        f.close()
+
+    channels = names.split('\n') if names else []
+    offset = header_size(channels)
+
+    # a log that is still being written may end in a partial record
+    num_records = (os.path.getsize(fname) - offset) // RECORD_DTYPE.itemsize
+    if num_records == 0: return channels, numpy.zeros(0, dtype=RECORD_DTYPE)
+
+    records = numpy.memmap(fname, dtype=RECORD_DTYPE, mode='r', offset=offset, shape=(num_records,))
+    return channels, records
+
+
+def read_log(fname):
+    """
+    Returns a dict from channel name to a dict with its stamp (nanoseconds)
+    and value columns as numpy arrays, sorted by stamp.
+    """
+    channels, records = read_records(fname)
+
+    # group by channel, then by stamp within every channel
+    order = numpy.lexsort((records['stamp'], records['channel']))
+    grouped = records[order]
+    bounds = numpy.searchsorted(grouped['channel'], numpy.arange(len(channels) + 1))
+
+    log = {}
+
+    for idx, name in enumerate(channels):
+        selected = grouped[bounds[idx]:bounds[idx+1]]
+        log[name] = {'stamp': numpy.array(selected['stamp']),
+                     'value': numpy.array(selected['value'])}
+
+    return log
@@ -50,6 +50,9 @@ from wubble_actions.msg import SmartArmGripperAction
 from dynamixel_controllers.srv import SetSpeed
 from wubble_blocks.srv import ClassifyObject
 
+from path_learning_experiment.scan_stats import ScanStatistics
+from path_learning_experiment.scan_stats import index_sector
+
 class ObjectSwat:
     def __init__(self):
         self.all_objects = []
@@ -61,6 +64,10 @@ class ObjectSwat:
         self.avg_front_dist = 10
         self.min_front_dist = 10
 
+        # 100 rays around the center of the tilt laser, returns closer than
+        # 5cm hit the robot itself
+        self.scan_stats = ScanStatistics([index_sector('front', -50, 50)], min_range=0.05)
+
         rospy.Subscriber('overhead_objects', PoseArray, self.update_object_positions)
         rospy.Subscriber('tilt_laser/scan', LaserScan, self.filter_scan)
 
@@ -86,14 +93,8 @@ class ObjectSwat:
         self.all_objects = msg.poses
 
     def filter_scan(self, scan):
-        center_scan_index = (len(scan.ranges) + 1) / 2
-
-        min_idx = center_scan_index - 50
-        max_idx = center_scan_index + 50
-
-        for dist in scan.ranges[min_idx:max_idx]:
-            if dist < self.min_front_dist and dist > 0.05:
-                self.min_front_dist = dist
+        stats = self.scan_stats.update(scan)
+        self.min_front_dist = min(self.min_front_dist, stats['front_min'])
 
     def tuck_arm_for_navigation(self):
         goal = SmartArmGripperGoal()
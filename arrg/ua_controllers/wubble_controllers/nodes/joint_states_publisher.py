@@ -33,22 +33,18 @@ import rospy
 from sensor_msgs.msg import JointState as JointStatePR2
 from dynamixel_msgs.msg import JointState as JointStateAX12
 
-class JointStateMessage():
-    def __init__(self, name, position, velocity, effort):
-        self.name = name
-        self.position = position
-        self.velocity = velocity
-        self.effort = effort
+from wubble_controllers.joint_state_aggregator import JointStateAggregator
+from wubble_controllers.joint_state_aggregator import POLICY_RATE
 
 class JointStatesPublisher():
     def __init__(self):
         rospy.init_node('wubble_joint_states_publisher', anonymous=True)
         
-        self.joint_states = {'base_caster_support_joint': JointStateMessage('base_caster_support_joint', 0.0, 0.0, 0.0),
-                             'caster_wheel_joint': JointStateMessage('caster_wheel_joint', 0.0, 0.0, 0.0),
-                             'base_link_left_wheel_joint': JointStateMessage('base_link_left_wheel_joint', 0.0, 0.0, 0.0),
-                             'base_link_right_wheel_joint': JointStateMessage('base_link_right_wheel_joint', 0.0, 0.0, 0.0)}
-                             
+        self.static_joints = ('base_caster_support_joint',
+                              'caster_wheel_joint',
+                              'base_link_left_wheel_joint',
+                              'base_link_right_wheel_joint')
+                              
         self.controllers = ('shoulder_pan_controller',
                             'shoulder_tilt_controller',
                             'elbow_tilt_controller',
@@ -59,43 +55,40 @@ class JointStatesPublisher():
                             'head_tilt_controller',
                             'laser_tilt_controller')
                             
-        # Start controller state subscribers
-        [rospy.Subscriber(c + '/state', JointStateAX12, self.controller_state_handler) for c in self.controllers]
+        joint_names = [rospy.get_param(c + '/joint_name') for c in self.controllers]
+        
+        publish_rate = rospy.get_param('~rate', 50)
+        publish_policy = rospy.get_param('~publish_policy', POLICY_RATE)
+        self.stale_timeout = rospy.get_param('~stale_timeout', 1.0)
         
         # Start publisher
         self.joint_states_pub = rospy.Publisher('joint_states', JointStatePR2)
+        self.aggregator = JointStateAggregator(self.joint_states_pub, self.static_joints, joint_names, publish_policy, 1.0 / publish_rate)
+        self.stale = set()
+        
+        # Start controller state subscribers
+        [rospy.Subscriber(c + '/state', JointStateAX12, self.controller_state_handler) for c in self.controllers]
         
-        publish_rate = rospy.get_param('~rate', 50)
         r = rospy.Rate(publish_rate)
         
         while not rospy.is_shutdown():
-            self.publish_joint_states()
+            self.aggregator.tick()
+            self.check_stale()
             r.sleep()
             
     def controller_state_handler(self, msg):
-        jcs = JointStateMessage(msg.name, msg.current_pos, msg.velocity, msg.load)
-        self.joint_states[msg.name] = jcs
+        self.aggregator.update(msg.name, msg.current_pos, msg.velocity, msg.load, msg.header.stamp)
         
-    def publish_joint_states(self):
-        # Construct message & publish joint states
-        msg = JointStatePR2()
-        msg.name = []
-        msg.position = []
-        msg.velocity = []
-        msg.effort = []
+    def check_stale(self):
+        stale = set(self.aggregator.stale_joints(self.stale_timeout))
         
-        for joint in self.joint_states.values():
-            msg.name.append(joint.name)
-            msg.position.append(joint.position)
-            msg.velocity.append(joint.velocity)
-            msg.effort.append(joint.effort)
+        if stale != self.stale:
+            if stale - self.stale: rospy.logwarn('No state updates for more than %.1fs from %s' % (self.stale_timeout, ', '.join(sorted(stale - self.stale))))
+            if self.stale - stale: rospy.loginfo('State updates resumed from %s' % ', '.join(sorted(self.stale - stale)))
+            self.stale = stale
             
-        msg.header.stamp = rospy.Time.now()
-        self.joint_states_pub.publish(msg)
-
 if __name__ == '__main__':
     try:
         s = JointStatesPublisher()
         rospy.spin()
     except rospy.ROSInterruptException: pass
-
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2010, Arizona Robotics Research Group, University of Arizona
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions and the following disclaimer.  * Redistributions
+#     in binary form must reproduce the above copyright notice, this list of
+#     conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution. # Neither the name of
+#     the Willow Garage, Inc. nor the names of its contributors may be used to
+#     endorse or promote products derived from this software without specific
+#     prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 'AS IS'
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from threading import Lock
+
+import rospy
+
+from sensor_msgs.msg import JointState
+
+
+# publish every tick of the node's rate
+POLICY_RATE = 'rate'
+
+# publish as soon as a joint reports a position, velocity or effort that
+# differs from the one already published
+POLICY_CHANGE = 'change'
+
+# publish once every controller has reported since the last message, i.e.
+# one message per round of controller updates
+POLICY_COALESCE = 'coalesce'
+
+POLICIES = (POLICY_RATE, POLICY_CHANGE, POLICY_COALESCE)
+
+
+class JointStateAggregator():
+    """
+    Keeps the latest state of a fixed list of joints in a single, reused
+    sensor_msgs/JointState message and decides when to publish it.
+
+    Joint order is the order of static_joints followed by the order of
+    controlled_joints and never changes, so every update is a plain index
+    assignment into the preallocated arrays. rospy serializes a message
+    synchronously in publish, so the same message object is safely reused
+    for every publication.
+
+    With the change and coalesce policies tick() acts as a heartbeat: it
+    only publishes if nothing went out during the last period, so static
+    joints keep showing up in TF while the arm is not moving.
+    
+    Nothing is published before every controlled joint reported at least
+    once, the placeholder zeros would otherwise briefly show up in TF.
+    """
+    def __init__(self, publisher, static_joints, controlled_joints, policy=POLICY_RATE, period=0.01):
+        if policy not in POLICIES:
+            raise ValueError('unknown publish policy %s, expected one of %s' % (policy, ', '.join(POLICIES)))
+
+        self.publisher = publisher
+        self.policy = policy
+        self.period = rospy.Duration.from_sec(period)
+        self.lock = Lock()
+
+        self.num_static = len(static_joints)
+        self.names = list(static_joints) + list(controlled_joints)
+        self.index = dict((name, idx) for idx, name in enumerate(self.names))
+
+        num_joints = len(self.names)
+        self.msg = JointState()
+        self.msg.name = self.names
+        self.msg.position = [0.0] * num_joints
+        self.msg.velocity = [0.0] * num_joints
+        self.msg.effort = [0.0] * num_joints
+
+        # arrival time of the latest update and smoothed delay between the
+        # controller stamping its state and the update arriving here
+        self.last_update = [None] * num_joints
+        self.latency = [None] * num_joints
+        self.latency_alpha = 0.1
+
+        # controlled joints that never reported
+        self.waiting = set(range(self.num_static, num_joints))
+        
+        self.pending = set()
+        self.last_publish = None
+        self.start_time = rospy.Time.now()
+
+    def update(self, name, position, velocity, effort, stamp=None):
+        """
+        Records the latest state of joint name, stamp is the time the
+        controller stamped it with (if any). Publishes right away if the
+        policy says so.
+        """
+        idx = self.index.get(name)
+        if idx is None: return
+
+        now = rospy.Time.now()
+
+        with self.lock:
+            msg = self.msg
+            changed = (msg.position[idx] != position or msg.velocity[idx] != velocity or msg.effort[idx] != effort)
+
+            msg.position[idx] = position
+            msg.velocity[idx] = velocity
+            msg.effort[idx] = effort
+
+            self.last_update[idx] = now
+            self.waiting.discard(idx)
+
+            if stamp is not None and not stamp.is_zero():
+                delay = (now - stamp).to_sec()
+                if self.latency[idx] is None: self.latency[idx] = delay
+                else: self.latency[idx] += self.latency_alpha * (delay - self.latency[idx])
+
+            if self.policy == POLICY_CHANGE:
+                if changed: self.publish(now)
+            elif self.policy == POLICY_COALESCE:
+                self.pending.add(idx)
+                if len(self.pending) == len(self.names) - self.num_static: self.publish(now)
+
+    def tick(self):
+        """
+        Called at the node's rate.
+        """
+        now = rospy.Time.now()
+
+        with self.lock:
+            if self.policy == POLICY_RATE or self.last_publish is None or now - self.last_publish >= self.period:
+                self.publish(now)
+
+    def publish(self, now):
+        # callers hold the lock
+        if self.waiting: return
+        
+        self.msg.header.stamp = now
+        self.publisher.publish(self.msg)
+        self.last_publish = now
+        self.pending.clear()
+
+    def joint_stats(self):
+        """
+        Returns (name, staleness, latency) for every joint: seconds since the
+        joint's latest update and the smoothed delay of its updates (None
+        for joints that never reported or whose states are not stamped).
+        """
+        now = rospy.Time.now()
+
+        with self.lock:
+            stats = []
+
+            for idx, name in enumerate(self.names):
+                last_update = self.last_update[idx]
+                if last_update is None: staleness = None
+                else: staleness = (now - last_update).to_sec()
+                stats.append((name, staleness, self.latency[idx]))
+
+            return stats
+
+    def stale_joints(self, timeout):
+        """
+        Returns the names of controlled joints that did not report for longer
+        than timeout seconds, joints that never reported count from the
+        moment the aggregator was created.
+        """
+        waited = (rospy.Time.now() - self.start_time).to_sec()
+
+        return [name for name, staleness, latency in self.joint_stats()[self.num_static:]
+                if (waited if staleness is None else staleness) > timeout]
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+#
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Antons Rebguns. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of University of Arizona nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Antons Rebguns
+#
+
+
+"""
+Buffered packet framing and decoding for the CHR-6dm binary protocol.
+"""
+
+import sys
+import time
+import struct
+
+from chr_6dm_const import *
+
+DEG_TO_RAD = 0.017453293    # degrees to radians
+MILIG_TO_MSS = 0.00980665   # mili g to m/s^2
+
+PREFIX = 'snp'
+HEADER_SIZE = 5             # s n p INSTRUCTION LENGTH
+CHECKSUM_SIZE = 2
+PREFIX_SUM = sum(map(ord, PREFIX))
+
+# SENSOR_DATA channels in the order they appear in the packet
+CHANNELS = [
+    (0x8000, 'yaw',        SCALE_YAW * DEG_TO_RAD),
+    (0x4000, 'pitch',      SCALE_PITCH * DEG_TO_RAD),
+    (0x2000, 'roll',       SCALE_ROLL * DEG_TO_RAD),
+    (0x1000, 'yaw_rate',   SCALE_YAW_RATE * DEG_TO_RAD),
+    (0x0800, 'pitch_rate', SCALE_PITCH_RATE * DEG_TO_RAD),
+    (0x0400, 'roll_rate',  SCALE_ROLL_RATE * DEG_TO_RAD),
+    (0x0200, 'mag_x',      SCALE_MAG_X),
+    (0x0100, 'mag_y',      SCALE_MAG_Y),
+    (0x0080, 'mag_z',      SCALE_MAG_Z),
+    (0x0040, 'gyro_x',     SCALE_GYRO_X * DEG_TO_RAD),
+    (0x0020, 'gyro_y',     SCALE_GYRO_Y * DEG_TO_RAD),
+    (0x0010, 'gyro_z',     SCALE_GYRO_Z * DEG_TO_RAD),
+    (0x0008, 'accel_x',    SCALE_ACCEL_X * MILIG_TO_MSS),
+    (0x0004, 'accel_y',    SCALE_ACCEL_Y * MILIG_TO_MSS),
+    (0x0002, 'accel_z',    SCALE_ACCEL_Z * MILIG_TO_MSS),
+]
+
+class SensorLayout(object):
+    """ Precompiled layout of a SENSOR_DATA payload for one active channel mask. """
+
+    def __init__(self, active_channels):
+        self.active_channels = active_channels
+        self.channels = [(key, scale) for mask, key, scale in CHANNELS if active_channels & mask]
+        self.struct = struct.Struct('>H' + 'h' * len(self.channels))
+
+    def decode(self, payload):
+        if len(payload) != self.struct.size:
+            return None
+            
+        values = self.struct.unpack(payload)
+        res = dict((key, value * scale) for (key, scale), value in zip(self.channels, values[1:]))
+        res['timestamp'] = time.time()
+        return res
+
+class PacketDecoder(object):
+    """
+    Frames packets out of an arbitrarily chunked byte stream.
+
+    Bytes are appended to an internal buffer, complete packets with a valid
+    checksum are returned as (command, payload) tuples. On garbage or a bad
+    checksum the decoder drops bytes up to the next 'snp' prefix and tries
+    again, so a corrupted packet costs at most itself.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.layouts = {}
+        self.skipped_bytes = 0
+        self.bad_checksums = 0
+
+    def reset(self):
+        self.buffer = ''
+
+    def feed(self, data):
+        """ Appends data to the buffer and returns all complete packets in it. """
+        buf = self.buffer + data
+        packets = []
+        pos = 0
+        
+        while True:
+            start = buf.find(PREFIX, pos)
+            
+            if start < 0:
+                # keep a possible partial prefix at the end of the buffer
+                keep = len(buf) - max(pos, len(buf) - len(PREFIX) + 1)
+                self.skipped_bytes += len(buf) - pos - keep
+                pos = len(buf) - keep
+                break
+                
+            self.skipped_bytes += start - pos
+            
+            if len(buf) - start < HEADER_SIZE:
+                pos = start
+                break
+                
+            command = ord(buf[start+3])
+            n = ord(buf[start+4])
+            end = start + HEADER_SIZE + n + CHECKSUM_SIZE
+            
+            if len(buf) < end:
+                pos = start
+                break
+                
+            payload = buf[start+HEADER_SIZE:end-CHECKSUM_SIZE]
+            chkSumRx = (ord(buf[end-2]) << 8) | ord(buf[end-1])
+            chkSum = PREFIX_SUM + command + n + sum(bytearray(payload))
+            
+            if chkSumRx != chkSum:
+                # resynchronize on the next prefix after this one
+                self.bad_checksums += 1
+                self.skipped_bytes += 1
+                pos = start + 1
+                continue
+                
+            packets.append((command, payload))
+            pos = end
+            
+        self.buffer = buf[pos:]
+        return packets
+
+    def layout(self, active_channels):
+        """ Returns the cached SensorLayout for an active channel mask. """
+        layout = self.layouts.get(active_channels)
+        
+        if layout is None:
+            layout = SensorLayout(active_channels)
+            self.layouts[active_channels] = layout
+            
+        return layout
+
+    def decode_sensor_data(self, payload):
+        active_channels = (ord(payload[0]) << 8) | ord(payload[1])
+        return self.layout(active_channels).decode(payload)
+
+class ReplayPort(object):
+    """
+    Minimal stand-in for serial.Serial that plays back a recorded byte stream,
+    so CHR6dmIMU can be driven (and benchmarked) without the hardware.
+    """
+
+    def __init__(self, data, chunk_size=4096):
+        self.data = data
+        self.pos = 0
+        self.chunk_size = chunk_size
+        self.timeout = 0.0
+        self.written = []
+
+    def read(self, size=1):
+        res = self.data[self.pos:self.pos+size]
+        self.pos += len(res)
+        return res
+
+    def inWaiting(self):
+        return min(self.chunk_size, len(self.data) - self.pos)
+
+    def write(self, data):
+        self.written.append(data)
+
+    def flushInput(self):
+        pass
+
+    def flushOutput(self):
+        pass
+
+    def close(self):
+        pass
+
+if __name__ == '__main__':
+    # decode a recorded byte stream and report the sustained decoding rate
+    f = open(sys.argv[1], 'rb')
+    data = f.read()
+    f.close()
+    
+    decoder = PacketDecoder()
+    start = time.time()
+    sensor_packets = 0
+    
+    for i in xrange(0, len(data), 4096):
+        for command, payload in decoder.feed(data[i:i+4096]):
+            if command == SENSOR_DATA:
+                decoder.decode_sensor_data(payload)
+                sensor_packets += 1
+                
+    elapsed = time.time() - start
+    print 'Decoded %d SENSOR_DATA packets in %f seconds (%d packets/s)' % (sensor_packets, elapsed, sensor_packets / max(elapsed, 1e-9))
+    print '%d bytes skipped, %d bad checksums' % (decoder.skipped_bytes, decoder.bad_checksums)
@@ -38,30 +38,42 @@ import time
 import serial
 import struct
 from math import sqrt
-from binascii import b2a_hex
+from collections import deque
 
 from chr_6dm_const import *
-
-DEG_TO_RAD = 0.017453293    # degrees to radians
-MILIG_TO_MSS = 0.00980665   # mili g to m/s^2
+from chr_6dm_decoder import DEG_TO_RAD
+from chr_6dm_decoder import MILIG_TO_MSS
+from chr_6dm_decoder import PacketDecoder
 
 MAX_BYTES_SKIPPED = 1000
 
 class CHR6dmIMU(object):
     """ Provides low level IO with the CHR-6dm IMU through pyserial. """
 
-    def __init__(self, port='/dev/ttyUSB0'):
-        """ Constructor takes serial port as argument. """
+    def __init__(self, port='/dev/ttyUSB0', ser=None):
+        """
+        Constructor takes serial port as argument. Alternatively an already
+        open serial-like object (e.g. a ReplayPort playing back a recorded
+        byte stream) can be passed in as ser.
+        """
         self.ser = None
-        self.ser = serial.Serial(port)
-        self.ser.timeout = 0.015
-        self.ser.baudrate = 115200
-        self.ser.bytesize = serial.EIGHTBITS
-        self.ser.stopbits = serial.STOPBITS_ONE
-        self.ser.parity = serial.PARITY_NONE
         
+        if ser is not None:
+            self.ser = ser
+        else:
+            self.ser = serial.Serial(port)
+            self.ser.timeout = 0.015
+            self.ser.baudrate = 115200
+            self.ser.bytesize = serial.EIGHTBITS
+            self.ser.stopbits = serial.STOPBITS_ONE
+            self.ser.parity = serial.PARITY_NONE
+            
         print "Connected to IMU on %s" % port
         
+        # packets framed from the serial stream but not handled yet
+        self.decoder = PacketDecoder()
+        self.packets = deque()
+        
         # IMU state variables
         self.yaw = 0.0
         self.pitch = 0.0
@@ -113,6 +125,8 @@ class CHR6dmIMU(object):
 
     def write_to_imu(self, command, data=tuple()):
         self.ser.flushInput()
+        self.decoder.reset()
+        self.packets.clear()
         
         chkSum = self.calculate_checksum(command, data)
         dataStr = ''.join(map(chr, data))
@@ -129,43 +143,38 @@ class CHR6dmIMU(object):
         
         self.read_from_imu()
 
-    def read_from_imu(self):
-        # look for packet prefix 'snp'
-        skipped_bytes = 0
+    def read_packet(self):
+        """
+        Returns the next (command, payload) packet with a valid checksum or None
+        if the IMU stays silent or only sends garbage.
+        """
+        skipped_bytes = self.decoder.skipped_bytes
         
-        while skipped_bytes < MAX_BYTES_SKIPPED:
-            if self.ser.read() != 's': skipped_bytes += 1
-            else: break
-        else:
-            print 'Unable to find packet prefix. Throw exception.'
-            return
+        while not self.packets:
+            chunk = self.ser.read(max(1, self.ser.inWaiting()))
+            
+            if not chunk:
+                return None
+                
+            self.packets.extend(self.decoder.feed(chunk))
             
-        packet = 's' + self.ser.read(2) # read 'n' and 'p'
+            if not self.packets and self.decoder.skipped_bytes - skipped_bytes >= MAX_BYTES_SKIPPED:
+                print 'Unable to find packet prefix. Throw exception.'
+                return None
+                
+        return self.packets.popleft()
+
+    def read_from_imu(self):
+        packet = self.read_packet()
         
-        if packet != 'snp':
-            print "Received corrupted packet, prefix was %s" % packet
+        if packet is None:
             return
             
-        command = ord(self.ser.read())
-        n = ord(self.ser.read())
-        
-        dataStr = self.ser.read(n)
-        data = map(b2a_hex, dataStr)
-        data = map(int, data, [16] * len(data))
+        command, dataStr = packet
+        data = map(ord, dataStr)
         
         # print "Received reply: %s (%s), data: %s" % (CODE_TO_STR[command], hex(command).upper(), str(data))
         
-        chkSumStr = self.ser.read(2)
-        chkSumData = map(b2a_hex, chkSumStr)
-        chkSumData = map(int, chkSumData, [16] * len(chkSumData))
-        chkSumRx = (chkSumData[0] << 8) | chkSumData[1]
-        
-        chkSum = self.calculate_checksum(command, data)
-        
-        if chkSumRx != chkSum:
-            print "Checksums don't match %d != %d" % (chkSumRx, chkSum)
-            return
-            
         if command == COMMAND_COMPLETE:
             print 'Command %s (%s) complete' % (CODE_TO_STR[data[0]], hex(data[0]).upper())
         elif command == COMMAND_FAILED:
@@ -193,115 +202,8 @@ class CHR6dmIMU(object):
             if data[0] & 0x01:
                 print 'FAILED self-test: accel_x'
         elif command == SENSOR_DATA:
-            self.imu_data['timestamp'] = time.time()
-            active_channels = (data[0] << 8) | data[1]
-            
-            i = 2
-            
-            # yaw angle
-            if active_channels & 0x8000:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['yaw'] = value[0] * SCALE_YAW * DEG_TO_RAD
-                #print 'yaw = %f' % self.imu_data['yaw']
-                i += 2
-                
-            # pitch angle
-            if active_channels & 0x4000:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['pitch'] = value[0] * SCALE_PITCH * DEG_TO_RAD
-                #print 'pitch = %f' % self.imu_data['pitch']
-                i += 2
-                
-            # roll angle
-            if active_channels & 0x2000:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['roll'] = value[0] * SCALE_ROLL * DEG_TO_RAD
-                #print 'roll = %f' % self.imu_data['roll']
-                i += 2
-                
-            # yaw rate
-            if active_channels & 0x1000:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['yaw_rate'] = value[0] * SCALE_YAW_RATE * DEG_TO_RAD
-                #print 'yaw_rate = %f' % self.imu_data['yaw_rate']
-                i += 2
-                
-            # pitch rate
-            if active_channels & 0x0800:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['pitch_rate'] = value[0] * SCALE_PITCH_RATE * DEG_TO_RAD
-                #print 'pitch_rate = %f' % self.imu_data['pitch_rate']
-                i += 2
-                
-            # roll rate
-            if active_channels & 0x0400:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['roll_rate'] = value[0] * SCALE_ROLL_RATE * DEG_TO_RAD
-                #print 'roll_rate = %f' % self.imu_data['roll_rate']
-                i += 2
-                
-            # mag X
-            if active_channels & 0x0200:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['mag_x'] = value[0] * SCALE_MAG_X
-                #print 'mx = %f' % self.imu_data['mag_x']
-                i += 2
-                
-            # mag Y
-            if active_channels & 0x0100:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['mag_y'] = value[0] * SCALE_MAG_Y
-                #print 'my = %f' % self.imu_data['mag_y']
-                i += 2
-                
-            # mag Z
-            if active_channels & 0x0080:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['mag_z'] = value[0] * SCALE_MAG_Z
-                #print 'mz = %f' % self.imu_data['mag_z']
-                i += 2
-                
-            # gyro X
-            if active_channels & 0x0040:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['gyro_x'] = value[0] * SCALE_GYRO_X * DEG_TO_RAD
-                #print 'gx = %f' % self.imu_data['gyro_x']
-                i += 2
-                
-            # gyro Y
-            if active_channels & 0x0020:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['gyro_y'] = value[0] * SCALE_GYRO_Y * DEG_TO_RAD
-                #print 'gy = %f' % self.imu_data['gyro_y']
-                i += 2
-                
-            # gyro Z
-            if active_channels & 0x0010:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['gyro_z'] = value[0] * SCALE_GYRO_Z * DEG_TO_RAD
-                #print 'gz = %f' % self.imu_data['gyro_z']
-                i += 2
-                
-            # accel X
-            if active_channels & 0x0008:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['accel_x'] = value[0] * SCALE_ACCEL_X * MILIG_TO_MSS
-                #print 'ax = %f' % self.imu_data['accel_x']
-                i += 2
-                
-            # accel Y
-            if active_channels & 0x0004:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['accel_y'] = value[0] * SCALE_ACCEL_Y * MILIG_TO_MSS
-                #print 'ay = %f' % self.imu_data['accel_y']
-                i += 2
-                
-            # accel Z
-            if active_channels & 0x0002:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['accel_z'] = value[0] * SCALE_ACCEL_Z * MILIG_TO_MSS
-                #print 'az = %f' % self.imu_data['accel_z']
-                i += 2
+            res = self.decoder.decode_sensor_data(dataStr)
+            if res: self.imu_data.update(res)
         elif command == GYRO_BIAS_REPORT:
             value = struct.unpack('>h', dataStr[0] + dataStr[1])
             gyro_z_bias = value[0] * SCALE_GYRO_Z * DEG_TO_RAD
@@ -557,6 +459,9 @@ class CHR6dmIMU(object):
         high_byte = int(high_byte, 2)
         low_byte = int(low_byte, 2)
         
+        # compile the SENSOR_DATA layout for these channels up front
+        self.decoder.layout((high_byte << 8) | low_byte)
+        
         self.write_to_imu(SET_ACTIVE_CHANNELS, (high_byte, low_byte))
 
     def set_silent_mode(self):
@@ -914,117 +819,17 @@ class CHR6dmIMU(object):
         self.set_active_channels(ch)
 
     def read_accel_angrate_orientation(self):
-        # look for packet prefix 'snp'
-        while self.ser.read() != 's':
-            print "looking for packet prefix 'snp'"
-        packet = 's' + self.ser.read(2) # read 'n' and 'p'
-        
-        if packet != 'snp':
-            print "Received corrupted packet, prefix was %s" % packet
-            return
-
-        command = ord(self.ser.read())
-        #print "packet type = %s" % hex(command).upper()
-
-        n = ord(self.ser.read())
-        #print "data bytes = %d" % n
-
-        dataStr = self.ser.read(n)
-        data = map(b2a_hex, dataStr)
-        data = map(int, data, [16] * len(data))
-        #print data
-
-        chkSumStr = self.ser.read(2)
-        chkSumData = map(b2a_hex, chkSumStr)
-        chkSumData = map(int, chkSumData, [16] * len(chkSumData))
-        chkSumRx = (chkSumData[0] << 8) | chkSumData[1]
-
-        chkSum = self.calculate_checksum(command, data)
+        packet = self.read_packet()
         
-        if chkSumRx != chkSum:
-            print "Checksums don't match %d != %d" % (chkSumRx, chkSum)
-            return
-
+        if packet is None:
+            return {}
+            
+        command, dataStr = packet
         res = {}
-
+        
         if command == SENSOR_DATA:
-            res['timestamp'] = time.time()
-            active_channels = (data[0] << 8) | data[1]
-            
-            i = 2
-            
-            # yaw angle
-            if active_channels & 0x8000:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                yaw = value[0] * SCALE_YAW * DEG_TO_RAD
-                #print 'yaw = %f' % yaw
-                res['yaw'] = yaw
-                i += 2
-            
-            # pitch angle
-            if active_channels & 0x4000:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                pitch = value[0] * SCALE_PITCH * DEG_TO_RAD
-                #print 'pitch = %f' % pitch
-                res['pitch'] = pitch
-                i += 2
+            res = self.decoder.decode_sensor_data(dataStr) or {}
             
-            # roll angle
-            if active_channels & 0x2000:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                roll = value[0] * SCALE_ROLL * DEG_TO_RAD
-                #print 'roll = %f' % roll
-                res['roll'] = roll
-                i += 2
-            
-            # yaw rate
-            if active_channels & 0x1000:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                yaw_rate = value[0] * SCALE_YAW_RATE * DEG_TO_RAD
-                #print 'yaw_rate = %f' % yaw_rate
-                res['yaw_rate'] = yaw_rate
-                i += 2
-            
-            # pitch rate
-            if active_channels & 0x0800:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                pitch_rate = value[0] * SCALE_PITCH_RATE * DEG_TO_RAD
-                #print 'pitch_rate = %f' % pitch_rate
-                res['pitch_rate'] = pitch_rate
-                i += 2
-            
-            # roll rate
-            if active_channels & 0x0400:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                roll_rate = value[0] * SCALE_ROLL_RATE * DEG_TO_RAD
-                #print 'roll_rate = %f' % roll_rate
-                res['roll_rate'] = roll_rate
-                i += 2
-
-            # accel X
-            if active_channels & 0x0008:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                ax = value[0] * SCALE_ACCEL_X * MILIG_TO_MSS
-                #print 'ax = %f' % ax
-                res['accel_x'] = ax
-                i += 2
-            
-            # accel Y
-            if active_channels & 0x0004:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                ay = value[0] * SCALE_ACCEL_Y * MILIG_TO_MSS
-                #print 'ay = %f' % ay
-                res['accel_y'] = ay
-                i += 2
-            
-            # accel Z
-            if active_channels & 0x0002:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                az = value[0] * SCALE_ACCEL_Z * MILIG_TO_MSS
-                #print 'az = %f' % az
-                res['accel_z'] = az
-                i += 2
-                
         return res
 
 if __name__ == "__main__":
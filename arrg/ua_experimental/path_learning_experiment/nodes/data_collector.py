@@ -15,83 +15,100 @@ from actionlib_msgs.msg import GoalStatusArray
 from nav_msgs.msg import Path
 from path_learning_experiment.msg import DistanceInfo
 
-import random
+import os
 import math
+import threading
+from Queue import Queue, Full
 
-import matplotlib.pyplot as plt
+import numpy as np
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from path_learning_experiment.episode_store import EpisodeStore
+from path_learning_experiment.episode_store import read_episode
+from path_learning_experiment.episode_store import time_slice
 
 def dist(x1, y1, x2, y2):
        return math.sqrt(math.pow(x2-x1,2) + math.pow(y2-y1,2))
 
 class Episode():
-    def __init__(self, plan_waypoints, actual_waypoints, distances):
-        #self.goal_x = goal_pos.position.x
-        #self.goal_y = goal_pos.position.y
-        #self.start_x = start_pos.position.x
-        #self.start_y = start_pos.position.y
+    def __init__(self, episode):
+        plan = episode['plan']
+        actual = episode['actual']
+        distance = episode['distance']
         
         # TODO: record episode status
         self.success = False
-        self.planned_x = []
-        self.planned_y = []
+        self.planned_x = plan['x']
+        self.planned_y = plan['y']
         
-        for waypoint in plan_waypoints:
-            self.planned_x += [waypoint.position.x]
-            self.planned_y += [waypoint.position.y]
-            
         # Hack, this should really come from the actual goal 
         self.goal_x = self.planned_x[-1]
         self.goal_y = self.planned_y[-1]
         
-        self.dist_t = []
-        self.dist_value = []
-        self.start_time = actual_waypoints[0].header.stamp
-        self.end_time = actual_waypoints[-1].header.stamp
-        
-        self.current_x = []
-        self.current_y = []
-        
-        for waypoint in actual_waypoints:
-            self.current_x += [waypoint.pose.position.x]
-            self.current_y += [waypoint.pose.position.y]    
-            self.dist_t += [(waypoint.header.stamp - self.start_time).to_sec()]
-            self.dist_value += [dist(self.current_x[-1], self.current_y[-1], self.goal_x, self.goal_y)]
-        
-        self.scan_t = []
-        self.scan_min = []
-        
-        for d in distances:
-            if d.header.stamp >= self.start_time and d.header.stamp <= self.end_time:
-                self.scan_t += [(d.header.stamp - self.start_time).to_sec()]
-                self.scan_min += [d.min_dist]
-                
-    def plot(self):
-        t = rospy.Time.now()
-        
-        plt.clf()
-        plt.subplot(211)
-        plt.plot(self.planned_x, self.planned_y, 'bo', label='Planned path')
-        plt.plot(self.current_x, self.current_y, 'gv', label='Actual path')
-        plt.axis([-3.5,3.5,-2.5,2.5])
-        plt.xlabel('Distance from x origin [m]')
-        plt.ylabel('Distance from y origin [m]')
-        plt.title('Planned vs. actual path')
-        plt.legend(loc=0)
-#        plt.draw()
-#        plt.savefig(str(t) + '-image.png')
-        
-#        plt.clf()
-        plt.subplot(212)
-        plt.plot(self.dist_t, self.dist_value, label='Distance to goal')
-        plt.plot(self.scan_t, self.scan_min, 'r', label='Distance to obstacle')
-        plt.axis(ymin=0.0, ymax=5.0)
-        plt.xlabel('Time')
-        plt.ylabel('Distance [m]')
-        plt.legend(loc=0)
-        
-        plt.draw()
-        plt.savefig(str(t) + '-plot.png')
-        #plt.show()
+        self.current_x = actual['x']
+        self.current_y = actual['y']
+        
+        self.start_time = actual['stamp'][0]
+        self.end_time = actual['stamp'][-1]
+        
+        self.dist_t = (actual['stamp'] - self.start_time) / 1e9
+        self.dist_value = np.hypot(self.goal_x - self.current_x, self.goal_y - self.current_y)
+        
+        during = time_slice(distance['stamp'], self.start_time, self.end_time)
+        self.scan_t = (distance['stamp'][during] - self.start_time) / 1e9
+        self.scan_min = distance['min_dist'][during]
+        
+    def plot(self, fname):
+        # a figure of its own instead of pyplot's global one, so plotting
+        # is safe outside of the main thread
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        
+        ax = fig.add_subplot(211)
+        ax.plot(self.planned_x, self.planned_y, 'bo', label='Planned path')
+        ax.plot(self.current_x, self.current_y, 'gv', label='Actual path')
+        ax.axis([-3.5,3.5,-2.5,2.5])
+        ax.set_xlabel('Distance from x origin [m]')
+        ax.set_ylabel('Distance from y origin [m]')
+        ax.set_title('Planned vs. actual path')
+        ax.legend(loc=0)
+        
+        ax = fig.add_subplot(212)
+        ax.plot(self.dist_t, self.dist_value, label='Distance to goal')
+        ax.plot(self.scan_t, self.scan_min, 'r', label='Distance to obstacle')
+        ax.set_ylim(0.0, 5.0)
+        ax.set_xlabel('Time')
+        ax.set_ylabel('Distance [m]')
+        ax.legend(loc=0)
+        
+        fig.savefig(fname)
+
+class EpisodePlotter(threading.Thread):
+    """
+    Plots finished episodes off the ROS callback threads.
+    """
+    def __init__(self, max_pending):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue = Queue(max_pending)
+        
+    def add(self, fname):
+        try:
+            self.queue.put_nowait(fname)
+        except Full:
+            rospy.logwarn('Plotter is falling behind, not plotting %s (its data is kept)' % fname)
+            
+    def run(self):
+        while True:
+            fname = self.queue.get()
+            try:
+                episode = read_episode(fname)
+                if len(episode['plan']['stamp']) and len(episode['actual']['stamp']):
+                    Episode(episode).plot(str(rospy.Time.now()) + '-plot.png')
+            except Exception, ex:
+                rospy.logerr('Failed to plot episode %s: %s' % (fname, ex))
 
 class DataCollector():
     def __init__(self):
@@ -101,12 +118,20 @@ class DataCollector():
         self.previous_success = True
         self.episodes = []
         self.goal_pos = None
-        self.plan_waypoints = []
-        self.actual_waypoints = []
-        self.distances = []
         
         rospy.init_node('data_collector', anonymous=True)
         
+        episode_dir = rospy.get_param('~episode_dir', os.path.join(os.getcwd(), 'episodes'))
+        buffer_size = rospy.get_param('~buffer_size', 4096)
+        max_pending_plots = rospy.get_param('~max_pending_plots', 10)
+        
+        # has the current episode received its plan yet
+        self.has_plan = False
+        self.store = EpisodeStore(episode_dir, buffer_size)
+        self.plotter = EpisodePlotter(max_pending_plots)
+        self.plotter.start()
+        rospy.on_shutdown(self.store.close)
+        
         rospy.Subscriber('move_base_simple/goal', PoseStamped, self.handle_goal)
         rospy.Subscriber('move_base/feedback', MoveBaseActionFeedback, self.handle_feedback)
         rospy.Subscriber('move_base/status', GoalStatusArray, self.handle_status)
@@ -114,12 +139,10 @@ class DataCollector():
         rospy.Subscriber('dist_info', DistanceInfo, self.handle_dist)
         
     def save_episode(self):
-        e = Episode(self.plan_waypoints, self.actual_waypoints, self.distances)
-        self.episodes += [e]
-        self.plan_waypoints = []
-        self.actual_waypoints = []
-        self.distances = []
-        e.plot()
+        fname, count = self.store.next_episode()
+        self.has_plan = False
+        self.episodes += [fname]
+        self.plotter.add(fname)
         
     def handle_goal(self, msg):
         self.goal_pos = msg.pose
@@ -129,16 +152,19 @@ class DataCollector():
             curr_status = msg.status_list[0].status
             
     def handle_feedback(self, msg):
-        self.actual_waypoints += [msg.feedback.base_position]
+        pose = msg.feedback.base_position
+        self.store.record('actual', pose.header.stamp.to_nsec(), pose.pose.position.x, pose.pose.position.y)
         
     def handle_plan(self, msg):
-        if self.plan_waypoints:
+        if self.has_plan:
             self.save_episode()
+        stamp = msg.header.stamp.to_nsec()
         for pose_stamped in msg.poses:
-            self.plan_waypoints += [pose_stamped.pose]
+            self.store.record('plan', stamp, pose_stamped.pose.position.x, pose_stamped.pose.position.y)
+        self.has_plan = self.has_plan or len(msg.poses) > 0
         
     def handle_dist(self, msg):
-        self.distances += [msg]
+        self.store.record('distance', msg.header.stamp.to_nsec(), msg.min_dist, msg.avg_dist, msg.front_dist)
 
 if __name__ == '__main__':
     try:
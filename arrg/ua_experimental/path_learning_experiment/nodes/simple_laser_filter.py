@@ -9,9 +9,8 @@ import rospy
 from sensor_msgs.msg import LaserScan
 from std_msgs.msg import Float64
 from path_learning_experiment.msg import DistanceInfo
-
-import time
-import numpy
+from path_learning_experiment.scan_stats import ScanStatistics
+from path_learning_experiment.scan_stats import index_sector
 
 class SimpleLaserFilter():
     def __init__(self):
@@ -22,20 +21,26 @@ class SimpleLaserFilter():
 
         rospy.init_node('simple_laser_filter', anonymous=True)
 
+        # front distance is the closest valid return among the center ray
+        # and front_half_width rays on either side of it
+        front_half_width = rospy.get_param('~front_half_width', 0)
+        
+        # exponential smoothing factor in (0, 1], 0 publishes raw values
+        smoothing = rospy.get_param('~smoothing', 0.0)
+        
+        self.scan_stats = ScanStatistics([index_sector('front', -front_half_width, front_half_width + 1)], smoothing=smoothing)
+
         rospy.Subscriber('scan', LaserScan, self.filter_scan)
 
     def filter_scan(self, scan):
+        stats = self.scan_stats.update(scan)
+        if self.scan_stats.smoothing: stats = self.scan_stats.smoothed
+        
         di = DistanceInfo()
         di.header = scan.header    
-        di.min_dist = numpy.min(scan.ranges)
-        num_scans = len(scan.ranges)
-        center_scan_index = (num_scans + 1) / 2
-        center_range = scan.ranges[center_scan_index]
-        di.front_dist = center_range
-        sum_dist = 0        
-        for dist in scan.ranges:
-            sum_dist += dist
-        di.avg_dist = sum_dist / num_scans 
+        di.min_dist = stats.get('min', float('inf'))
+        di.front_dist = stats.get('front_min', float('inf'))
+        di.avg_dist = stats.get('mean', float('nan'))
         self.dist_pub.publish(di)
 
 if __name__ == '__main__':
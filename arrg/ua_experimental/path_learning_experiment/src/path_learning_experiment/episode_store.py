@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+import os
+import threading
+
+import numpy
+
+
+# every stream of an episode with the names of its value columns
+STREAMS = (('plan', ('x', 'y')),
+           ('actual', ('x', 'y')),
+           ('distance', ('min_dist', 'avg_dist', 'front_dist')))
+
+STREAM_IDS = dict((name, idx) for idx, (name, columns) in enumerate(STREAMS))
+
+# one fixed size record per plan waypoint, feedback pose or distance
+# message, stamps are nanoseconds
+RECORD_DTYPE = numpy.dtype([('stream', numpy.uint8),
+                            ('stamp', numpy.int64),
+                            ('values', numpy.float64, (3,))])
+
+
+class EpisodeWriter():
+    """
+    Appends records to an episode file through a fixed size buffer, at most
+    buffer_size records are held in memory no matter how long the episode.
+    """
+    def __init__(self, fname, buffer_size=4096):
+        self.fname = fname
+        self.file = open(fname, 'ab')
+        self.buffer = numpy.zeros(buffer_size, dtype=RECORD_DTYPE)
+        self.size = 0
+        self.count = 0
+
+    def append(self, stream, stamp, *values):
+        record = self.buffer[self.size]
+        record['stream'] = STREAM_IDS[stream]
+        record['stamp'] = stamp
+        record['values'][:len(values)] = values
+        record['values'][len(values):] = 0.0
+
+        self.size += 1
+        self.count += 1
+        if self.size == len(self.buffer): self.flush()
+
+    def flush(self):
+        if self.size:
+            self.buffer[:self.size].tofile(self.file)
+            self.file.flush()
+            self.size = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def read_episode(fname):
+    """
+    Returns a dict from stream name to a dict of its columns: stamp
+    (nanoseconds) and the stream's value columns, all numpy arrays in the
+    order they were recorded.
+    """
+    if os.path.getsize(fname) >= RECORD_DTYPE.itemsize:
+        records = numpy.memmap(fname, dtype=RECORD_DTYPE, mode='r')
+    else:
+        records = numpy.zeros(0, dtype=RECORD_DTYPE)
+
+    episode = {}
+
+    for name, columns in STREAMS:
+        selected = records[records['stream'] == STREAM_IDS[name]]
+        stream = {'stamp': numpy.array(selected['stamp'])}
+        for idx, column in enumerate(columns):
+            stream[column] = numpy.array(selected['values'][:,idx])
+        episode[name] = stream
+
+    return episode
+
+
+def time_slice(stamps, start, end):
+    """
+    Returns the slice of the (sorted) stamps that lie within [start, end].
+    """
+    lo = numpy.searchsorted(stamps, start, side='left')
+    hi = numpy.searchsorted(stamps, end, side='right')
+    return slice(lo, hi)
+
+
+class EpisodeStore():
+    """
+    Writes every episode into its own append-only file episode_NNNN.dat in
+    directory, numbering continues after the episodes already there.
+    Recording is safe from any number of subscriber threads.
+    """
+    def __init__(self, directory, buffer_size=4096):
+        self.directory = directory
+        self.buffer_size = buffer_size
+        self.lock = threading.Lock()
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        indices = [int(f[8:-4]) for f in os.listdir(directory)
+                   if f.startswith('episode_') and f.endswith('.dat') and f[8:-4].isdigit()]
+        self.next_index = max(indices) + 1 if indices else 0
+        self.writer = self.open_writer()
+
+    def open_writer(self):
+        fname = os.path.join(self.directory, 'episode_%04d.dat' % self.next_index)
+        self.next_index += 1
+        return EpisodeWriter(fname, self.buffer_size)
+
+    def record(self, stream, stamp, *values):
+        with self.lock:
+            self.writer.append(stream, stamp, *values)
+
+    def next_episode(self):
+        """
+        Closes the current episode file, starts the next one and returns the
+        name of the closed file and the number of records written to it.
+        """
+        with self.lock:
+            writer = self.writer
+            writer.close()
+            self.writer = self.open_writer()
+
+        return writer.fname, writer.count
+
+    def close(self):
+        with self.lock:
+            self.writer.close()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+import math
+
+import numpy
+
+
+def index_sector(name, start_offset, end_offset):
+    """
+    Rays center + start_offset up to (not including) center + end_offset,
+    where center is the (n + 1) / 2 ray of an n ray scan.
+    """
+    return ('index', name, start_offset, end_offset)
+
+
+def angle_sector(name, min_angle, max_angle):
+    """
+    Rays whose angle lies within [min_angle, max_angle] (radians, in the
+    laser frame).
+    """
+    return ('angle', name, min_angle, max_angle)
+
+
+class ScanStatistics():
+    """
+    Minimum, mean and number of valid returns of a sensor_msgs/LaserScan,
+    overall and for any number of sectors, from one numpy view of the ranges
+    per scan.
+
+    A return is valid if it is finite, within [range_min, range_max] of the
+    scan and, if given, greater than min_range. Statistics over no valid
+    returns are inf (minimum) and nan (mean).
+
+    Sector bounds are worked out once per scan geometry. Minima come from a
+    single minimum.reduceat over all sector bounds and means from the
+    cumulative sums of the masked ranges, so the cost per scan does not
+    grow with the number of sectors beyond a few array lookups.
+
+    With smoothing set to alpha in (0, 1], every statistic is also
+    exponentially smoothed across scans (smoothed = smoothed + alpha *
+    (value - smoothed)), statistics that are not finite in a scan leave
+    their smoothed value alone.
+    """
+    def __init__(self, sectors=(), min_range=None, smoothing=None):
+        self.sectors = list(sectors)
+        self.min_range = min_range
+        self.smoothing = smoothing
+
+        self.geometry = None
+        self.bounds = None
+        self.stats = {}
+        self.smoothed = {}
+
+    def sector_bounds(self, num_ranges, angle_min, angle_increment):
+        center = (num_ranges + 1) / 2
+        bounds = []
+
+        for kind, name, first, last in self.sectors:
+            if kind == 'index':
+                lo = center + first
+                hi = center + last
+            elif angle_increment > 0:
+                lo = int(math.ceil((first - angle_min) / angle_increment))
+                hi = int(math.floor((last - angle_min) / angle_increment)) + 1
+            else:
+                lo = hi = 0
+
+            lo = min(max(lo, 0), num_ranges)
+            hi = min(max(hi, lo), num_ranges)
+            bounds.append((lo, hi))
+
+        # whole scan first, then every sector
+        return numpy.array([(0, num_ranges)] + bounds, dtype=numpy.intp)
+
+    def update(self, scan):
+        """
+        Returns a dict with min, mean and count over the whole scan and
+        <sector>_min, <sector>_mean and <sector>_count for every sector.
+        """
+        ranges = numpy.asarray(scan.ranges, dtype=numpy.float64)
+        num_ranges = len(ranges)
+
+        geometry = (num_ranges, scan.angle_min, scan.angle_increment)
+        if geometry != self.geometry:
+            self.geometry = geometry
+            self.bounds = self.sector_bounds(*geometry)
+
+        # NaN returns fail every comparison, which is what we want
+        with numpy.errstate(invalid='ignore'):
+            valid = numpy.isfinite(ranges)
+            valid &= ranges >= scan.range_min
+            valid &= ranges <= scan.range_max
+            if self.min_range is not None: valid &= ranges > self.min_range
+
+        # one extra element so that bounds equal to num_ranges are valid
+        # reduceat indices
+        masked = numpy.empty(num_ranges + 1)
+        masked[:num_ranges] = numpy.where(valid, ranges, numpy.inf)
+        masked[num_ranges] = numpy.inf
+
+        sums = numpy.zeros(num_ranges + 1)
+        numpy.cumsum(numpy.where(valid, ranges, 0.0), out=sums[1:])
+        counts = numpy.zeros(num_ranges + 1, dtype=numpy.intp)
+        numpy.cumsum(valid, out=counts[1:])
+
+        lo = self.bounds[:,0]
+        hi = self.bounds[:,1]
+        count = counts[hi] - counts[lo]
+        minimum = numpy.minimum.reduceat(masked, self.bounds.ravel())[::2]
+        minimum[count == 0] = numpy.inf
+
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            mean = (sums[hi] - sums[lo]) / count
+
+        stats = {'min': minimum[0], 'mean': mean[0], 'count': int(count[0])}
+
+        for idx, (kind, name, first, last) in enumerate(self.sectors):
+            stats[name + '_min'] = minimum[idx+1]
+            stats[name + '_mean'] = mean[idx+1]
+            stats[name + '_count'] = int(count[idx+1])
+
+        self.stats = stats
+        if self.smoothing: self.smooth(stats)
+
+        return stats
+
+    def smooth(self, stats):
+        alpha = self.smoothing
+
+        for key, value in stats.items():
+            if not numpy.isfinite(value): continue
+
+            previous = self.smoothed.get(key)
+            if previous is None: self.smoothed[key] = float(value)
+            else: self.smoothed[key] = previous + alpha * (value - previous)
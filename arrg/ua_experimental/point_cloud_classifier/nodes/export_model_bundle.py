@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+
+import os
+import sys
+from optparse import OptionParser
+
+import roslib; roslib.load_manifest('point_cloud_classifier')
+
+from point_cloud_classifier.model_bundle import ModelBundle
+
+
+if __name__ == '__main__':
+    default_data_path = os.path.join(roslib.packages.get_pkg_dir('point_cloud_classifier'), 'data')
+    
+    parser = OptionParser(usage='Usage: %prog [options]')
+    parser.add_option('-d', '--data-path', metavar='DIR', default=default_data_path,
+                      help='directory with codebook.txt, mean.txt, std.txt, pcamean.txt, pcacomps.txt and dataTrain.txt [default: %default]')
+    parser.add_option('-o', '--output', metavar='FILE', default=None,
+                      help='bundle file to write [default: DIR/model.npz]')
+                      
+    (options, args) = parser.parse_args(sys.argv[1:])
+    bundle_file = options.output or os.path.join(options.data_path, 'model.npz')
+    
+    bundle = ModelBundle.from_text(options.data_path)
+    bundle.save(bundle_file)
+    
+    print 'Wrote %s: %d codewords, %d components, %d training histograms' % (bundle_file, len(bundle.code_book), len(bundle.pca_comps), len(bundle.train_data))
@@ -6,6 +6,8 @@ import matplotlib.pyplot
 import string
 import pdb
 import pickle
+from point_cloud_classifier.bag_of_words import BagOfWords
+from point_cloud_classifier.model_bundle import load_bundle, load_text_array
 
 def		run():
 #	pdb.set_trace();
@@ -13,12 +15,13 @@ def		run():
 	numCodeWords = 200;
 	#data loading and normalization
 	print 'loading data'
-	pcaMean  = loadtxt('pcamean.txt');
-	pcaComps = loadtxt('pcacomps.txt');
-	mean     = loadtxt('mean.txt');
-	std      = loadtxt('std.txt');
+	bundle   = load_bundle('model.npz', '.');
+	pcaMean  = bundle.pca_mean;
+	pcaComps = bundle.pca_comps;
+	mean     = bundle.mean;
+	std      = bundle.std;
 	
-	data = loadtxt('/home/mohsen/Downloads/shotFiles/shot.txt');
+	data = load_text_array('/home/mohsen/Downloads/shotFiles/shot.txt');
 #	mean = data.mean(axis=0);
 #	std = sqrt(data.var(axis=0));
 #	std [where(std==0)] = 1;
@@ -44,7 +47,8 @@ def		run():
 #	kmeans.fit(projection);
 #	codeBook = kmeans.cluster_centers_;
 #	savetxt('codebook.txt',codeBook)
- 	codeBook = loadtxt('codebook.txt');
+ 	codeBook = bundle.code_book;
+	bagOfWords = BagOfWords.from_bundle(bundle);
 	#building histogram for eahc object
 	print 'building histograms'
 	root = '/home/mohsen/Downloads/shotFiles/';
@@ -53,21 +57,12 @@ def		run():
 	target = [0];
 	for line in f:
 		shotFileName = root + line.replace('\n','');
-		objectFeatures = loadtxt(shotFileName);
+		objectFeatures = atleast_2d(load_text_array(shotFileName));
 		objectLabel = labelFromFileName(shotFileName);
 		if objectLabel==-1:
 			print 'Error: Cannot determine label from file name!!!'
 			return;
-		objectFeatures = objectFeatures - mean;
-		objectFeatures = objectFeatures / std;
-		#objectPca = pca.transform(objectFeatures);
-		temp = objectFeatures - pcaMean;
-		objectPca = dot(temp, pcaComps.T);
-		objectHist = zeros((1,shape(codeBook)[0]));
-		for idx in range(shape(objectPca)[0]):
-			dist = sum( (codeBook - objectPca[idx,:])**2 , axis=1 );
-			objectHist[0,argmin(dist)] = objectHist[0,argmin(dist)] + 1;
-		objectHist = objectHist / sum(objectHist);
+		objectHist = bagOfWords.histograms(objectFeatures, [shape(objectFeatures)[0]]);
 		data = concatenate((data,objectHist),axis=0);
 		target.append(objectLabel);
 #	pdb.set_trace();	
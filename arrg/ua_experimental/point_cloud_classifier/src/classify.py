@@ -5,7 +5,12 @@ import rospy
 from point_cloud_classifier.srv import GetClusterLabels
 from point_cloud_classifier.srv import GetClusterLabelsResponse
 from point_cloud_classifier.srv import ExtractSHOTDescriptor
-from sklearn import decomposition,neighbors
+from point_cloud_classifier.srv import ExtractSHOTDescriptors
+from point_cloud_classifier.bag_of_words import BagOfWords
+from point_cloud_classifier.bag_of_words import LabelCache
+from point_cloud_classifier.bag_of_words import cloud_key
+from point_cloud_classifier.model_bundle import NeighborIndex
+from point_cloud_classifier.model_bundle import load_bundle
 from numpy import *
 import os
 
@@ -30,15 +35,18 @@ class ClusterClassification:
         default_data_path = os.path.join(roslib.packages.get_pkg_dir('point_cloud_classifier'), 'data')
         data_path = rospy.get_param('data_path', default_data_path)
         
-        rospy.loginfo('Loading codebook...')
-        self.code_book = loadtxt(os.path.join(data_path, 'codebook.txt'))
+        # codebook, normalization, PCA and training data in one binary file,
+        # exported from the text files above whenever they are newer
+        bundle_file = rospy.get_param('model_bundle', os.path.join(data_path, 'model.npz'))
         
-        # PCA
-        rospy.loginfo('Loading PCA data...')
-        self.pca_mean  = loadtxt(os.path.join(data_path, 'pcamean.txt'))
-        self.pca_comps = loadtxt(os.path.join(data_path, 'pcacomps.txt'))
-        self.mean      = loadtxt(os.path.join(data_path, 'mean.txt'))
-        self.std       = loadtxt(os.path.join(data_path, 'std.txt'))
+        rospy.loginfo('Loading model bundle %s...' % bundle_file)
+        bundle = load_bundle(bundle_file, data_path)
+        
+        self.code_book = bundle.code_book
+        self.pca_mean  = bundle.pca_mean
+        self.pca_comps = bundle.pca_comps
+        self.mean      = bundle.mean
+        self.std       = bundle.std
         
 #        data = loadtxt('shot.txt')
 #        mean = data.mean(axis=0)
@@ -54,15 +62,26 @@ class ClusterClassification:
 #        self.pca  = pca
         
         # KNN
-        rospy.loginfo('Loading training data...')
-        trainData = loadtxt(os.path.join(data_path, 'dataTrain.txt'))
-        rospy.loginfo('Training KNN...')
-        self.knn = neighbors.KNeighborsClassifier(1)
-        self.knn.fit(trainData[:,:-1], trainData[:,-1])
-        del trainData
+        if not len(bundle.train_data):
+            rospy.logwarn('Model bundle %s has no training data' % bundle_file)
+            
+        self.knn = NeighborIndex(bundle.train_data, bundle.train_labels, bundle.train_norms)
+        self.bag_of_words = BagOfWords.from_bundle(bundle)
+        
+        # state machines keep asking about the same clusters, labels are
+        # remembered by cluster content
+        self.label_cache = LabelCache(rospy.get_param('label_cache_size', 256))
         
         rospy.wait_for_service('extract_shot_descriptor')
-        self.extract_shot_features_srv = rospy.ServiceProxy('extract_shot_descriptor', ExtractSHOTDescriptor)
+        self.extract_shot_features_srv = rospy.ServiceProxy('extract_shot_descriptor', ExtractSHOTDescriptor, persistent=True)
+        
+        try:
+            rospy.wait_for_service('extract_shot_descriptors', timeout=1.0)
+            self.extract_shot_batch_srv = rospy.ServiceProxy('extract_shot_descriptors', ExtractSHOTDescriptors, persistent=True)
+        except rospy.ROSException:
+            rospy.logwarn('extract_shot_descriptors service is not available, will extract descriptors one cluster at a time')
+            self.extract_shot_batch_srv = None
+            
         rospy.loginfo('Classification node initialization done')
         
         rospy.Service('get_cluster_labels', GetClusterLabels, self.get_cluster_labels)
@@ -72,44 +91,101 @@ class ClusterClassification:
         res = GetClusterLabelsResponse()
         clusters = req.clusters
         
-        for idx,point_cloud in enumerate(clusters):
+        keys = [cloud_key(point_cloud) for point_cloud in clusters]
+        labels = [self.label_cache.get(key) for key in keys]
+        
+        # classify every cluster that is not cached yet once, in one batch
+        todo = {}
+        for idx,key in enumerate(keys):
+            if labels[idx] is None and key not in todo: todo[key] = idx
+            
+        if todo:
             try:
-                label = self.classify(point_cloud)
-                res.labels.append(label)
+                new_labels = self.classify_all([clusters[idx] for idx in todo.values()])
             except Exception as e:
-                label = 'Unknown'
                 rospy.logerr('classification failed: %s' % e)
+                new_labels = [None] * len(todo)
+                
+            for key,label in zip(todo.keys(), new_labels):
+                if label is not None: self.label_cache.put(key, label)
                 
+            classified = dict(zip(todo.keys(), new_labels))
+            labels = [label if label is not None else classified[key] for key,label in zip(keys, labels)]
+            
+        for idx,label in enumerate(labels):
+            if label is None: label = 'Unknown'
+            res.labels.append(label)
             rospy.loginfo('labeled object %d with %s category' % (idx, label))
             
         return res
 
-    def classify(self, point_cloud):
-        res = self.extract_shot_features_srv(point_cloud)
-        num_features = res.num_features
-        feature_size = res.feature_size
-        shot_features = res.shot_feature
-        rospy.loginfo('successfully extarcted shot features')
-        
-        shot_features = reshape(shot_features, (num_features, feature_size))
-        shot_features = shot_features - self.mean
-        shot_features = shot_features / self.std
-        
-        #pca transform
-        temp = shot_features - self.pca_mean
-        objectPca = dot(temp, self.pca_comps.T)
-#        objectPca = self.pca.transform(shot_features)
-        objectHist = zeros((self.code_book.shape[0]))
-        
-        for i in range(objectPca.shape[0]):
-            dist = sum( (self.code_book - objectPca[i,:])**2 , axis=1 )
-            objectHist[argmin(dist)] = objectHist[argmin(dist)] + 1
+    def call_persistent(self, proxy, *args):
+        # a persistent connection that went down is re-established once,
+        # errors raised by the service itself are not retried
+        try:
+            return proxy(*args)
+        except rospy.ServiceException as e:
+            if 'responded with an error' in str(e): raise
+            proxy.close()
+            return proxy(*args)
+
+    def extract_descriptors(self, point_clouds):
+        """
+        Returns the SHOT descriptors of all point clouds one after another
+        and the number of descriptors of every cloud.
+        """
+        feature_size = len(self.mean)
+        
+        if self.extract_shot_batch_srv is not None:
+            try:
+                res = self.call_persistent(self.extract_shot_batch_srv, point_clouds)
+                if res.feature_size: feature_size = res.feature_size
+                features = reshape(res.shot_feature, (-1, feature_size))
+                return features, array(res.num_features)
+            except rospy.ServiceException as e:
+                # one bad cluster fails the whole batch, one at a time only
+                # that cluster goes without a label
+                rospy.logwarn('batch shot descriptor extraction failed, extracting one cluster at a time: %s' % e)
+                
+        features = []
+        counts = zeros(len(point_clouds), dtype=int)
+        
+        for idx,point_cloud in enumerate(point_clouds):
+            try:
+                res = self.call_persistent(self.extract_shot_features_srv, point_cloud)
+            except Exception as e:
+                rospy.logerr('shot descriptor extraction failed: %s' % e)
+                continue
+                
+            features.append(reshape(res.shot_feature, (res.num_features, res.feature_size)))
+            counts[idx] = res.num_features
             
-        objectHist = objectHist / objectHist.sum()
-        idx = self.knn.predict(objectHist)[0]
+        if features: return vstack(features), counts
+        else: return zeros((0, feature_size)), counts
+
+    def classify_all(self, point_clouds):
+        """
+        Returns a label for every point cloud, None for clouds that have no
+        descriptors.
+        """
+        features, counts = self.extract_descriptors(point_clouds)
+        rospy.loginfo('successfully extracted shot features of %d clusters' % len(point_clouds))
+        
+        hists = self.bag_of_words.histograms(features, counts)
+        labels = [None] * len(point_clouds)
+        described = flatnonzero(counts > 0)
         
-        if idx in self.index_to_label: return self.index_to_label[idx]
-        else: return 'Unknown'
+        if len(described):
+            for idx,category in zip(described, self.knn.predict(hists[described])):
+                if category in self.index_to_label: labels[idx] = self.index_to_label[category]
+                else: labels[idx] = 'Unknown'
+                
+        return labels
+
+    def classify(self, point_cloud):
+        label = self.classify_all([point_cloud])[0]
+        if label is None: raise ValueError('no shot descriptors for point cloud')
+        return label
 
 
 if __name__ == '__main__':
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+import hashlib
+
+from collections import OrderedDict
+
+import numpy as np
+
+from point_cloud_classifier.model_bundle import fold_projection
+
+
+class BagOfWords:
+    """
+    Turns the SHOT descriptors of point clouds into normalized codeword
+    histograms, the same ones classify.py used to build one descriptor at a
+    time, for any number of clouds at once.
+    
+    Descriptors are normalized and PCA projected with one folded affine map
+    (see model_bundle.fold_projection) as a single matrix, then
+    matched against all codewords in one matrix product using squared
+    distances expanded as |c|^2 - 2 c.x with the codeword norms computed
+    once. Descriptors whose two closest codewords are too close to call in
+    that form are re-checked with the direct difference.
+    """
+    def __init__(self, code_book, mean, std, pca_mean, pca_comps, max_batch_bytes=1<<25):
+        self.code_book = np.asarray(code_book, dtype=np.float64)
+        self.code_norms = (self.code_book ** 2).sum(axis=1)
+        self.mean = mean
+        self.std = std
+        self.pca_mean = pca_mean
+        self.pca_comps = pca_comps
+        self.projection, self.offset = fold_projection(mean, std, pca_mean, pca_comps)
+        self.max_batch_bytes = max_batch_bytes
+        
+    @staticmethod
+    def from_bundle(bundle, max_batch_bytes=1<<25):
+        bag_of_words = BagOfWords(bundle.code_book, bundle.mean, bundle.std, bundle.pca_mean, bundle.pca_comps, max_batch_bytes)
+        bag_of_words.code_norms = bundle.code_norms
+        bag_of_words.projection = bundle.projection
+        bag_of_words.offset = bundle.offset
+        return bag_of_words
+        
+    @property
+    def num_words(self):
+        return len(self.code_book)
+        
+    def project(self, features):
+        return np.dot(features, self.projection) + self.offset
+        
+    def quantize(self, projected):
+        """
+        Returns the index of the closest codeword for every row of projected.
+        """
+        result = np.empty(len(projected), dtype=np.intp)
+        batch = max(1, self.max_batch_bytes // (8 * self.num_words))
+        
+        for start in xrange(0, len(projected), batch):
+            x = projected[start:start+batch]
+            dist = self.code_norms - 2 * np.dot(x, self.code_book.T)
+            best = np.argmin(dist, axis=1)
+            
+            if self.num_words > 1:
+                nearest_two = np.partition(dist, 1, axis=1)[:,:2]
+                scale = self.code_norms.max() + (x ** 2).sum(axis=1)
+                close = np.flatnonzero(nearest_two[:,1] - nearest_two[:,0] <= 1e-9 * scale)
+                
+                for row in close:
+                    best[row] = np.argmin(((self.code_book - x[row]) ** 2).sum(axis=1))
+                    
+            result[start:start+len(x)] = best
+            
+        return result
+        
+    def histograms(self, features, counts):
+        """
+        features holds the descriptors of all clouds one after another,
+        counts[i] of them belong to cloud i. Returns one normalized histogram
+        per cloud (all zeros for clouds without descriptors).
+        """
+        counts = np.asarray(counts, dtype=np.intp)
+        hists = np.zeros((len(counts), self.num_words))
+        if not counts.sum(): return hists
+        
+        words = self.quantize(self.project(features))
+        owners = np.repeat(np.arange(len(counts)), counts)
+        hists = np.bincount(owners * self.num_words + words, minlength=len(counts) * self.num_words)
+        hists = hists.reshape(len(counts), self.num_words).astype(np.float64)
+        
+        nonempty = counts > 0
+        hists[nonempty] /= hists[nonempty].sum(axis=1)[:,np.newaxis]
+        
+        return hists
+
+
+def cloud_key(point_cloud):
+    """
+    Content hash of the points of a sensor_msgs/PointCloud, SHOT descriptors
+    only depend on the xyz coordinates.
+    """
+    xyz = np.array([(p.x, p.y, p.z) for p in point_cloud.points], dtype=np.float32)
+    return hashlib.sha1(xyz.tostring()).hexdigest()
+
+
+class LabelCache:
+    """
+    Least recently used map from cloud_key to label.
+    """
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.labels = OrderedDict()
+        
+    def get(self, key):
+        label = self.labels.pop(key, None)
+        if label is not None: self.labels[key] = label
+        return label
+        
+    def put(self, key, label):
+        self.labels.pop(key, None)
+        self.labels[key] = label
+        
+        while len(self.labels) > self.max_size:
+            self.labels.popitem(last=False)
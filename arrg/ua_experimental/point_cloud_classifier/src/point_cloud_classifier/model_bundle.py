@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+import os
+
+import numpy as np
+
+
+BUNDLE_VERSION = 1
+
+# text files the bundle is exported from, relative to the data directory
+TEXT_FILES = {
+    'code_book': 'codebook.txt',
+    'pca_mean':  'pcamean.txt',
+    'pca_comps': 'pcacomps.txt',
+    'mean':      'mean.txt',
+    'std':       'std.txt',
+    'train':     'dataTrain.txt',
+}
+
+
+def atomic_write(fname, write):
+    """
+    Calls write with a file open for writing and renames the result to
+    fname, readers see either the old file or the complete new one.
+    """
+    tmp_fname = '%s.%d.tmp' % (fname, os.getpid())
+    f = open(tmp_fname, 'wb')
+    try:
+        write(f)
+    finally:
+        f.close()
+    os.rename(tmp_fname, fname)
+
+
+def load_text_array(fname):
+    """
+    numpy.loadtxt with a binary cache: the parsed array is saved next to the
+    text file as <fname>.npy and used for as long as it is newer than the
+    text file.
+    """
+    cache_fname = fname + '.npy'
+    
+    if os.path.exists(cache_fname) and os.path.getmtime(cache_fname) >= os.path.getmtime(fname):
+        return np.load(cache_fname)
+        
+    data = np.loadtxt(fname)
+    
+    # the cache is only an optimization, a read-only data dir just means
+    # parsing the text again next time
+    try:
+        atomic_write(cache_fname, lambda f: np.save(f, data))
+    except (IOError, OSError):
+        pass
+        
+    return data
+
+
+def fold_projection(mean, std, pca_mean, pca_comps):
+    """
+    Folds normalization and PCA, dot((x - mean) / std - pca_mean, pca_comps.T),
+    into one affine map dot(x, projection) + offset.
+    """
+    projection = (pca_comps / std).T
+    offset = -np.dot(mean / std + pca_mean, pca_comps.T)
+    return projection, offset
+
+
+class ModelBundle:
+    """
+    Everything the classifier needs, as plain arrays in one uncompressed
+    .npz file: normalization and PCA parameters (and the folded projection),
+    the codebook with its squared norms and the training histograms with
+    their labels and squared norms, i.e. the 1-NN index.
+    """
+    def __init__(self, arrays):
+        version = int(arrays['version'])
+        if version != BUNDLE_VERSION:
+            raise ValueError('model bundle version %d, expected %d' % (version, BUNDLE_VERSION))
+            
+        for name, value in arrays.items():
+            setattr(self, name, value)
+            
+    @staticmethod
+    def from_text(data_path):
+        """
+        Builds a bundle from the text files in data_path.
+        """
+        text = {}
+        
+        for name, fname in TEXT_FILES.items():
+            fname = os.path.join(data_path, fname)
+            if name != 'train' or os.path.exists(fname): text[name] = np.loadtxt(fname)
+            
+        # offline experiments only need the projection and the codebook, a
+        # bundle without training histograms has an empty index
+        num_words = len(text['code_book'])
+        train = np.atleast_2d(text.pop('train', np.zeros((0, num_words + 1))))
+        
+        projection, offset = fold_projection(text['mean'], text['std'], text['pca_mean'], text['pca_comps'])
+        
+        arrays = dict(text)
+        arrays.update(version=BUNDLE_VERSION,
+                      projection=projection,
+                      offset=offset,
+                      code_norms=(text['code_book'] ** 2).sum(axis=1),
+                      train_data=np.ascontiguousarray(train[:,:-1]),
+                      train_labels=train[:,-1],
+                      train_norms=(train[:,:-1] ** 2).sum(axis=1))
+                      
+        return ModelBundle(arrays)
+        
+    @staticmethod
+    def load(fname):
+        data = np.load(fname)
+        arrays = dict((name, data[name]) for name in data.files)
+        data.close()
+        return ModelBundle(arrays)
+        
+    def save(self, fname):
+        arrays = dict((name, value) for name, value in self.__dict__.items())
+        atomic_write(fname, lambda f: np.savez(f, **arrays))
+
+
+def is_stale(bundle_fname, data_path):
+    """
+    True if the bundle is missing or older than any of its text files.
+    """
+    if not os.path.exists(bundle_fname): return True
+    
+    bundle_mtime = os.path.getmtime(bundle_fname)
+    
+    for fname in TEXT_FILES.values():
+        fname = os.path.join(data_path, fname)
+        if os.path.exists(fname) and os.path.getmtime(fname) > bundle_mtime: return True
+        
+    return False
+
+
+def load_bundle(bundle_fname, data_path):
+    """
+    Loads the bundle, (re)exporting it from the text files in data_path first
+    if it is stale. If the bundle can not be written the exported bundle is
+    used as is.
+    """
+    if is_stale(bundle_fname, data_path):
+        bundle = ModelBundle.from_text(data_path)
+        
+        # as with the text caches, a read-only data dir only means parsing
+        # the text files again on the next start
+        try:
+            bundle.save(bundle_fname)
+        except (IOError, OSError):
+            return bundle
+            
+    return ModelBundle.load(bundle_fname)
+
+
+class NeighborIndex:
+    """
+    Exact 1-nearest neighbour classifier over the bundle's training
+    histograms, squared distances are expanded with the precomputed training
+    norms and near ties are re-checked with the direct difference.
+    """
+    def __init__(self, train_data, train_labels, train_norms=None):
+        self.train_data = np.asarray(train_data, dtype=np.float64)
+        self.train_labels = train_labels
+        
+        if train_norms is None: train_norms = (self.train_data ** 2).sum(axis=1)
+        self.train_norms = train_norms
+        
+    def nearest(self, X):
+        X = np.atleast_2d(X)
+        dist = self.train_norms - 2 * np.dot(X, self.train_data.T)
+        best = np.argmin(dist, axis=1)
+        
+        if len(self.train_data) > 1:
+            nearest_two = np.partition(dist, 1, axis=1)[:,:2]
+            scale = self.train_norms.max() + (X ** 2).sum(axis=1)
+            close = np.flatnonzero(nearest_two[:,1] - nearest_two[:,0] <= 1e-9 * scale)
+            
+            for row in close:
+                best[row] = np.argmin(((self.train_data - X[row]) ** 2).sum(axis=1))
+                
+        return best
+        
+    def predict(self, X):
+        return self.train_labels[self.nearest(X)]
@@ -1,5 +1,6 @@
 #include <ros/ros.h>
 #include <point_cloud_classifier/ExtractSHOTDescriptor.h>
+#include <point_cloud_classifier/ExtractSHOTDescriptors.h>
 #include <sensor_msgs/PointCloud.h>
 #include <sensor_msgs/point_cloud_conversion.h>
 #include <stdlib.h>
@@ -16,8 +17,7 @@
 
 using namespace pcl;
 
-bool extract(point_cloud_classifier::ExtractSHOTDescriptor::Request  &req,
-         point_cloud_classifier::ExtractSHOTDescriptor::Response &res )
+void computeShot(const sensor_msgs::PointCloud &pointCloud, pcl::PointCloud<pcl::SHOT> &cloudShot)
 {
     float        kernelSize;
 
@@ -27,12 +27,11 @@ bool extract(point_cloud_classifier::ExtractSHOTDescriptor::Request  &req,
     pcl::KdTreeFLANN<pcl::PointXYZ>::Ptr tree (new pcl::KdTreeFLANN<pcl::PointXYZ> ());
     pcl::KdTreeFLANN<pcl::PointXYZ>::Ptr tree2 (new pcl::KdTreeFLANN<pcl::PointXYZ> ());
     pcl::PointCloud<pcl::Normal>::Ptr cloud_normals (new pcl::PointCloud<pcl::Normal>);
-    pcl::PointCloud<pcl::SHOT>::Ptr cloudShot (new pcl::PointCloud<pcl::SHOT> ());
 
     //initialization
     kernelSize = 5;
     sensor_msgs::PointCloud2 pcl2;
-    sensor_msgs:convertPointCloudToPointCloud2(req.point_cloud,pcl2);
+    sensor_msgs::convertPointCloudToPointCloud2(pointCloud,pcl2);
     fromROSMsg(pcl2,*cloudIn);
     //estimating input normals
     ne.setInputCloud (cloudIn);
@@ -44,16 +43,48 @@ bool extract(point_cloud_classifier::ExtractSHOTDescriptor::Request  &req,
     shotExtractor.setInputNormals(cloud_normals);
     shotExtractor.setSearchMethod(tree2);
     shotExtractor.setRadiusSearch(kernelSize);
-    shotExtractor.compute(*cloudShot);
+    shotExtractor.compute(cloudShot);
+}
+
+void appendDescriptors(const pcl::PointCloud<pcl::SHOT> &cloudShot, std::vector<double> &features)
+{
+    for(size_t i=0;i<cloudShot.size();i++)
+    {
+        const std::vector<float> &descriptor = cloudShot.points[i].descriptor;
+        features.insert(features.end(), descriptor.begin(), descriptor.end());
+    }
+}
+
+bool extract(point_cloud_classifier::ExtractSHOTDescriptor::Request  &req,
+         point_cloud_classifier::ExtractSHOTDescriptor::Response &res )
+{
+    pcl::PointCloud<pcl::SHOT> cloudShot;
+    computeShot(req.point_cloud, cloudShot);
+
     //response
-    res.num_features = cloudShot->size();
-    res.feature_size = cloudShot->points[0].descriptor.size();
-    for(int i=0;i<cloudShot->size();i++)
+    res.num_features = cloudShot.size();
+    res.feature_size = cloudShot.points[0].descriptor.size();
+    res.shot_feature.reserve(res.num_features * res.feature_size);
+    appendDescriptors(cloudShot, res.shot_feature);
+
+    return true;
+}
+
+// descriptors of all clusters of a scene in one round-trip
+bool extractBatch(point_cloud_classifier::ExtractSHOTDescriptors::Request  &req,
+         point_cloud_classifier::ExtractSHOTDescriptors::Response &res )
+{
+    res.feature_size = 0;
+    res.num_features.resize(req.point_clouds.size(), 0);
+
+    for(size_t i=0;i<req.point_clouds.size();i++)
     {
-        for(int j=0;j<cloudShot->points[i].descriptor.size();j++)
-        {
-            res.shot_feature.push_back(cloudShot->points[i].descriptor[j]);
-        }
+        pcl::PointCloud<pcl::SHOT> cloudShot;
+        computeShot(req.point_clouds[i], cloudShot);
+
+        res.num_features[i] = cloudShot.size();
+        if (cloudShot.size() > 0) res.feature_size = cloudShot.points[0].descriptor.size();
+        appendDescriptors(cloudShot, res.shot_feature);
     }
 
     return true;
@@ -64,6 +95,7 @@ int main(int argc, char **argv)
     ros::init(argc, argv, "shotExtractor");
     ros::NodeHandle n;
     ros::ServiceServer service = n.advertiseService("extract_shot_descriptor", extract);
+    ros::ServiceServer batchService = n.advertiseService("extract_shot_descriptors", extractBatch);
     ROS_INFO("Ready to extract shot features.");
     ros::spin();
     return 0;
@@ -21,18 +21,15 @@ import subprocess
 from std_msgs.msg import String
 from dynamixel_msgs.msg import JointState
 from phidgets_ros.msg import Float64Stamped
+from wubble2_robot.sensor_log import SensorLogWriter
+from wubble2_robot.sensor_log import read_log
 
-# Global variable to hold all of the sensor's data
-sensorData = []
-sensorDataAr = []
-servoData = []
-matrix = []
-matrixAr = []
+# Global variable to hold the log all of the sensor's data goes to
+sensorLog = None
 
 # Output file names
 defaultDir = '/tmp/'
-sensorOutputFile = defaultDir
-servoOutputFile = defaultDir
+outputFile = defaultDir
 plot6 = 'rxplot '
 plot8 = 'rxplot '
 
@@ -56,8 +53,6 @@ for i in range(numSensors):
 plot6 += ' > output.dat'
 plot8 += ' > output.dat'
 
-# Global variable to change Global sleep time between sensor reads
-sleep_time = 0.02
 # Global variable to show sensor output, 0 = no, 1 = yes
 print_sensor_y_n = 0
 print_servo_y_n = 0
@@ -74,17 +69,16 @@ elif(numSensors == 8):
 # Function to store sensor data depending on type, with option to print sensor's data
 def store_sensor_data(datatype, index, msg, print_output):
     if datatype == 'sensorData':
-        sensorData[index].append( (str(msg.header.stamp), msg.data) )
+        sensorLog.write('sensor%d' % index, msg.header.stamp, msg.data)
         if print_output == 1:
             print 'Sensor ' + str(index) + ': ' + str(msg.data) + "\n"
     elif datatype == 'servoData':
-        servoData[index].append( (str(msg.header.stamp), msg.load) )
+        sensorLog.write(('left_load', 'right_load')[index], msg.header.stamp, msg.load)
         if print_output == 1:
             if index == 0:
                 print 'Left claw load: ' + str(msg.load) + '\n'
             else:
                 print 'Right claw load: ' + str(msg.load) + '\n'
-    time.sleep(sleep_time)
 
 # Callback for sensor 0
 def c0(msg):
@@ -120,12 +114,6 @@ def callRight(msg):
 # Function to get all sensor data
 def affordance_listener():
 #    rospy.init_node('affordance_listener', anonymous=True)
-    # Initialize the sensorData list of lists
-    for i in range(numSensors):
-        sensorData.append([])
-    # Initialize the sensorData list of lists
-    for i in range(2):
-        servoData.append([])
     if(numSensors == 6):
         callbacks = (c0, c1, c2, c3, c4, c5)
     elif(numSensors == 8):
@@ -139,33 +127,27 @@ def affordance_listener():
     rospy.Subscriber(rightFinger, JointState, callRight)
     rospy.spin()
 
-# Store the sensorData and servoData to an output file
+# Write out whatever is still queued and close the output file
 def write_data():
-    sensorOutput = open(sensorOutputFile, 'wb')
-    servoOutput = open(servoOutputFile, 'wb')
-    cPickle.dump(sensorData, sensorOutput)
-    cPickle.dump(servoData, servoOutput)
-    sensorOutput.close()
-    servoOutput.close()
-
-# Read the sensorData and servoData from an output file
+    sensorLog.close()
+
+# Read the sensor and servo data from an output file, one stamp and value
+# column per channel
 def read_data(fileName):
-    inputFile = open(fileName, 'rb')
-    inputList = cPickle.load(inputFile)
-    inputFile.close()
-    return inputList
+    return read_log(fileName)
 
 # Main
 if __name__ == '__main__':
     rospy.init_node('affordance_listener', anonymous=True)
-    sensorOutputFile += str(rospy.Time.now())
-    sensorOutputFile += 'sensorData.dat'
-    servoOutputFile += str(rospy.Time.now())
-    servoOutputFile += 'servoData.dat'
+    outputFile += str(rospy.Time.now())
+    outputFile += 'affordanceData.dat'
+    channels = ['sensor%d' % i for i in range(numSensors)] + ['left_load', 'right_load']
+    sensorLog = SensorLogWriter(outputFile, channels)
     # Print output
     print 'Recording sensor data... (Press Ctrl-C to stop recording)'
     # Get input from sensors
     affordance_listener()
     # Store data to output file
     write_data()
+    print 'Sensor data written to ' + outputFile
 
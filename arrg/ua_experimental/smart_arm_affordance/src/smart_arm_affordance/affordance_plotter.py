@@ -22,6 +22,7 @@ from optparse import OptionParser
 from std_msgs.msg import String
 from dynamixel_msgs.msg import JointState
 from phidgets_ros.msg import Float64Stamped
+from wubble2_robot.sensor_log import read_log
 
 # Global variable to hold all of the sensor's data
 sensorData = []
@@ -35,29 +36,15 @@ matrixAr = []
 # Variables depending on arm
 numSensors = 6
 
-# Output file names
-sensorOutputFile = 'sensorData.dat'
-servoOutputFile = 'servoData.dat'
-
-# Plot the sensor's correspinding color and data point
-def plot_sensor_data(inputList, color):
-    for d in inputList:
-        if color == 0:
-            ax.plot(str(d[0]), str(d[1]),'ro')
-        elif color == 1:
-            ax.plot(str(d[0]), str(d[1]),'g^')
-        elif color == 2:
-            ax.plot(str(d[0]), str(d[1]),'bo')
-        elif color == 3:
-            ax.plot(str(d[0]), str(d[1]),'c^')
-        elif color == 4:
-            ax.plot(str(d[0]), str(d[1]),'mo')
-        elif color == 5:
-            ax.plot(str(d[0]), str(d[1]),'k^')
-        elif color == 6:
-            ax.plot(str(d[0]), str(d[1]),'b^')
-        elif color == 7:
-            ax.plot(str(d[0]), str(d[1]),'r^')
+# Output file name
+outputFile = 'affordanceData.dat'
+
+# Marker of every sensor
+sensorStyles = ['ro', 'g^', 'bo', 'c^', 'mo', 'k^', 'b^', 'r^']
+
+# Plot the sensor's correspinding color and data points
+def plot_sensor_data(channel, color):
+    ax.plot(channel['stamp'] / 1e9, channel['value'], sensorStyles[color])
 
 # Plot the sensor data over time
 def graph_data_scatter(inputList):
@@ -159,17 +146,10 @@ def bucket_counter(data, minV, maxV, Nbuckets):
     return temphisto
 
 def convert_to_numpy(inputList, index):
-    temp = []
-    for i in inputList[index]:
-        temp.append(i[1])
-    num = array(temp)
-    return num
+    return inputList[index]['value']
 
 def toList(inputList, index):
-    temp = []
-    for i in inputList[index]:
-        temp.append(i[1])
-    return temp
+    return inputList[index]['value'].tolist()
 
 def histo_generator():
     # Take all sensor data, put them into buckets, then append to the output matrix
@@ -183,20 +163,12 @@ def histo_generator():
         temphisto = bucket_counter(temp, min(temp), max(temp) + 1, 10)
         matrix.append(temphisto)
 
-# Store the sensorData and servoData to an output file
-def write_data():
-    sensorOutput = open(sensorOutputFile, 'wb')
-    servoOutput = open(servoOutputFile, 'wb')
-    pickle.dump(sensorData, sensorOutput)
-    pickle.dump(servoData, servoOutput)
-    sensorOutput.close()
-    servoOutput.close()
-# Read the sensorData and servoData from an output file
+# Read the sensorData and servoData from an output file, the stamp and
+# value columns of every sensor and of the left and right servo
 def read_data(fileName):
-    inputFile = open(fileName, 'rb')
-    inputList = cPickle.load(inputFile)
-    inputFile.close()
-    return inputList
+    log = read_log(fileName)
+    sensors = sorted([name for name in log if name.startswith('sensor')], key=lambda name: int(name[6:]))
+    return [log[name] for name in sensors], [log['left_load'], log['right_load']]
 
 # Main
 if __name__ == '__main__':
@@ -205,17 +177,16 @@ if __name__ == '__main__':
     parser.add_option("-f", "--file", dest="filename", help="write report to FILE", metavar="FILE")
     (options, args) = parser.parse_args()
     if(len(args) > 0):
-        sensorOutputFile = args[0]
-        servoOutputFile = args[1]
-        if(len(args) > 2):
-            graph_type = args[2]
+        outputFile = args[0]
+        if(len(args) > 1):
+            graph_type = args[1]
     else:
-        print 'No input files specified!  Opened from current directory...'
+        print 'No input file specified!  Opened from current directory...'
 
     # Read in data from output file
-    sensorData = read_data(sensorOutputFile)
-    servoData = read_data(servoOutputFile)
-    print sensorData
+    sensorData, servoData = read_data(outputFile)
+    for index, channel in enumerate(sensorData):
+        print 'Sensor %d: %d values' % (index, len(channel['value']))
     if(graph_type == 'histo'):
         histo_generator()
         graph_data_histo(matrix, 10)
@@ -44,12 +44,11 @@ from ua_audio_capture.srv import StartAudioRecording
 from ua_audio_capture.srv import StopAudioRecording
 from ua_audio_capture.srv import StopAudioRecordingResponse
 
-from array import array
+from ua_audio_capture.recorder import ChunkedRecorder
 
 class AudioDump():
     def __init__(self):
         self.save_audio = False
-        self.stream = []
         self.counter = 1
         self.object_id = 0
         self.action_id = 0
@@ -58,10 +57,17 @@ class AudioDump():
         
         rospy.init_node('audio_dump', anonymous=True)
         
+        # with offset_only set the stop service only reports where the sound
+        # is in the .rawsound file instead of sending all samples back
+        self.offset_only = rospy.get_param('~offset_only', False)
+        
         time = rospy.Time.now().to_sec()
-        self.f = open('/tmp/sound_%d.rawsound' % time, 'wb')
+        self.f = open('/tmp/sound_%d.rawsound' % time, 'w+b')
         self.fdesc = open('/tmp/sound_%d.desc' % time, 'w')
         
+        # samples go to disk while they are being recorded
+        self.recorder = ChunkedRecorder(self.f)
+        
         rospy.Subscriber('audio_capture/audio', AudioRawStream, self.process_audio)
         rospy.Service('audio_dump/start_audio_recording', StartAudioRecording, self.process_start_recording)
         rospy.Service('audio_dump/stop_audio_recording', StopAudioRecording, self.process_stop_recording)
@@ -70,10 +76,13 @@ class AudioDump():
         self.f.close()
         self.fdesc.close()
 
+    def shutdown(self):
+        self.recorder.close()
+
     def process_audio(self, msg):
         if self.save_audio:
             self.l.acquire()
-            self.stream.extend(msg.samples)
+            if self.save_audio: self.recorder.append(msg.samples)
             self.l.release()
 
     def process_start_recording(self, req):
@@ -82,6 +91,7 @@ class AudioDump():
         self.l.acquire()
         self.action_id = req.action_id
         self.object_id = req.object_id
+        self.last_index = self.recorder.position
         self.save_audio = True
         self.l.release()
         
@@ -93,37 +103,42 @@ class AudioDump():
         
         # was recording, now stop and dump to file
         if self.save_audio:
-            # save the sound to file and ditch it from memory
-            self.save_audio = False
-            
             self.l.acquire()
-            res.recorded_sound = self.stream
-            self.stream = []
+            self.save_audio = False
+            self.recorder.flush()
+            offset = self.last_index
+            length = self.recorder.position - offset
             self.l.release()
             
+            res.file_name = self.f.name
+            res.offset = offset
+            res.length = length
+            
+            if not self.offset_only:
+                res.recorded_sound = self.recorder.read(offset, length)
+                
             if req.dump_to_file:
                 rospy.loginfo('Save current sound sample to file')
-                self.save_sound(res.recorded_sound)
+                self.save_sound(offset, length)
             else:
                 rospy.logwarn('Will not save current sound sample to file')
+                self.recorder.truncate(offset)
         else:
             rospy.logwarn('Was not recording audio, will return empty array')
             
         self.counter += 1
         return res
 
-    def save_sound(self, sound):
-        stream_array = array('d', sound)
-        stream_array.tofile(self.f)
-        rospy.loginfo('current stream has %d numbers' % len(sound))
-        offset = self.last_index
-        self.last_index += len(sound)
+    def save_sound(self, offset, length):
+        # samples are already in the .rawsound file, only index them
+        rospy.loginfo('current stream has %d numbers' % length)
+        self.last_index = offset + length
         rospy.loginfo('current sound begins at %d and next sound will start at %d' % (offset, self.last_index))
-        desc = '%d %d %d %d\n' % (self.action_id, self.object_id, offset, len(sound))
+        desc = '%d %d %d %d\n' % (self.action_id, self.object_id, offset, length)
         self.fdesc.write(desc)
         self.fdesc.flush()
 
 if __name__ == '__main__':
     a = AudioDump()
     rospy.spin()
-
+    a.shutdown()
@@ -39,6 +39,7 @@ import pickle
 import math
 import os
 import time
+import weakref
 from fnmatch import fnmatch
 from array import array
 from operator import itemgetter
@@ -53,7 +54,6 @@ import matplotlib
 from scipy.ndimage.filters import gaussian_filter1d
 from scikits.audiolab import Format, Sndfile
 
-import nwalign as nw
 from scikits.learn.cluster import SelfOrganizingMap
 from Bio import kNN
 
@@ -63,6 +63,17 @@ from multiprocessing import cpu_count
 from itertools import ifilter
 from sklearn.cluster.spectral import spectral_clustering
 
+from ua_audio_capture.corpus import SoundCorpus
+from ua_audio_capture.featurize import segment_start
+from ua_audio_capture.featurize import segment_end
+from ua_audio_capture.featurize import CorpusFeaturizer
+from ua_audio_capture.alignment import AlignmentEngine
+from ua_audio_capture.alignment import parse_cost_matrix
+from ua_audio_capture.alignment import read_cost_matrix
+from ua_audio_capture.encoding import SomEncoder
+from ua_audio_capture.neighbors import vote
+from ua_audio_capture.neighbors import SequenceIndex
+
 
 
 def print_confusion_matrix(o, c):
@@ -185,6 +196,12 @@ class AudioClassifier():
                            '/tmp/robot_sounds/raw/shake_pitch',
                           ]
                           
+        self.feature_cache_dir = '/tmp/robot_sounds/fft/cache'
+        self.num_processes = cpu_count()
+        self.alignment = None
+        self.indices = weakref.WeakKeyDictionary()
+        self.encoders = weakref.WeakKeyDictionary()
+                          
         self.action_names = ['grasp',        # 0
                              'lift',         # 1
                              'drop',         # 2
@@ -207,6 +224,21 @@ class AudioClassifier():
                             ]
 
 
+    def __getstate__(self):
+        # weak key caches do not pickle (pool.map hands the classifier to
+        # worker processes), workers rebuild what they need
+        state = self.__dict__.copy()
+        del state['indices']
+        del state['encoders']
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.indices = weakref.WeakKeyDictionary()
+        self.encoders = weakref.WeakKeyDictionary()
+
+
     def stringify_sequence(self, seq):
         """
         input  = [(1,2),(2,3) ...]
@@ -262,26 +294,38 @@ class AudioClassifier():
         outfile.write(result)
         outfile.close()
         
+        self.alignment = AlignmentEngine(parse_cost_matrix(result),
+                                         self.params['nw_gap_open'],
+                                         self.params['nw_gap_extend'])
+                                         
         return result
 
 
+    def get_alignment_engine(self):
+        """
+        Returns the in-memory alignment engine, falls back to the cost matrix
+        left in /tmp/som.costs by an earlier generate_cost_matrix call.
+        """
+        if self.alignment is None:
+            self.alignment = AlignmentEngine(read_cost_matrix('/tmp/som.costs'),
+                                             self.params['nw_gap_open'],
+                                             self.params['nw_gap_extend'])
+                                             
+        return self.alignment
+
+
     def sound_seq_distance_str(self, seq1_str, seq2_str):
-        gopen = self.params['nw_gap_open']
-        gextend = self.params['nw_gap_extend']
-        seq1_str = np.asanyarray(seq1_str)
-        seq2_str = np.asanyarray(seq2_str)
-        
-        align = nw.global_align(seq1_str.tostring(), seq2_str.tostring(), gap_open=gopen, gap_extend=gextend, matrix='/tmp/som.costs')
-        len1 = len(seq1_str.tostring())
-        len2 = len(seq2_str.tostring())
-        return (-nw.score_alignment(*align, gap_open=gopen, gap_extend=gextend, matrix='/tmp/som.costs'))/(len1+len2+0.0)
+        return self.get_alignment_engine().distance(seq1_str, seq2_str)
 
 
-    def knn_weight_fn(self, x, y):
-        dist = self.sound_seq_distance_str(x, y)
+    def knn_distance_weight(self, dist):
         return math.exp(-(dist-1)/0.5) / math.exp(0)
 
 
+    def knn_weight_fn(self, x, y):
+        return self.knn_distance_weight(self.sound_seq_distance_str(x, y))
+
+
     def rebin_time_fixed_width(self, s, w):
         # filter first
         #s = gaussian_filter1d(s, 10, mode='constant')
@@ -298,9 +342,19 @@ class AudioClassifier():
         return np.asarray(result)
 
 
+    def get_encoder(self, som):
+        if som not in self.encoders:
+            self.encoders[som] = SomEncoder(som, self.params['som_size'])
+            
+        return self.encoders[som]
+
+
     def sound_fft_to_string(self, sound_fft, som):
-        sequence = [som.bmu(sound_fft[:,col]) for col in range(sound_fft.shape[1])]
-        return self.stringify_sequence(sequence)
+        return self.get_encoder(som).encode(sound_fft)
+
+
+    def sound_ffts_to_strings(self, sound_ffts, som):
+        return self.get_encoder(som).encode_all(sound_ffts)
 
 
     def train_model(self, training_ffts, training_labels):
@@ -321,12 +375,29 @@ class AudioClassifier():
         np.random.shuffle(column_vectors)
         som.fit(column_vectors)
         
-        training_sequences = [self.sound_fft_to_string(sound_fft, som) for sound_fft in training_ffts]
+        training_sequences = self.sound_ffts_to_strings(training_ffts, som)
         knn_model = kNN.train(training_sequences, training_labels, knn_k)
+        self.indices[knn_model] = SequenceIndex(self.get_alignment_engine(), training_sequences)
         
         return som, knn_model
 
 
+    def get_sequence_index(self, knn_model):
+        """
+        Returns the SequenceIndex built over the training sequences of
+        knn_model, rebuilt if the model was unpickled or the cost matrix has
+        changed since it was trained.
+        """
+        engine = self.get_alignment_engine()
+        index = self.indices.get(knn_model)
+        
+        if index is None or index.engine is not engine:
+            index = SequenceIndex(engine, knn_model.xs)
+            self.indices[knn_model] = index
+            
+        return index
+
+
     def classify(self, sound_fft, som, knn_model):
         """
         Classify a new sound. Takes in a sound FFT, a SOM model and kNN model.
@@ -335,10 +406,10 @@ class AudioClassifier():
         """
         sequence = self.sound_fft_to_string(sound_fft, som)
         
-        weights = kNN.calculate(knn_model,
-                                self.stringify_sequence(sequence),
-                                weight_fn=self.knn_weight_fn,
-                                distance_fn=self.sound_seq_distance_str)
+        # same neighbours and weighting kNN.calculate gives, but only training
+        # sequences that can still make it into the top k get aligned
+        neighbors, distances = self.get_sequence_index(knn_model).knn(sequence, knn_model.k)
+        weights = vote(knn_model, neighbors, distances, self.knn_distance_weight)
                               
         sum_weights = float(sum(weights.values()))
         
@@ -364,7 +435,7 @@ class AudioClassifier():
         return most_class, weights
 
 
-    def find_sound_start(self, data_paths, actions, objects):
+    def find_sound_start(self, data_paths, actions, objects, corpus=None):
         window = int(self.params['rebin_window'] * 44100)
         
         counter = {}
@@ -381,55 +452,18 @@ class AudioClassifier():
             for object_str in objects:
                 start_times_by_action[action_str][object_str] = []
                 
-        for path in data_paths:
-            print 'Processing sound descriptor files in %s' % path
+        if corpus is None:
+            corpus = SoundCorpus(data_paths)
+            
+        for action_str, object_str, sound in corpus.segments(actions, objects):
+            start = segment_start(sound, window, self.params['start_offset'])
+            
+            if start != -1:
+                total[action_str] += start
+                counter[action_str] += 1
+                
+            start_times_by_action[action_str][object_str].append(start)
             
-            for fname in os.listdir(path):
-                if fnmatch(fname, '*.desc'):
-                    name = os.path.splitext(fname)[0]
-                    desc_file = open(os.path.join(path, fname), 'r')
-                    data_file = open(os.path.join(path, name + '.rawsound'), 'r')
-                    
-                    descriptors = desc_file.read().split('\n')
-                    arr = array('d')
-                    arr.fromstring(data_file.read())
-                    audio_blob = arr.tolist()
-                    
-                    desc_file.close()
-                    data_file.close()
-                    
-                    for descriptor in descriptors:
-                        if not descriptor: continue
-                        
-                        action_id, object_id, offset, length = descriptor.split()
-                        
-                        # grab string labels for current action and object
-                        action_str = actions[int(action_id)]
-                        object_str = objects[int(object_id)]
-                        
-                        sound = np.asarray(audio_blob[int(offset):int(offset)+int(length)])
-                        sound = np.abs(sound)
-                        sound = self.rebin_time_fixed_width(sound, window)
-                        maximum = max(sound)
-                        
-                        start = index_where(sound, (lambda x: x > 0.02))#maximum / 2.0))
-                        
-    #                    f = pl.figure()
-    #                    ax = f.add_subplot(111)
-    #                    im = pl.plot(sound)
-    #                    pl.draw()
-    #                    pl.show()
-                        
-                        
-                        if start is not None:
-                            start *= window
-                            start = max(0, start - self.params['start_offset'] * 44100)
-                            total[action_str] += start
-                            counter[action_str] += 1
-                            start_times_by_action[action_str][object_str].append(start)
-                        else:
-                            start_times_by_action[action_str][object_str].append(-1)
-                            
         average_start_time = {}
         
         for action_str in actions:
@@ -444,7 +478,7 @@ class AudioClassifier():
         return start_times_by_action
 
 
-    def find_sound_end(self, data_paths, actions, objects, start_times):
+    def find_sound_end(self, data_paths, actions, objects, start_times, corpus=None):
         window = int(self.params['rebin_window'] * 44100)
         
         counter = {}
@@ -461,54 +495,19 @@ class AudioClassifier():
             for object_str in objects:
                 end_times_by_action[action_str][object_str] = []
                 
-        for path in data_paths:
-            print 'Processing sound descriptor files in %s' % path
+        if corpus is None:
+            corpus = SoundCorpus(data_paths)
+            
+        for action_str, object_str, sound in corpus.segments(actions, objects):
+            sample_idx = len(end_times_by_action[action_str][object_str])
+            end = segment_end(sound, window, start_times[action_str][object_str][sample_idx], self.params['end_offset'])
+            
+            if end != -1:
+                total[action_str] += end
+                counter[action_str] += 1
+                
+            end_times_by_action[action_str][object_str].append(end)
             
-            for fname in os.listdir(path):
-                if fnmatch(fname, '*.desc'):
-                    name = os.path.splitext(fname)[0]
-                    desc_file = open(os.path.join(path, fname), 'r')
-                    data_file = open(os.path.join(path, name + '.rawsound'), 'r')
-                    
-                    descriptors = desc_file.read().split('\n')
-                    arr = array('d')
-                    arr.fromstring(data_file.read())
-                    audio_blob = arr.tolist()
-                    
-                    desc_file.close()
-                    data_file.close()
-                    
-                    for descriptor in descriptors:
-                        if not descriptor: continue
-                        
-                        action_id, object_id, offset, length = descriptor.split()
-                        
-                        # grab string labels for current action and object
-                        action_str = actions[int(action_id)]
-                        object_str = objects[int(object_id)]
-                        
-                        sound = np.asarray(audio_blob[int(offset):int(offset)+int(length)])
-                        sound = np.abs(sound)
-                        last_index = len(sound)
-                        sound = self.rebin_time_fixed_width(sound, window)
-                        minimum = min(sound)
-                        sample_idx = len(end_times_by_action[action_str][object_str])
-                        start = int((start_times[action_str][object_str][sample_idx]+0.15*44100)/window)
-                        sound = sound[start:]
-                        maximum = max(sound)
-                        end = reverse_index_where(sound, (lambda x: x > 0.02))#maximum / 2.0))
-                        
-                        if end is not None:
-                            end = (start + end) * window
-                            end = min(end + self.params['end_offset'] * 44100, last_index)
-                            total[action_str] += end
-                            counter[action_str] += 1
-                            end_times_by_action[action_str][object_str].append(end)
-                        else:
-                            end_times_by_action[action_str][object_str].append(-1)
-                            
-                        sample_idx += 1
-                        
         average_end_time = {}
         
         for action_str in actions:
@@ -523,18 +522,25 @@ class AudioClassifier():
         return end_times_by_action
 
 
-    def calculate_fft(self, data_paths, actions, objects):
+    def calculate_fft(self, data_paths, actions, objects, corpus=None):
         """
         Given a path to the data, a list of actions and a list objects reads raw
         sound waves from files and computes FFTs. Returns a list of FFTs with a list
-        of corresponding labels.
+        of corresponding labels. An already opened SoundCorpus can be passed in
+        to avoid re-indexing data_paths.
+        
+        Work is spread over self.num_processes processes one .rawsound file at
+        a time, intermediate results are cached in self.feature_cache_dir keyed
+        on file contents and the relevant self.params entries.
         """
-        ####### Parameters ######
-        sampling_rate = 44100
-        fft_n = self.params['fft_n']
-        fft_overlap = self.params['fft_overlap']
-        fft_freq_bins = self.params['fft_freq_bins']
-        #########################
+        # map every .rawsound file once, the pool workers re-map the files
+        # they are given by name instead of receiving pickled samples
+        if corpus is None:
+            corpus = SoundCorpus(data_paths)
+            
+        featurizer = CorpusFeaturizer(self.params, self.feature_cache_dir, self.num_processes)
+        action_labels, object_labels, processed_ffts = featurizer.run(corpus, actions, objects)
+        print 'Calculated %d FFTs' % len(processed_ffts)
         
         object_count_by_actions = {}
         for action_str in actions:
@@ -542,86 +548,9 @@ class AudioClassifier():
             for object_str in objects:
                 object_count_by_actions[action_str][object_str] = 0
                 
-        processed_ffts = []
-        object_labels = []
-        action_labels = []
-        
-        #print 'Calculating start times...'
-        start_times = self.find_sound_start(data_paths, actions, objects)
-        #print start_times
-        
-        #print 'Calculating end times...'
-        end_times = self.find_sound_end(data_paths, actions, objects, start_times)
-        #print end_times
-        
-        sample_idx = 0
-        
-        for path in data_paths:
-            print 'Processing sound descriptor files in %s' % path
+        for action_str, object_str in zip(action_labels, object_labels):
+            object_count_by_actions[action_str][object_str] += 1
             
-            for fname in os.listdir(path):
-                if fnmatch(fname, '*.desc'):
-                    name = os.path.splitext(fname)[0]
-                    desc_file = open(os.path.join(path, fname), 'r')
-                    data_file = open(os.path.join(path, name + '.rawsound'), 'r')
-                    
-                    descriptors = desc_file.read().split('\n')
-                    arr = array('d')
-                    arr.fromstring(data_file.read())
-                    audio_blob = arr.tolist()
-                    
-                    desc_file.close()
-                    data_file.close()
-                    
-                    for descriptor in descriptors:
-                        if not descriptor: continue
-                        
-                        action_id, object_id, offset, length = descriptor.split()
-                        
-                        # grab string labels for current action and object
-                        action_str = actions[int(action_id)]
-                        object_str = objects[int(object_id)]
-                        
-                        action_labels.append(action_str)
-                        object_labels.append(object_str)
-                        
-                        sound = np.asarray(audio_blob[int(offset):int(offset)+int(length)])
-                        idx = object_count_by_actions[action_str][object_str]
-                        start = int(start_times[action_str][object_str][idx])
-                        end = int(end_times[action_str][object_str][idx]) #start + int(fft_time_after_peak * sampling_rate)
-                        sound = sound[start:end]
-                        
-    #                    f = pl.figure()
-    #                    ax = f.add_subplot(111)
-    #                    im = pl.plot(sound)
-    #                    pl.draw()
-    #                    pl.show()
-                        
-                        Pxx,freqs,t = matplotlib.mlab.specgram(sound, NFFT=fft_n, Fs=sampling_rate, noverlap=fft_overlap)
-                        Pxx = 20 * np.log10(Pxx)
-                        freqs /= 1000.0
-                        
-                        # bin resulting FFT into fft_freq_bins number of frequency bins
-                        l = np.linspace(0, Pxx.shape[0], fft_freq_bins+1)
-                        fft_binned = np.empty((fft_freq_bins,Pxx.shape[1]))
-                        
-                        for i in range(len(l)-1):
-                            lis = int(l[i])
-                            lie = int(l[i+1])
-                            t = Pxx[lis:lie,:]
-                            fft_binned[i] = t.mean(axis=0)
-                            
-                        processed_ffts.append(fft_binned)
-                        print '[Sample %d] calculated FFT for action %s on object %s' % (sample_idx, action_str, object_str)
-                        object_count_by_actions[action_str][object_str] += 1
-                        sample_idx += 1
-                        
-    #                    f = pl.figure()
-    #                    ax = f.add_subplot(111)
-    #                    im = ax.pcolormesh(fft_binned)
-    #                    pl.draw()
-    #                    pl.show()
-                        
         pretty_print_totals(object_count_by_actions)
         return action_labels, object_labels, processed_ffts
 
@@ -997,27 +926,12 @@ class AudioClassifier():
             objs_ffts = by_action[act]
             num_objs = len(objs_ffts)
             
-            for idx_obj1 in range(num_objs):
-                print '\t[%d/%d]' % (idx_obj1+1, num_objs)
-                
-                som = soms[act]
-                
-                str1 = self.sound_fft_to_string(objs_ffts[idx_obj1][1], som)
-                row = []
-                
-                for idx_obj2 in range(num_objs):
-                    #print '\t\tComputing distance between %s and %s objects' % (objs_ffts[idx_obj1][0], objs_ffts[idx_obj2][0])
-                    str2 = self.sound_fft_to_string(objs_ffts[idx_obj2][1], som)
-                    dist = self.sound_seq_distance_str(str1, str2)
-                    #dist = math.exp(-(dist-1)/0.5) / math.exp(0)
-                    #delta = 0.1
-                    #row.append(np.exp(-dist ** 2 / (2. * delta ** 2)))
-                    #row.append(1.0/dist if dist > 0.0 else 1)
-                    row.append(dist)
-                    #print '\t\t\tdistance = %f' % row[-1]
-                    
-                affinity_by_action[act].append(row)
-                
+            som = soms[act]
+            strs = self.sound_ffts_to_strings([obj_fft[1] for obj_fft in objs_ffts], som)
+            
+            print '\tAligning %d sequences' % num_objs
+            affinity_by_action[act] = self.get_alignment_engine().distance_matrix(strs, strs, self.num_processes)
+            
             var = np.asarray(affinity_by_action[act]).var()
             affinity_by_action[act] = np.exp(-np.asarray(affinity_by_action[act]) ** 2 / (2. * var ** 2)) * 10
             #print '\t%f' % var
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+#
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Antons Rebguns. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of University of Arizona nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Antons Rebguns
+#
+
+import roslib; roslib.load_manifest('ua_audio_capture')
+from ua_audio_msgs.msg import AudioRawStream
+from ua_audio_msgs.msg import SoundEvent
+
+import rospy
+import numpy as np
+
+from ua_audio_capture.segmenter import StreamingSegmenter
+from ua_audio_capture.segmenter import ONSET
+
+class AudioSegmenter():
+    """
+    Cuts the live audio stream into sounds as it arrives. Onsets and offsets
+    are published on audio_segmenter/events as soon as they are detected and
+    every finished sound goes out on audio_segmenter/segments ready to be
+    handed to the classify service.
+    """
+    def __init__(self):
+        rospy.init_node('audio_segmenter', anonymous=True)
+        
+        self.sampling_rate = rospy.get_param('~sampling_rate', 44100)
+        self.window = int(rospy.get_param('~rebin_window', 0.1) * self.sampling_rate)
+        self.start_offset = rospy.get_param('~start_offset', 0.15)
+        self.end_offset = rospy.get_param('~end_offset', 0.15)
+        self.hangover = rospy.get_param('~hangover', 0.5)
+        self.max_length = rospy.get_param('~max_length', 5.0)
+        
+        # one segmenter per channel, created when the first message arrives
+        self.segmenters = []
+        
+        self.event_pub = rospy.Publisher('audio_segmenter/events', SoundEvent)
+        self.segment_pub = rospy.Publisher('audio_segmenter/segments', AudioRawStream)
+        rospy.Subscriber('audio_capture/audio', AudioRawStream, self.process_audio)
+
+    def process_audio(self, msg):
+        num_channels = max(1, msg.num_channels)
+        
+        if len(self.segmenters) != num_channels:
+            self.segmenters = [StreamingSegmenter(self.window, self.start_offset, self.end_offset,
+                                                  self.hangover, self.max_length, msg.sample_rate or self.sampling_rate)
+                               for channel in range(num_channels)]
+                               
+        # samples are interleaved by channel
+        samples = np.asarray(msg.samples, dtype=np.float64)
+        samples = samples[:len(samples) // num_channels * num_channels].reshape(-1, num_channels)
+        
+        for channel, segmenter in enumerate(self.segmenters):
+            for event in segmenter.push(samples[:,channel]):
+                self.publish(channel, event, msg.sample_rate)
+
+    def publish(self, channel, event, sample_rate):
+        ev = SoundEvent()
+        ev.type = event[0]
+        ev.channel = channel
+        ev.sample = event[1]
+        self.event_pub.publish(ev)
+        
+        if event[0] == ONSET:
+            rospy.loginfo('Sound started at sample %d on channel %d' % (event[1], channel))
+            return
+            
+        segment = event[2]
+        rospy.loginfo('Sound ended at sample %d on channel %d (%d samples)' % (event[1], channel, len(segment)))
+        
+        seg = AudioRawStream()
+        seg.samples = segment.tolist()
+        seg.num_channels = 1
+        seg.sample_rate = sample_rate
+        self.segment_pub.publish(seg)
+
+if __name__ == '__main__':
+    a = AudioSegmenter()
+    rospy.spin()
@@ -14,7 +14,6 @@ import numpy as np
 import matplotlib
 from scipy.ndimage.filters import gaussian_filter1d
 
-import nwalign as nw
 from scikits.learn.cluster import SelfOrganizingMap
 from Bio import kNN
 
@@ -27,20 +26,38 @@ from Bio import kNN
 __author__ = 'Antons Rebguns, antons@email.arizona.edu; Daniel Ford, dford@email.arizona.edu'
 
 from ua_audio_capture.srv import *
+from ua_audio_capture.features import get_engine
+from ua_audio_capture.alignment import AlignmentEngine
+from ua_audio_capture.alignment import ParallelAligner
+from ua_audio_capture.alignment import read_cost_matrix
+from ua_audio_capture.encoding import SomEncoder
+from ua_audio_capture.neighbors import vote
+from ua_audio_capture.neighbors import SequenceIndex
 
 class classifyNode():
 
     def __init__(self):
            
+        # spectrogram parameters, window and frequency bin tables are built
+        # once here and reused for every request
+        self.engine = get_engine(fft_n=512, fft_overlap=256, fft_freq_bins=33, sampling_rate=44100)
+        
+        # load previously trained SOM and knn_model from pkl files
+        self.som = pickle.load(open('/tmp/som.pkl'))
+        self.knn_model = pickle.load(open('/tmp/knn_model.pkl'))
+        self.encoder = SomEncoder(self.som, map_side=6)
+
+        # SOM cost matrix is read once, training sequences are handed to a
+        # pool of aligner processes (started before rospy spawns its threads)
+        self.alignment = AlignmentEngine(read_cost_matrix('/tmp/som.costs'), gap_open=0, gap_extend=-5)
+        self.aligner = ParallelAligner(self.alignment, self.knn_model.xs)
+        self.index = SequenceIndex(self.alignment, self.knn_model.xs, self.aligner)
+
         # init node and service
         rospy.init_node('classifyNode')
         request = rospy.Service('classify', classify, self._handleSvcRequest)
         print "\nReady for audio-based classification..."
 
-        # load previously trained SOM and knn_model from pkl files
-        self.som = pickle.load(open('/tmp/som.pkl'))
-        self.knn_model = pickle.load(open('/tmp/knn_model.pkl'))
-
     # callback that handles actual work
     def _handleSvcRequest(self, req):
         
@@ -64,15 +81,12 @@ class classifyNode():
         Returns a tuple containing a highest probability label and a dictionary of
         all label probabilities.
         """
-        sequence = []
-        
-        for col in range(sound_fft.shape[1]):
-            sequence.append(self.som.bmu(sound_fft[:,col]))
+        sequence = self.encoder.encode(sound_fft)
             
-        weights = kNN.calculate(self.knn_model,
-                                self.stringify_sequence(sequence),
-                                weight_fn=self.knn_weight_fn,
-                                distance_fn=self.sound_seq_distance_str)
+        # only training sequences whose distance lower bound can still beat
+        # the current k-th neighbour are aligned (in parallel)
+        neighbors, distances = self.index.knn(sequence, self.knn_model.k)
+        weights = vote(self.knn_model, neighbors, distances, self.knn_distance_weight)
                               
         sum_weights = float(sum(weights.values()))
         
@@ -95,10 +109,7 @@ class classifyNode():
         """
         ####### Parameters ######
         sampling_rate = 44100
-        fft_n = 512
-        fft_overlap = 256
         fft_time_after_peak = 2.0
-        fft_freq_bins = 33
         #########################
         
         #processed_ffts = []
@@ -115,19 +126,9 @@ class classifyNode():
         end = start + int(fft_time_after_peak * sampling_rate)
         s = s[start:end]
         
-        Pxx,freqs,t = matplotlib.mlab.specgram(s, NFFT=fft_n, Fs=sampling_rate, noverlap=fft_overlap)
-        Pxx = 20 * np.log10(Pxx)
-        freqs /= 1000.0
+        # same spectrogram/binning code path that audio_read uses for training
+        fft_binned = self.engine.compute_one(s)
         
-        l = np.linspace(0, Pxx.shape[0], fft_freq_bins+1)
-        fft_binned = np.empty((fft_freq_bins,Pxx.shape[1]))
-        
-        for i in range(len(l)-1):
-            lis = int(l[i])
-            lie = int(l[i+1])
-            t = Pxx[lis:lie,:]
-            fft_binned[i] = t.mean(axis=0)
-            
         #processed_fft.append(fft_binned)
         
         return fft_binned
@@ -136,6 +137,9 @@ class classifyNode():
         #dist = sound_seq_distance_str(x, y)
         return 1#math.exp(dist)
 
+    def knn_distance_weight(self, dist):
+        return 1#math.exp(dist)
+
     def rebin_time_fixed_width(self, s, w):
         # filter first
         s = gaussian_filter1d(s, 10, mode='constant')
@@ -167,15 +171,8 @@ class classifyNode():
         return ''.join(result)
 
     # compares two strings and returns the distance between them
-    # requires som.costs file to be in /tmp
     def sound_seq_distance_str(self,seq1_str, seq2_str):
-        seq1_str = np.asanyarray(seq1_str)
-        seq2_str = np.asanyarray(seq2_str)
-        
-        align = nw.global_align(seq1_str.tostring(), seq2_str.tostring(), gap_open=0, gap_extend=-5, matrix='/tmp/som.costs')
-        len1 = len(seq1_str.tostring())
-        len2 = len(seq2_str.tostring())
-        return (-nw.score_alignment(*align, gap_open=0, gap_extend=-5, matrix='/tmp/som.costs'))/(len1+len2+0.0)
+        return self.alignment.distance(seq1_str, seq2_str)
 
     # find the start of a sound
     def find_sound_start(self,rawAudio):
@@ -265,9 +262,13 @@ class classifyNode():
     def reset(self):
         pass
 
+    def shutdown(self):
+        self.aligner.close()
+
 if __name__ == '__main__':
 
     node = classifyNode()
     #node.test('/tmp/sounds')
     node.run()
+    node.shutdown()
 
@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+
+#
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Antons Rebguns. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of University of Arizona nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Antons Rebguns
+#
+
+from multiprocessing import Pool
+from multiprocessing import cpu_count
+
+import numpy as np
+
+
+# traceback pointer values, same meaning as in nwalign
+UP, LEFT, DIAG, NONE = 1, 2, 3, 4
+
+
+def parse_cost_matrix(text):
+    """
+    Parses a scoring matrix in the NCBI format written by
+    AudioClassifier.generate_cost_matrix into a square int array indexed by
+    character codes, the same way nwalign reads its matrix files.
+    """
+    lines = text.split('\n')
+    headers = None
+
+    while headers is None:
+        line = lines.pop(0).strip()
+        if line[0] == '#': continue
+        headers = [ord(x) for x in line.split(' ') if x]
+
+    mat_size = max(headers) + 1
+    matrix = np.zeros((mat_size, mat_size), dtype=np.int64)
+
+    for ai, line in enumerate(l for l in lines if l):
+        line_vals = [int(x) for x in line.split(' ')[1:] if x]
+        for ohidx, val in zip(headers, line_vals):
+            matrix[headers[ai], ohidx] = val
+
+    return matrix
+
+
+def read_cost_matrix(fname):
+    f = open(fname, 'r')
+    text = f.read()
+    f.close()
+    return parse_cost_matrix(text)
+
+
+def as_codes(seq):
+    """
+    Converts a SOM string (or anything np.asanyarray(...).tostring() turns
+    into one) to an array of character codes, code arrays pass through.
+    """
+    if isinstance(seq, np.ndarray) and seq.ndim == 1 and seq.dtype.kind in 'iu':
+        return seq.astype(np.intp)
+    if not isinstance(seq, str):
+        seq = np.asanyarray(seq).tostring()
+    return np.fromstring(seq, dtype=np.uint8).astype(np.intp)
+
+
+class AlignmentEngine():
+    """
+    In-process replacement for nw.global_align followed by nw.score_alignment.
+
+    The dynamic programming recurrence, tie breaking and gap bookkeeping of
+    nwalign are reproduced exactly, so distances are identical to the ones
+    sound_seq_distance_str used to compute. A whole batch of pairs is aligned
+    at once: every DP row is one vectorized cumulative max over all pairs,
+    and the traceback walks all pairs in lockstep accumulating the alignment
+    score directly instead of building the aligned strings.
+    """
+    def __init__(self, cost_matrix, gap_open, gap_extend, max_batch_bytes=1<<25):
+        assert gap_extend <= 0, "gap_extend penalty must be <= 0"
+        assert gap_open <= 0, "gap_open must be <= 0"
+
+        self.cost_matrix = np.asarray(cost_matrix, dtype=np.int64)
+        self.gap_open = gap_open
+        self.gap_extend = gap_extend
+        self.max_batch_bytes = max_batch_bytes
+
+
+    def distance(self, seq1, seq2):
+        return self.distance_row(seq1, [seq2])[0]
+
+
+    def distance_row(self, query, sequences):
+        """
+        Returns an array with the normalized alignment distance between query
+        and every sequence in sequences.
+        """
+        query = as_codes(query)
+        sequences = [as_codes(seq) for seq in sequences]
+        distances = np.empty(len(sequences))
+
+        # pairs of similar shape go into the same batch to keep padding low
+        order = sorted(range(len(sequences)), key=lambda idx: len(sequences[idx]))
+        start = 0
+
+        while start < len(order):
+            rows = max(len(query), len(sequences[order[start]])) + 1
+            end = start + 1
+
+            while end < len(order):
+                rows = max(rows, len(sequences[order[end]]) + 1)
+                cols = min(len(query), len(sequences[order[end]])) + 1
+                if (end - start + 1) * rows * cols > self.max_batch_bytes: break
+                end += 1
+
+            batch = order[start:end]
+            scores = self.batch_scores(query, [sequences[idx] for idx in batch])
+
+            for pos, idx in enumerate(batch):
+                distances[idx] = -scores[pos] / (len(query) + len(sequences[idx]) + 0.0)
+
+            start = end
+
+        return distances
+
+
+    def distance_matrix(self, queries, sequences, processes=None):
+        """
+        Returns a (len(queries), len(sequences)) distance matrix, rows are
+        computed in parallel on processes cores.
+        """
+        if processes == 1 or len(queries) < 2:
+            return np.vstack([self.distance_row(query, sequences) for query in queries])
+
+        aligner = ParallelAligner(self, sequences, processes)
+        try:
+            return np.vstack([aligner.distance_row(query) for query in queries])
+        finally:
+            aligner.close()
+
+
+    def batch_scores(self, query, sequences):
+        """
+        Aligns query against every sequence and returns the nwalign alignment
+        scores. Like nwalign the longer sequence of a pair runs along the DP
+        rows (i) and the shorter one along the columns (j).
+        """
+        go = self.gap_open
+        ge = self.gap_extend
+        mat = self.cost_matrix
+        num = len(sequences)
+
+        # flip is True where the query is the row sequence
+        flip = np.asarray([len(query) > len(seq) for seq in sequences])
+        seqs_i = [query if f else seq for f, seq in zip(flip, sequences)]
+        seqs_j = [seq if f else query for f, seq in zip(flip, sequences)]
+        len_i = np.asarray([len(s) for s in seqs_i], dtype=np.intp)
+        len_j = np.asarray([len(s) for s in seqs_j], dtype=np.intp)
+        max_i = len_i.max() if num else 0
+        max_j = len_j.max() if num else 0
+
+        I = np.zeros((num, max_i), dtype=np.intp)
+        J = np.zeros((num, max_j), dtype=np.intp)
+        for k in range(num):
+            I[k,:len_i[k]] = seqs_i[k]
+            J[k,:len_j[k]] = seqs_j[k]
+
+        # substitution scores of every alphabet letter against every column
+        # sequence, turns the per-row lookup into a contiguous row gather
+        alphabet = np.unique(np.concatenate([query] + sequences + [[0]]))
+        profile = mat[alphabet][:,J].astype(np.int32).transpose(1, 0, 2).copy()
+        I_idx = np.searchsorted(alphabet, I)
+        k = np.arange(num)
+
+        col_mask = np.arange(1, max_j + 1)[None,:] <= len_j[:,None]
+
+        # score[i,j] = max(up, diag, left) where left is always a gap
+        # extension except in the first column, so with
+        # offset[j] = gap_open + (j-1) * gap_extend a row reduces to a
+        # cumulative max of (max(up, diag) - offset)
+        offset = (go + ge * np.arange(-1, max_j)).astype(np.int32)
+        offset[0] = 0
+        left_pen = np.empty(max_j, dtype=np.int32)
+        left_pen.fill(ge)
+        if max_j: left_pen[0] = go
+
+        pointer = np.empty((num, max_i + 1, max_j + 1), dtype=np.uint8)
+        pointer[:,0,0] = NONE
+        pointer[:,0,1:] = LEFT
+        pointer[:,1:,0] = UP
+
+        prev = np.empty((num, max_j + 1), dtype=np.int32)
+        prev[:] = offset
+        t = np.empty((num, max_j + 1), dtype=np.int32)
+        diag_seen = np.ones(num, dtype=bool)
+
+        for i in range(1, max_i + 1):
+            up = prev[:,1:] + np.where(diag_seen, go, ge).astype(np.int32)[:,None]
+            diag = prev[:,:-1] + profile[k,I_idx[:,i-1]]
+
+            t[:,0] = go + ge * (i - 1)
+            np.maximum(up, diag, t[:,1:])
+            t[:,1:] -= offset[1:]
+            row = np.maximum.accumulate(t, axis=1)
+            row += offset
+
+            left = row[:,:-1] + left_pen
+
+            # nwalign picks UP if up >= diag and up > left, DIAG if
+            # diag > up and diag > left and LEFT otherwise, i.e.
+            # pointer = LEFT - is_up + is_diag
+            up_wins = up >= diag
+            is_up = up_wins & (up > left)
+            is_diag = ~up_wins & (left < diag)
+            ptr = pointer[:,i,1:]
+            np.add(is_diag, LEFT, out=ptr, casting='unsafe')
+            np.subtract(ptr, is_up, out=ptr, casting='unsafe')
+
+            diag_seen = (is_diag & col_mask).any(axis=1)
+            prev = row
+
+        return self.traceback_scores(pointer, I, J, len_i, len_j, flip)
+
+
+    def traceback_scores(self, pointer, I, J, len_i, len_j, flip):
+        """
+        Follows the pointers of every pair back to (0,0) and sums up the
+        nwalign.score_alignment score: substitution cost for aligned
+        characters, gap_open for the first and gap_extend for every following
+        column of a gap run.
+        """
+        go = self.gap_open
+        ge = self.gap_extend
+        mat = self.cost_matrix
+        num = len(len_i)
+        k = np.arange(num)
+
+        i = len_i.copy()
+        j = len_j.copy()
+        score = np.zeros(num, dtype=np.int64)
+        prev_gap = np.zeros(num, dtype=bool)
+
+        while True:
+            p = pointer[k,i,j]
+            is_diag = p == DIAG
+            is_gap = (p == LEFT) | (p == UP)
+
+            # the column processed in the previous iteration opened its gap
+            # run (we are walking the alignment backwards)
+            score += np.where(prev_gap & ~is_gap, go - ge, 0)
+
+            if (p == NONE).all(): break
+
+            ci = I[k,np.maximum(i-1, 0)]
+            cj = J[k,np.maximum(j-1, 0)]
+            sub = np.where(flip, mat[ci,cj], mat[cj,ci])
+            score += np.where(is_diag, sub, 0) + np.where(is_gap, ge, 0)
+
+            i -= is_diag | (p == UP)
+            j -= is_diag | (p == LEFT)
+            prev_gap = is_gap
+
+        return score
+
+
+class ParallelAligner():
+    """
+    Keeps a fixed set of reference sequences (e.g. the kNN training set) in a
+    pool of worker processes and splits every query-vs-reference distance row
+    across them.
+    """
+    def __init__(self, engine, sequences, processes=None):
+        self.processes = processes or cpu_count()
+        self.num_sequences = len(sequences)
+        self.pool = Pool(processes=self.processes, initializer=_init_worker, initargs=(engine, sequences))
+
+        # a few chunks per worker so uneven sequence lengths even out
+        num_chunks = min(self.num_sequences, self.processes * 4) or 1
+        bounds = np.linspace(0, self.num_sequences, num_chunks + 1).astype(int)
+        self.chunks = zip(bounds[:-1], bounds[1:])
+
+
+    def distance_row(self, query, indices=None):
+        """
+        Returns distances between query and all reference sequences, or only
+        the ones listed in indices (in that order).
+        """
+        query = as_codes(query)
+
+        if indices is None:
+            jobs = [(query, lo, hi, None) for lo, hi in self.chunks]
+        else:
+            indices = np.asarray(indices, dtype=np.intp)
+            num_chunks = min(len(indices), self.processes) or 1
+            jobs = [(query, 0, 0, chunk) for chunk in np.array_split(indices, num_chunks)]
+
+        rows = self.pool.map(_distance_chunk_worker, jobs)
+        return np.concatenate(rows) if rows else np.zeros(0)
+
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+_worker_engine = None
+_worker_sequences = None
+
+def _init_worker(engine, sequences):
+    global _worker_engine, _worker_sequences
+    _worker_engine = engine
+    _worker_sequences = [as_codes(seq) for seq in sequences]
+
+
+def _distance_chunk_worker(job):
+    query, lo, hi, indices = job
+
+    if indices is None:
+        return _worker_engine.distance_row(query, _worker_sequences[lo:hi])
+
+    return _worker_engine.distance_row(query, [_worker_sequences[idx] for idx in indices])
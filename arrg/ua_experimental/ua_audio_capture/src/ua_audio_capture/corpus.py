@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+#
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Antons Rebguns. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of University of Arizona nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Antons Rebguns
+#
+
+import os
+from fnmatch import fnmatch
+
+import numpy as np
+
+
+def map_rawsound(fname):
+    """
+    Returns a read-only float64 view of a .rawsound file. The files are
+    written with array('d').tofile(), i.e. native byte order, no header.
+    """
+    if os.path.getsize(fname) == 0:
+        return np.zeros(0, dtype=np.float64)
+    return np.memmap(fname, dtype=np.float64, mode='r')
+
+
+class SoundCorpus():
+    """
+    Read-only view of a set of .rawsound/.desc recordings.
+
+    Every .rawsound file is memory-mapped as a float64 array and every .desc
+    file is parsed exactly once into a flat index of (file, action, object,
+    offset, length) records. Segments handed out by segment() are views into
+    the mapped files, no samples are copied until a caller modifies them.
+    """
+    def __init__(self, data_paths):
+        self.data_paths = data_paths
+        self.file_names = []
+        self.blobs = []
+
+        file_ids = []
+        action_ids = []
+        object_ids = []
+        offsets = []
+        lengths = []
+
+        for path in data_paths:
+            print 'Indexing sound descriptor files in %s' % path
+
+            for fname in os.listdir(path):
+                if not fnmatch(fname, '*.desc'): continue
+
+                name = os.path.splitext(fname)[0]
+                data_fname = os.path.join(path, name + '.rawsound')
+
+                file_id = len(self.blobs)
+                self.file_names.append(data_fname)
+                self.blobs.append(map_rawsound(data_fname))
+
+                desc_file = open(os.path.join(path, fname), 'r')
+                descriptors = desc_file.read().split('\n')
+                desc_file.close()
+
+                for descriptor in descriptors:
+                    if not descriptor: continue
+
+                    action_id, object_id, offset, length = descriptor.split()
+                    file_ids.append(file_id)
+                    action_ids.append(int(action_id))
+                    object_ids.append(int(object_id))
+                    offsets.append(int(offset))
+                    lengths.append(int(length))
+
+        self.file_ids = np.asarray(file_ids, dtype=np.int32)
+        self.action_ids = np.asarray(action_ids, dtype=np.int32)
+        self.object_ids = np.asarray(object_ids, dtype=np.int32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+
+
+    def __len__(self):
+        return len(self.file_ids)
+
+
+    def segment(self, idx):
+        """
+        Returns a zero-copy view of the samples described by index entry idx.
+        """
+        offset = self.offsets[idx]
+        return self.blobs[self.file_ids[idx]][offset:offset+self.lengths[idx]]
+
+
+    def segments(self, actions, objects):
+        """
+        Iterates over all descriptors in the order they appear on disk, yields
+        (action_str, object_str, sound) tuples where sound is a memory-mapped
+        view of the segment.
+        """
+        for idx in xrange(len(self)):
+            action_str = actions[self.action_ids[idx]]
+            object_str = objects[self.object_ids[idx]]
+            yield action_str, object_str, self.segment(idx)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+#
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Antons Rebguns. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of University of Arizona nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Antons Rebguns
+#
+
+
+import numpy as np
+
+
+class SomEncoder():
+    """
+    Turns spectrograms into SOM strings, i.e. the same thing as calling
+    som.bmu on every column and stringifying the (i, j) units, but with all
+    columns matched against all units in one matrix product.
+
+    Squared distances are expanded as |u|^2 - 2 u.x (the |x|^2 term does not
+    change the argmin) with the unit norms computed once. Columns where the
+    two closest units are too close to call in that form are re-checked
+    with the direct difference so the picked unit agrees with som.bmu.
+    """
+    def __init__(self, som, map_side, max_batch_bytes=1<<25):
+        units = np.asarray(som.neurons_, dtype=np.float64)
+        self.units = units.reshape(-1, units.shape[-1])
+        assert len(self.units) == map_side * map_side, "SOM does not have map_side x map_side units"
+
+        self.map_side = map_side
+        self.unit_norms = (self.units ** 2).sum(axis=1)
+        self.max_batch_bytes = max_batch_bytes
+
+        # unit (i, j) is encoded as chr(i * map_side + j + 48)
+        self.alphabet = (np.arange(len(self.units)) + 48).astype(np.uint8)
+
+
+    def bmu_indices(self, columns):
+        """
+        Returns the flat index of the best matching unit for every row of
+        columns, a (num_columns, dim) array.
+        """
+        columns = np.asarray(columns, dtype=np.float64)
+        result = np.empty(len(columns), dtype=np.intp)
+        batch = max(1, self.max_batch_bytes // (8 * len(self.units)))
+
+        for start in xrange(0, len(columns), batch):
+            x = columns[start:start+batch]
+            dist = self.unit_norms - 2 * np.dot(x, self.units.T)
+
+            best = np.argmin(dist, axis=1)
+
+            if len(self.units) > 1:
+                nearest_two = np.partition(dist, 1, axis=1)[:,:2]
+                scale = self.unit_norms.max() + (x ** 2).sum(axis=1)
+                close = np.flatnonzero(nearest_two[:,1] - nearest_two[:,0] <= 1e-9 * scale)
+
+                for row in close:
+                    best[row] = np.argmin(((self.units - x[row]) ** 2).sum(axis=1))
+
+            result[start:start+len(x)] = best
+
+        return result
+
+
+    def encode(self, sound_fft):
+        """
+        Returns the SOM string of a (freq_bins, num_frames) spectrogram.
+        """
+        return self.alphabet[self.bmu_indices(sound_fft.T)].tostring()
+
+
+    def encode_all(self, sound_ffts):
+        """
+        Returns SOM strings for a list of spectrograms, all of their columns
+        are matched in one pass.
+        """
+        if not sound_ffts: return []
+
+        counts = [sound_fft.shape[1] for sound_fft in sound_ffts]
+        encoded = self.alphabet[self.bmu_indices(np.hstack(sound_ffts).T)].tostring()
+        bounds = np.concatenate(([0], np.cumsum(counts)))
+
+        return [encoded[bounds[pos]:bounds[pos+1]] for pos in range(len(counts))]
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+#
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Antons Rebguns. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of University of Arizona nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Antons Rebguns
+#
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+class SpectrogramEngine():
+    """
+    Computes frequency binned dB spectrograms for a batch of sound segments.
+
+    The result for every segment is identical to running
+    matplotlib.mlab.specgram (hanning window, one-sided PSD scaled by
+    frequency) followed by averaging the rows between the integer
+    np.linspace edges, but all frames of all segments go through a single
+    rfft call and the binning is done with one np.add.reduceat.
+    """
+    def __init__(self, fft_n, fft_overlap, fft_freq_bins, sampling_rate=44100):
+        self.fft_n = fft_n
+        self.fft_overlap = fft_overlap
+        self.fft_freq_bins = fft_freq_bins
+        self.sampling_rate = sampling_rate
+        self.step = fft_n - fft_overlap
+
+        self.window = np.hanning(fft_n)
+
+        # one-sided PSD scaling, everything except DC (and Nyquist for even
+        # fft_n) is doubled to account for the discarded negative frequencies
+        num_freqs = fft_n // 2 + 1
+        scale = np.ones(num_freqs) * 2.0
+        scale[0] = 1.0
+        if fft_n % 2 == 0: scale[-1] = 1.0
+        self.scale = scale / (sampling_rate * (self.window ** 2).sum())
+
+        edges = np.linspace(0, num_freqs, fft_freq_bins+1).astype(int)
+        self.bin_starts = edges[:-1]
+        self.bin_widths = np.diff(edges).astype(float)
+
+
+    def frames(self, sound):
+        """
+        Returns a (num_frames, fft_n) strided view over sound, segments
+        shorter than fft_n are zero padded like mlab does.
+        """
+        sound = np.ascontiguousarray(sound, dtype=np.float64)
+
+        if len(sound) < self.fft_n:
+            padded = np.zeros(self.fft_n)
+            padded[:len(sound)] = sound
+            sound = padded
+
+        num_frames = (len(sound) - self.fft_n) // self.step + 1
+        stride = sound.strides[0]
+        return as_strided(sound, shape=(num_frames, self.fft_n), strides=(self.step*stride, stride))
+
+
+    def compute(self, sounds, batch_size=64):
+        """
+        Takes a list of 1-D sample arrays and returns a list of
+        (fft_freq_bins, num_frames) arrays, one per input sound. Sounds are
+        transformed batch_size at a time to bound the size of the stacked
+        frame matrix.
+        """
+        result = []
+
+        for batch_start in xrange(0, len(sounds), batch_size):
+            result.extend(self.compute_batch(sounds[batch_start:batch_start+batch_size]))
+
+        return result
+
+
+    def compute_batch(self, sounds):
+        all_frames = [self.frames(sound) for sound in sounds]
+        counts = [f.shape[0] for f in all_frames]
+
+        stacked = np.vstack(all_frames) * self.window
+        Pxx = np.abs(np.fft.rfft(stacked, n=self.fft_n, axis=1)) ** 2
+        Pxx *= self.scale
+        Pxx = 20 * np.log10(Pxx)
+
+        binned = np.add.reduceat(Pxx, self.bin_starts, axis=1) / self.bin_widths
+        binned = binned.T
+
+        result = []
+        start = 0
+        for count in counts:
+            result.append(np.ascontiguousarray(binned[:,start:start+count]))
+            start += count
+
+        return result
+
+
+    def compute_one(self, sound):
+        return self.compute([sound])[0]
+
+
+_engines = {}
+
+def get_engine(fft_n, fft_overlap, fft_freq_bins, sampling_rate=44100):
+    """
+    Returns a shared SpectrogramEngine, window and bin edge tables are built
+    once per parameter combination.
+    """
+    key = (fft_n, fft_overlap, fft_freq_bins, sampling_rate)
+
+    if key not in _engines:
+        _engines[key] = SpectrogramEngine(fft_n, fft_overlap, fft_freq_bins, sampling_rate)
+
+    return _engines[key]
@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+
+#
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Antons Rebguns. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of University of Arizona nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Antons Rebguns
+#
+
+import os
+import hashlib
+
+from multiprocessing import Pool
+from multiprocessing import cpu_count
+
+import numpy as np
+
+from ua_audio_capture.corpus import map_rawsound
+from ua_audio_capture.features import get_engine
+
+
+SAMPLING_RATE = 44100
+THRESHOLD = 0.02
+
+
+def rebin_time_fixed_width(s, w):
+    """
+    Averages s over consecutive non-overlapping windows of w samples, a
+    trailing partial window is dropped.
+    """
+    num_intervals = len(s) // w
+    return np.asarray(s[:num_intervals*w]).reshape(num_intervals, w).mean(axis=1)
+
+
+def segment_start(sound, window, start_offset):
+    """
+    Returns the sample index where the sound starts or -1 if the rebinned
+    amplitude never crosses the threshold.
+    """
+    binned = rebin_time_fixed_width(np.abs(sound), window)
+    above = np.flatnonzero(binned > THRESHOLD)
+
+    if len(above) == 0:
+        return -1
+
+    return max(0, above[0] * window - start_offset * SAMPLING_RATE)
+
+
+def segment_end(sound, window, start_time, end_offset):
+    """
+    Returns the sample index where the sound ends or -1 if the rebinned
+    amplitude after start_time never crosses the threshold.
+    """
+    last_index = len(sound)
+    binned = rebin_time_fixed_width(np.abs(sound), window)
+    start = int((start_time + 0.15 * SAMPLING_RATE) / window)
+    above = np.flatnonzero(binned[start:] > THRESHOLD)
+
+    if len(above) == 0:
+        return -1
+
+    end = (start + above[-1]) * window
+    return min(end + end_offset * SAMPLING_RATE, last_index)
+
+
+def fill_missing(times, action_ids):
+    """
+    Replaces -1 entries with the integer average of the detected times for
+    the same action.
+    """
+    times = np.asarray(times, dtype=np.float64)
+
+    for action_id in np.unique(action_ids):
+        of_action = action_ids == action_id
+        found = of_action & (times != -1)
+
+        if found.any():
+            times[of_action & (times == -1)] = int(times[found].sum() / found.sum())
+
+    return times
+
+
+def file_digest(fname, chunk_size=1<<24):
+    sha = hashlib.sha1()
+    f = open(fname, 'rb')
+
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk: break
+        sha.update(chunk)
+
+    f.close()
+    return sha.hexdigest()
+
+
+class FeatureCache():
+    """
+    Content addressed store of per-file featurization results. Every entry is
+    an uncompressed .npz file named after the sha1 of everything the result
+    depends on, so changing a recording or a parameter simply misses.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+
+    def key(self, *parts):
+        sha = hashlib.sha1()
+
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                sha.update(np.ascontiguousarray(part).tostring())
+            else:
+                sha.update(repr(part))
+
+        return sha.hexdigest()
+
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+
+    def load(self, key):
+        if not self.cache_dir: return None
+
+        fname = self.path(key)
+        if not os.path.exists(fname): return None
+
+        data = np.load(fname)
+        result = dict((name, data[name]) for name in data.files)
+        data.close()
+
+        return result
+
+
+    def save(self, key, **arrays):
+        if not self.cache_dir: return
+
+        # pool workers may compute the same key at once, whichever rename
+        # comes last wins and either entry is complete
+        fname = self.path(key)
+        tmp_fname = '%s.%d.tmp.npz' % (fname[:-4], os.getpid())
+        np.savez(tmp_fname, **arrays)
+        os.rename(tmp_fname, fname)
+
+
+def _map_segments(fname, offsets, lengths):
+    blob = map_rawsound(fname)
+    return [blob[offset:offset+length] for offset, length in zip(offsets, lengths)]
+
+
+def _detect_starts(job):
+    idx, fname, offsets, lengths, params, cache_dir = job
+    cache = FeatureCache(cache_dir)
+    digest = file_digest(fname)
+    window = int(params['rebin_window'] * SAMPLING_RATE)
+
+    key = cache.key('start', digest, offsets, lengths, params['rebin_window'], params['start_offset'])
+    cached = cache.load(key)
+    if cached is not None:
+        return idx, digest, cached['starts']
+
+    sounds = _map_segments(fname, offsets, lengths)
+    starts = np.asarray([segment_start(sound, window, params['start_offset']) for sound in sounds], dtype=np.float64)
+    cache.save(key, starts=starts)
+
+    return idx, digest, starts
+
+
+def _detect_ends(job):
+    idx, fname, digest, offsets, lengths, starts, params, cache_dir = job
+    cache = FeatureCache(cache_dir)
+    window = int(params['rebin_window'] * SAMPLING_RATE)
+
+    key = cache.key('end', digest, offsets, lengths, starts, params['rebin_window'], params['end_offset'])
+    cached = cache.load(key)
+    if cached is not None:
+        return idx, cached['ends']
+
+    sounds = _map_segments(fname, offsets, lengths)
+    ends = np.asarray([segment_end(sound, window, start, params['end_offset']) for sound, start in zip(sounds, starts)], dtype=np.float64)
+    cache.save(key, ends=ends)
+
+    return idx, ends
+
+
+def _compute_ffts(job):
+    idx, fname, digest, offsets, lengths, starts, ends, params, cache_dir = job
+    cache = FeatureCache(cache_dir)
+
+    key = cache.key('fft', digest, offsets, lengths, starts, ends, params['fft_n'], params['fft_overlap'], params['fft_freq_bins'])
+    cached = cache.load(key)
+    if cached is not None:
+        return idx, cached['ffts'], cached['frame_counts']
+
+    engine = get_engine(params['fft_n'], params['fft_overlap'], params['fft_freq_bins'], SAMPLING_RATE)
+    sounds = _map_segments(fname, offsets, lengths)
+    ffts = engine.compute([sound[int(start):int(end)] for sound, start, end in zip(sounds, starts, ends)])
+
+    # all spectrograms of a file are stored side by side along the time axis
+    frame_counts = np.asarray([fft.shape[1] for fft in ffts], dtype=np.int64)
+    if ffts: ffts = np.hstack(ffts)
+    else: ffts = np.zeros((params['fft_freq_bins'], 0))
+    cache.save(key, ffts=ffts, frame_counts=frame_counts)
+
+    return idx, ffts, frame_counts
+
+
+class CorpusFeaturizer():
+    """
+    Runs sound start/end detection and spectrogram computation for every
+    .rawsound file of a corpus across a process pool, results of every stage
+    are cached per file in a FeatureCache.
+
+    Start and end times that could not be detected are replaced by the
+    per-action average over the whole corpus, which is why the work is split
+    into three map stages with a (cheap) reduction in between.
+    """
+    def __init__(self, params, cache_dir, processes=None):
+        self.params = params
+        self.cache_dir = cache_dir
+        self.processes = processes or cpu_count()
+
+        FeatureCache(cache_dir)
+
+
+    def run_stage(self, func, jobs):
+        # largest files first so the pool does not idle on a long tail
+        jobs = sorted(jobs, key=lambda job: -os.path.getsize(job[1]))
+
+        if self.processes == 1:
+            return sorted(map(func, jobs))
+
+        pool = Pool(processes=self.processes)
+        try:
+            results = sorted(pool.imap_unordered(func, jobs))
+        finally:
+            pool.close()
+            pool.join()
+
+        return results
+
+
+    def run(self, corpus, actions, objects):
+        """
+        Returns action labels, object labels and binned FFTs in corpus order,
+        i.e. the same thing AudioClassifier.calculate_fft returns.
+        """
+        params = self.params
+        num_files = len(corpus.file_names)
+        by_file = [np.flatnonzero(corpus.file_ids == file_id) for file_id in range(num_files)]
+
+        print 'Detecting sound start times in %d files using %d processes' % (num_files, self.processes)
+        jobs = [(file_id, corpus.file_names[file_id], corpus.offsets[inds], corpus.lengths[inds], params, self.cache_dir)
+                for file_id, inds in enumerate(by_file)]
+
+        digests = [None] * num_files
+        starts = np.zeros(len(corpus))
+
+        for file_id, digest, file_starts in self.run_stage(_detect_starts, jobs):
+            digests[file_id] = digest
+            starts[by_file[file_id]] = file_starts
+
+        starts = fill_missing(starts, corpus.action_ids)
+
+        print 'Detecting sound end times'
+        jobs = [(file_id, corpus.file_names[file_id], digests[file_id], corpus.offsets[inds], corpus.lengths[inds], starts[inds], params, self.cache_dir)
+                for file_id, inds in enumerate(by_file)]
+
+        ends = np.zeros(len(corpus))
+
+        for file_id, file_ends in self.run_stage(_detect_ends, jobs):
+            ends[by_file[file_id]] = file_ends
+
+        ends = fill_missing(ends, corpus.action_ids)
+
+        print 'Calculating FFTs'
+        jobs = [(file_id, corpus.file_names[file_id], digests[file_id], corpus.offsets[inds], corpus.lengths[inds], starts[inds], ends[inds], params, self.cache_dir)
+                for file_id, inds in enumerate(by_file)]
+
+        processed_ffts = [None] * len(corpus)
+
+        for file_id, ffts, frame_counts in self.run_stage(_compute_ffts, jobs):
+            bounds = np.concatenate(([0], np.cumsum(frame_counts)))
+            for pos, idx in enumerate(by_file[file_id]):
+                processed_ffts[idx] = ffts[:,bounds[pos]:bounds[pos+1]]
+
+        action_labels = [actions[action_id] for action_id in corpus.action_ids]
+        object_labels = [objects[object_id] for object_id in corpus.object_ids]
+
+        return action_labels, object_labels, processed_ffts
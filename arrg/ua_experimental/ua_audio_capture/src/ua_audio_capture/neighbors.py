@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+#
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Antons Rebguns. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of University of Arizona nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Antons Rebguns
+#
+
+import numpy as np
+
+from ua_audio_capture.alignment import as_codes
+
+
+def nearest(distances, k):
+    """
+    Returns indices of the k smallest distances, ties are broken by index
+    exactly like sorting (distance, index) tuples in Bio.kNN does.
+    """
+    order = np.argsort(distances, kind='mergesort')
+    return order[:k]
+
+
+def vote(knn_model, neighbors, distances, weight_fn):
+    """
+    Sums weight_fn(distance) of the given neighbours per class.
+    """
+    weights = {}
+
+    for klass in knn_model.classes:
+        weights[klass] = 0.0
+
+    for idx, dist in zip(neighbors, distances):
+        klass = knn_model.ys[idx]
+        weights[klass] = weights[klass] + weight_fn(dist)
+
+    return weights
+
+
+def knn_weights(knn_model, distances, weight_fn):
+    """
+    Same result as Bio.kNN.calculate(knn_model, x, weight_fn, distance_fn)
+    but takes the row of distances between x and every training sequence,
+    precomputed in one batched call. weight_fn receives the distance to a
+    neighbour instead of the (x, neighbour) pair so it does not have to
+    align them a second time.
+    """
+    neighbors = nearest(distances, knn_model.k)
+    return vote(knn_model, neighbors, distances[neighbors], weight_fn)
+
+
+class SequenceIndex():
+    """
+    Exact k nearest neighbour search over a fixed set of SOM strings under
+    the AlignmentEngine distance.
+
+    Every alignment scores at most what its gap columns and substitutions
+    can contribute given the two lengths (at least |m-n| gap columns) and
+    the BMU histograms (no more identical aligned pairs than the histogram
+    overlap). That gives a lower bound on the distance to every indexed
+    sequence for the price of a histogram intersection. Candidates are
+    aligned in order of increasing bound, batch_size at a time, until the
+    next bound exceeds the k-th best distance found so far, so the result is
+    the same top k (including tie breaking) as a full scan.
+    """
+    def __init__(self, engine, sequences, aligner=None, batch_size=64):
+        self.engine = engine
+        self.aligner = aligner
+        self.batch_size = batch_size
+
+        self.sequences = [as_codes(seq) for seq in sequences]
+        self.lengths = np.asarray([len(seq) for seq in self.sequences], dtype=np.int64)
+
+        # BMU histograms over the alphabet of the indexed strings, the last
+        # column collects characters that only ever show up in queries
+        self.alphabet = np.unique(np.concatenate(self.sequences + [np.zeros(0, dtype=np.intp)]))
+        self.histograms = np.zeros((len(self.sequences), len(self.alphabet) + 1), dtype=np.int64)
+
+        for idx, seq in enumerate(self.sequences):
+            self.histograms[idx] = self.histogram(seq)
+
+        self.last_evaluated = 0
+
+
+    def __len__(self):
+        return len(self.sequences)
+
+
+    def histogram(self, seq):
+        size = len(self.alphabet)
+        pos = np.minimum(np.searchsorted(self.alphabet, seq), max(size - 1, 0))
+        if size: pos[self.alphabet[pos] != seq] = size
+        else: pos[:] = size
+        return np.bincount(pos, minlength=size + 1)
+
+
+    def score_bounds(self, query):
+        """
+        Returns an upper bound on the alignment score of query against every
+        indexed sequence.
+        """
+        go = self.engine.gap_open
+        ge = self.engine.gap_extend
+        mat = self.engine.cost_matrix
+
+        # best identical and best differing substitution over the characters
+        # that can actually meet in an alignment
+        chars = np.union1d(self.alphabet, query)
+        sub = mat[chars][:,chars]
+        best_match = sub.diagonal().max() if len(chars) else 0
+        off_diag = sub[~np.eye(len(chars), dtype=bool)]
+        best_mismatch = off_diag.max() if len(off_diag) else best_match
+        match_bonus = max(0, best_match - best_mismatch)
+
+        q = len(query)
+        L = self.lengths
+        shortest = np.minimum(q, L)
+        overlap = np.minimum(self.histograms[:,:-1], self.histogram(query)[:-1]).sum(axis=1)
+
+        # the bound is piecewise linear in the number of aligned pairs P, so
+        # its maximum is attained at one of the breakpoints
+        split = (q + L - 1) // 3
+        candidates = np.vstack([np.zeros_like(L), overlap, split, split + 1, shortest]).T
+        P = np.clip(candidates, 0, shortest[:,None])
+
+        gaps = q + L[:,None] - 2 * P
+        if go >= ge: runs = np.minimum(P + 1, gaps)
+        else: runs = np.minimum(1, gaps)
+
+        gap_score = runs * go + (gaps - runs) * ge
+        sub_score = P * best_mismatch + np.minimum(P, overlap[:,None]) * match_bonus
+
+        return (gap_score + sub_score).max(axis=1)
+
+
+    def lower_bounds(self, query):
+        query = as_codes(query)
+        return -self.score_bounds(query) / (len(query) + self.lengths + 0.0)
+
+
+    def distances(self, query, indices):
+        if self.aligner is not None:
+            return self.aligner.distance_row(query, indices)
+        return self.engine.distance_row(query, [self.sequences[idx] for idx in indices])
+
+
+    def knn(self, query, k):
+        """
+        Returns indices and distances of the k nearest indexed sequences,
+        ordered by (distance, index).
+        """
+        query = as_codes(query)
+        bounds = self.lower_bounds(query)
+        order = np.lexsort((np.arange(len(bounds)), bounds))
+
+        distances = np.empty(len(bounds))
+        distances.fill(np.inf)
+        kth = None
+        start = 0
+        evaluated = 0
+        batch_size = max(k, self.batch_size)
+
+        while start < len(order):
+            batch = order[start:start+batch_size]
+            if kth is not None: batch = batch[bounds[batch] <= kth]
+            if len(batch) == 0: break
+
+            distances[batch] = self.distances(query, batch)
+            start += batch_size
+            evaluated += len(batch)
+
+            if evaluated >= k: kth = np.sort(distances)[k-1]
+
+        self.last_evaluated = evaluated
+        neighbors = nearest(distances, k)
+
+        return neighbors, distances[neighbors]
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+#
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Antons Rebguns. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of University of Arizona nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Antons Rebguns
+#
+
+
+from Queue import Queue
+from Queue import Empty
+from threading import Thread
+from threading import Event
+
+import numpy as np
+
+
+class ChunkedRecorder():
+    """
+    Appends float64 samples to an open .rawsound file from a background
+    thread.
+
+    Incoming samples are copied into preallocated chunk_size arrays, full
+    chunks are queued to the writer thread and handed back for reuse once
+    they are on disk, so memory stays at num_chunks * chunk_size samples no
+    matter how long the recording runs (an extra chunk is allocated only if
+    the disk falls behind).
+    """
+    def __init__(self, f, chunk_size=1<<16, num_chunks=16):
+        self.f = f
+        self.chunk_size = chunk_size
+
+        self.free = Queue()
+        for i in range(num_chunks):
+            self.free.put(np.empty(chunk_size))
+
+        self.pending = Queue()
+        self.chunk = self.free.get()
+        self.fill = 0
+
+        # number of samples appended so far, i.e. the offset (in samples) the
+        # next sample will be written at
+        self.position = f.tell() // 8
+
+        self.writer = Thread(target=self.write_chunks)
+        self.writer.daemon = True
+        self.writer.start()
+
+
+    def append(self, samples):
+        samples = np.asarray(samples, dtype=np.float64)
+        pos = 0
+
+        while pos < len(samples):
+            take = min(self.chunk_size - self.fill, len(samples) - pos)
+            self.chunk[self.fill:self.fill+take] = samples[pos:pos+take]
+            self.fill += take
+            pos += take
+
+            if self.fill == self.chunk_size:
+                self.submit()
+
+        self.position += len(samples)
+
+
+    def submit(self):
+        self.pending.put((self.chunk, self.fill))
+
+        try:
+            self.chunk = self.free.get_nowait()
+        except Empty:
+            self.chunk = np.empty(self.chunk_size)
+
+        self.fill = 0
+
+
+    def flush(self):
+        """
+        Blocks until every appended sample is written to the file.
+        """
+        if self.fill: self.submit()
+
+        done = Event()
+        self.pending.put((None, done))
+        done.wait()
+
+
+    def truncate(self, position):
+        """
+        Drops everything appended after position (in samples).
+        """
+        self.flush()
+        self.f.truncate(position * 8)
+        self.f.seek(position * 8)
+        self.position = position
+
+
+    def read(self, offset, length):
+        """
+        Returns length samples starting at offset, flush first.
+        """
+        f = open(self.f.name, 'rb')
+        f.seek(offset * 8)
+        data = np.fromfile(f, dtype=np.float64, count=length)
+        f.close()
+        return data
+
+
+    def close(self):
+        self.flush()
+        self.pending.put(None)
+        self.writer.join()
+
+
+    def write_chunks(self):
+        while True:
+            item = self.pending.get()
+
+            if item is None:
+                break
+
+            chunk, fill = item
+
+            # a flush request carries the event to set instead of a chunk
+            if chunk is None:
+                self.f.flush()
+                fill.set()
+                continue
+
+            self.f.write(chunk[:fill].tostring())
+            self.free.put(chunk)
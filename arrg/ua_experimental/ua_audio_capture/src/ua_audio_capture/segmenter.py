@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+#
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Antons Rebguns. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of University of Arizona nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Antons Rebguns
+#
+
+
+import numpy as np
+
+from ua_audio_capture.featurize import SAMPLING_RATE
+from ua_audio_capture.featurize import THRESHOLD
+
+
+ONSET, OFFSET = 0, 1
+
+
+class StreamingSegmenter():
+    """
+    Finds sounds in a single channel stream of samples as they arrive.
+
+    Samples are averaged (absolute value) over consecutive windows of
+    window samples. A segment starts at the first window above THRESHOLD,
+    moved start_offset seconds back, and ends end_offset seconds after the
+    start of the last loud window, once hangover seconds have passed
+    without another one (or the segment reached max_length seconds).
+
+    Onset and offset are the values featurize.segment_start and
+    featurize.segment_end compute on the stretch of stream between the end
+    of the previous segment and the point the offset was detected at. The
+    only difference is a segment with no loud window after the 0.15 second
+    guard, which the batch code marks with -1; here it ends end_offset
+    seconds after the guard instead.
+
+    While no sound is active only the samples of the current window and
+    start_offset seconds of history are kept.
+    """
+    def __init__(self, window, start_offset, end_offset, hangover=0.5, max_length=5.0,
+                 sampling_rate=SAMPLING_RATE, threshold=THRESHOLD):
+        self.window = window
+        self.start_offset = start_offset * sampling_rate
+        self.end_offset = end_offset * sampling_rate
+        self.guard = 0.15 * sampling_rate
+        self.hangover_bins = max(1, int(np.ceil(hangover * sampling_rate / window)))
+        self.max_length = int(max_length * sampling_rate)
+        self.threshold = threshold
+
+        self.history = int(np.ceil(self.start_offset)) + window
+
+        # absolute index of the next sample and of the first sample of the
+        # current (batch equivalent) recording, which is always on a window
+        # boundary
+        self.position = 0
+        self.origin = 0
+
+        self.bin = np.empty(window)
+        self.bin_fill = 0
+
+        # kept samples are chunks[...] starting at absolute index kept_start
+        self.chunks = []
+        self.kept = 0
+        self.kept_start = 0
+
+        self.onset = None
+
+
+    def push(self, samples):
+        """
+        Feeds the next block of samples, returns a list of events in order:
+        (ONSET, sample) and (OFFSET, sample, segment) with absolute sample
+        indices and the segment samples between onset and offset.
+        """
+        samples = np.asarray(samples, dtype=np.float64)
+        events = []
+        pos = 0
+
+        while pos < len(samples):
+            # complete a partially filled window first, then take whole
+            # windows straight from the block
+            if self.bin_fill or len(samples) - pos < self.window:
+                take = min(self.window - self.bin_fill, len(samples) - pos)
+                self.bin[self.bin_fill:self.bin_fill+take] = samples[pos:pos+take]
+                self.bin_fill += take
+                self.keep(samples[pos:pos+take])
+                pos += take
+
+                if self.bin_fill == self.window:
+                    self.bin_fill = 0
+                    means = np.abs(self.bin).reshape(1, self.window).mean(axis=1)
+                    self.process_bins(means, events)
+            else:
+                count = (len(samples) - pos) // self.window
+                block = samples[pos:pos+count*self.window]
+                means = np.abs(block).reshape(count, self.window).mean(axis=1)
+
+                # windows are handled one at a time since an offset moves the
+                # origin, so only keep samples up to the window being handled
+                for idx in range(count):
+                    self.keep(block[idx*self.window:(idx+1)*self.window])
+                    self.process_bins(means[idx:idx+1], events)
+
+                pos += count * self.window
+
+        return events
+
+
+    def keep(self, samples):
+        self.chunks.append(samples)
+        self.kept += len(samples)
+        self.position += len(samples)
+
+        if self.onset is None:
+            # drop whole chunks that are older than the history we need
+            while self.chunks and self.kept - len(self.chunks[0]) >= self.history:
+                self.kept -= len(self.chunks[0])
+                self.kept_start += len(self.chunks[0])
+                self.chunks.pop(0)
+
+
+    def samples(self, start, end):
+        data = np.concatenate(self.chunks) if self.chunks else np.zeros(0)
+        return data[start-self.kept_start:end-self.kept_start]
+
+
+    def process_bins(self, means, events):
+        for mean in means:
+            # index of the window that just completed, relative to origin
+            idx = (self.position - self.origin) // self.window - 1
+            loud = mean > self.threshold
+
+            if self.onset is None:
+                if loud:
+                    self.onset = max(0, idx * self.window - self.start_offset)
+                    self.guard_bin = int((self.onset + self.guard) / self.window)
+                    self.last_loud = None
+                    self.quiet_bins = 0
+                    events.append((ONSET, self.origin + int(self.onset)))
+                continue
+
+            if idx < self.guard_bin:
+                continue
+
+            if loud:
+                self.last_loud = idx
+                self.quiet_bins = 0
+            else:
+                self.quiet_bins += 1
+
+            length = self.position - self.origin - int(self.onset)
+            if self.quiet_bins >= self.hangover_bins or length >= self.max_length:
+                events.append(self.finish())
+
+
+    def finish(self):
+        recorded = self.position - self.origin
+        last_loud = self.last_loud
+
+        if last_loud is None:
+            last_loud = self.guard_bin
+
+        end = min(last_loud * self.window + self.end_offset, recorded)
+        start = self.origin + int(self.onset)
+        stop = self.origin + int(end)
+        segment = self.samples(start, stop)
+
+        # the next recording starts where this one was cut off
+        self.origin = self.position
+        self.onset = None
+        self.chunks = []
+        self.kept = 0
+        self.kept_start = self.position
+
+        return (OFFSET, stop, segment)
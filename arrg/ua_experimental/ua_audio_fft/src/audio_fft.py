@@ -4,7 +4,8 @@ import rospy
 import sys
 import traceback
 import getopt
-from scipy.fftpack import fft, fftshift
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
 
 from ua_audio_msgs.msg import AudioRawStream
 from ua_audio_msgs.msg import TransformedStream
@@ -17,13 +18,16 @@ class audio_fft(object):
         self.pub = rospy.Publisher('transform_audio',TransformedStream)
         self.parse_cline(argv)
         self.first_time = True
+        self.pending = []
 
     def parse_cline(self,argv):
         self.wszp = 0.25
         self.ovrp = 0.125
         self.pwr = True
+        self.window_fn = 'none'
+        self.frames_per_msg = 1
         try:
-            opts, args = getopt.getopt(argv, 'w:o:p:', ['window-size=','overlap=','powers_of_two='])
+            opts, args = getopt.getopt(argv, 'w:o:p:f:b:', ['window-size=','overlap=','powers_of_two=','window-function=','frames-per-message='])
         except:
             traceback.print_exc()
             rospy.loginfo(rospy.get_name()+': Command line fail')
@@ -39,12 +43,20 @@ class audio_fft(object):
                 if arg=='False':
                     self.pwr = False
                 rospy.loginfo(rospy.get_name()+': powers_of_two='+str(self.pwr))
+            elif opt in ('-f','--window-function'):
+                rospy.loginfo(rospy.get_name()+': window-function='+arg)
+                self.window_fn = arg
+            elif opt in ('-b','--frames-per-message'):
+                rospy.loginfo(rospy.get_name()+': frames-per-message='+arg)
+                self.frames_per_msg = int(arg)
         if self.wszp <= 0:
             self.wszp = 0.25
         if self.ovrp <= 0:
             self.ovrp = 0.125
         if self.ovrp > self.wszp:
             self.ovrp = self.wszp
+        if self.frames_per_msg < 1:
+            self.frames_per_msg = 1
 
     def init_freq(self,data):
         self.first_time = False
@@ -72,30 +84,91 @@ class audio_fft(object):
         rospy.loginfo(rospy.get_name()+': From frequency %d, using window-size %d and overlap %d.',data.sample_rate,self.wsz,self.ovr)
         self.nUniquePts = (self.wsz+1)/2 + (self.wsz+1)%2
 
+        # as before the transform is taken over the first wsz-1 samples of
+        # every window, points above the Nyquist point of that length mirror
+        # the ones below it
+        self.nfft = self.wsz - 1
+        self.bins = np.minimum(np.arange(self.nUniquePts), self.nfft - np.arange(self.nUniquePts))
+
+        if self.window_fn == 'none':
+            self.window = None
+        else:
+            self.window = getattr(np, self.window_fn)(self.nfft)
+
+        # scale by the number of points so that the magnitude does not depend
+        # on the length of the signal or on its sampling frequency, square it
+        # to get the power and double everything but DC (and the Nyquist point
+        # for an even number of points)
+        self.scale = np.ones(self.nUniquePts) * 2.0 / float(self.wsz)**2
+        self.scale[0] /= 2.0
+        if self.wsz % 2 == 0:
+            self.scale[-1] /= 2.0
+
+        # circular buffer, every sample is stored twice (at i and i + cap)
+        # so any window of unread samples is a contiguous slice
+        self.cap = max(2 * self.wsz, 1 << 14)
+        self.buf = np.zeros(2 * self.cap, dtype=np.float32)
+        self.start = 0      # first sample of the next window
+        self.end = 0        # number of samples received
+
+    def write(self, samples):
+        pos = self.end % self.cap
+        first = min(len(samples), self.cap - pos)
+        self.buf[pos:pos+first] = samples[:first]
+        self.buf[pos+self.cap:pos+self.cap+first] = samples[:first]
+        rest = len(samples) - first
+        self.buf[:rest] = samples[first:]
+        self.buf[self.cap:self.cap+rest] = samples[first:]
+        self.end += len(samples)
+
+    def frames(self):
+        """
+        Returns all complete windows as a (num_frames, wsz) view and moves
+        past them.
+        """
+        available = self.end - self.start
+        if available < self.wsz:
+            return None
+        count = (available - self.wsz) / self.ovr + 1
+        stride = self.buf.strides[0]
+        frames = as_strided(self.buf[self.start % self.cap:],
+                            shape=(count, self.wsz), strides=(self.ovr*stride, stride))
+        self.start = min(self.start + count * self.ovr, self.end)
+        return frames
+
+    def transform(self, frames):
+        x = frames[:,:self.nfft].astype(np.float64)
+        if self.window is not None:
+            x = x * self.window
+        p = np.abs(np.fft.rfft(x, n=self.nfft, axis=1)[:,self.bins]) ** 2
+        return p * self.scale
+
     def callback(self,data):
         
         if(self.first_time):
-            self.data = data.samples
             self.init_freq(data)
-        else:
-            self.data = self.data + data.samples
-
-        while len(self.data) >= self.wsz:
-            p = fft(self.data[0:self.wsz-1]) # take the fourier transform 
-            p = p[0:self.nUniquePts]
-            p = abs(p)
-            p = p / float(self.wsz) # scale by the number of points so that
-                             # the magnitude does not depend on the length 
-                             # of the signal or on its sampling frequency  
-            p = p**2  # square it to get the power 
-            # odd nfft excludes Nyquist point
-            if self.wsz % 2 > 0: # we've got odd number of points fft
-                p[1:len(p)] = p[1:len(p)] * 2
-            else:
-                p[1:len(p) -1] = p[1:len(p) - 1] * 2 # we've got even number of points fft
-            #rospy.loginfo(rospy.get_name()+': publishing %d datapoints.', len(p))
-            self.data = self.data[self.ovr:len(self.data)]
-            self.pub.publish(p,1,data.num_channels,data.sample_rate,self.nUniquePts,self.wsz,self.ovr)
+
+        samples = np.asarray(data.samples, dtype=np.float32)
+
+        while len(samples):
+            # never overwrite samples that are not part of a window yet
+            space = self.cap - (self.end - self.start)
+            if space == 0:
+                self.publish(self.transform(self.frames()), data)
+                continue
+            self.write(samples[:space])
+            samples = samples[space:]
+            frames = self.frames()
+            if frames is not None:
+                self.publish(self.transform(frames), data)
+
+    def publish(self, spectra, data):
+        self.pending.extend(spectra)
+        while len(self.pending) >= self.frames_per_msg:
+            group = self.pending[:self.frames_per_msg]
+            self.pending = self.pending[self.frames_per_msg:]
+            #rospy.loginfo(rospy.get_name()+': publishing %d frames.', len(group))
+            self.pub.publish(np.concatenate(group),1,data.num_channels,data.sample_rate,self.nUniquePts,self.wsz,self.ovr)
             #Currently the '1' indicates that it is fft transform. Other transforms can be indicated by other integers.
 
 if __name__ == '__main__':
@@ -24,7 +24,8 @@ class plot_fft(object):
         #rospy.loginfo(rospy.get_name()+": I received %d datapoints.", data.num_points)
         freqArray = arange(0, data.num_points, 1.0) * (data.orig_rate/data.num_points);
         self.fig.clear()
-        logpower = 10*log10(data.stream)
+        # messages may carry several frames, show the most recent one
+        logpower = 10*log10(data.stream[-data.num_points:])
         self.minpower = min((self.minpower, min(logpower)))
         self.maxpower = max((self.maxpower, max(logpower)))
         plot(freqArray/1000, logpower, color='k')
@@ -1,11 +1,12 @@
 from numpy import *
-from scipy.special import psi
-from scipy.special import polygamma
-from scipy.special import gamma
-from scipy.special import gammaln
 from numpy.random.mtrand import dirichlet
 import pickle
 
+import roslib; roslib.load_manifest('ua_audio_infomax')
+from ua_audio_infomax.PDF import get_pdf_store
+from ua_audio_infomax.dirichlet import fit_dirichlet
+from ua_audio_infomax.dirichlet import DirichletEstimator
+
 
 action_names = ['grasp',        # 0
                 'lift',         # 1
@@ -42,76 +43,35 @@ def get_fake_data(k, N):
 
 
 def get_real_data_old(action, category):
-    pkl_file = open('/tmp/obj_pdf.pkl', 'rb')
-    pdfs = pickle.load(pkl_file)
-    pkl_file.close()
-    
-    d = pdfs[action][category]
-    D = zeros((len(d), len(object_names)))
-    
-    for idx,pdf in enumerate(d):
-        D[idx] = [pdf[obj] for obj in object_names]
-        
-    return D
+    store = get_pdf_store('/tmp/obj_pdf.pkl', action_names, object_names)
+    return array(store.rows(action_names.index(action), object_names.index(category)))
 
 
 def get_real_data(action, category):
-    pkl_file = open('/tmp/proportions.pkl', 'rb')
-    pdfs,_,_ = pickle.load(pkl_file)
-    pkl_file.close()
-    
-    return pdfs[action][category]
-
-
-def invert_psi(y):
-    y_greater = exp(y) + 0.5
-    y_less = -1.0 / (y-psi(1))
-    
-    x = where(y >= -2.22, y_greater, y_less)
-    
-    for i in range(5):
-        x = x - (psi(x) - y) / polygamma(1, x)
-        
-    return x
+    store = get_pdf_store('/tmp/proportions.pkl', action_names, object_names)
+    return array(store.rows(action_names.index(action), object_names.index(category)))
 
 
 def compute_alphas(D):
-    N = D.shape[0]
-    k = D.shape[1]
-    
-    log_p_bar = log(D).mean(axis=0)
-    
-    alphas = ones(k, dtype=float)
-    
-    last_log_like = -float('inf')
-    diff = float('inf')
-    
-    while diff > 1e-9:
-        psi_alpha_new = psi(alphas.sum()) + log_p_bar
-        alphas = invert_psi(psi_alpha_new)
-        term1 = N * gammaln(alphas.sum())
-        term2 = N * gammaln(alphas).sum()
-        term3 = N * ((alphas-1.0)*log_p_bar).sum()
-        log_like = term1 - term2 + term3
-        diff = log_like - last_log_like
-        last_log_like = log_like
-        
-    return alphas
+    return fit_dirichlet(log(D).mean(axis=0), [D.shape[0]])[0]
+
 
 if __name__ == '__main__':
     #D = get_fake_data(10, 100)
     
-    results = {}
+    # proportions are loaded once, only pairs whose data changed since the
+    # last run are refitted (all of them in one vectorized solve)
+    datasets = {}
     
     for action in action_names:
-        results[action] = {}
         for category in object_names:
-            D = get_real_data(action, category)
-            results[action][category] = compute_alphas(D)
-            print action, category
-            print results[action][category]
+            datasets[action,category] = get_real_data(action, category)
             
-    out_pkl = open('/tmp/alphas.pkl', 'wb')
-    pickle.dump(results, out_pkl)
-    out_pkl.close()
+    estimator = DirichletEstimator('/tmp/alphas.pkl')
+    results, refitted = estimator.fit(datasets)
+    
+    print 'refitted %d of %d action/category pairs' % (len(refitted), len(datasets))
     
+    for action, category in refitted:
+        print action, category
+        print results[action][category]
@@ -39,7 +39,6 @@ runs InfoMax agent in batches and collects and plots data
 
 import os
 import sys
-import pickle
 import datetime
 
 from optparse import OptionParser
@@ -62,8 +61,13 @@ from pybrain.structure.modules import SoftmaxLayer
 from pybrain.utilities import drawGibbs
 
 from ua_audio_infomax.tasks import InfoMaxTask
+from ua_audio_infomax.tasks import BatchInfoMaxTask
+from ua_audio_infomax.tasks import read_prior_alphas
+from ua_audio_infomax.simulator import InfoMaxSimulator
 from ua_audio_infomax.environment import InfoMaxEnv
 from ua_audio_infomax.graphExperiment import graph
+from ua_audio_infomax.results import ResultsStore
+from ua_audio_infomax.results import last_per_key
 from ua_audio_infomax.msg import Action as InfomaxAction
 
 from multiprocessing import Pool
@@ -101,6 +105,17 @@ if __name__ == '__main__':
                       help='number of episodes to run the best overall agent')
     parser.add_option('-m', '--max-steps', metavar='STEPS', type='int', default=10,
                       help='number of steps per episode')
+    parser.add_option('-s', '--simulated-envs', metavar='ENVS', type='int', default=0,
+                      help='learn in an in-process simulator that averages every evaluation over ENVS episodes, '
+                           '0 learns through InfoMaxTask [default: %default]')
+    parser.add_option('-d', '--results-dir', metavar='DIR', type='string', default=None,
+                      help='directory results and checkpoints are written to, an interrupted run '
+                           'resumes from the checkpoints found there as long as it was started with '
+                           'the same options [default: a new experiment_results/<timestamp>]')
+    parser.add_option('-w', '--workers', metavar='WORKERS', type='int', default=cpu_count(),
+                      help='number of worker processes running experiments [default: %default]')
+    parser.add_option('-c', '--chunk-size', metavar='CHUNK', type='int', default=1,
+                      help='number of experiments handed to a worker at a time [default: %default]')
                       
     (options, args) = parser.parse_args(sys.argv)
     
@@ -112,7 +127,15 @@ if __name__ == '__main__':
     num_testing_episodes = options.num_testing_episodes
     num_best_test_runs = options.num_best_test_runs
     max_steps = options.max_steps
+    simulated_envs = options.simulated_envs
+    results_dir = options.results_dir
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+    num_workers = options.workers
+    chunk_size = options.chunk_size
     
+    if results_dir is None:
+        results_dir = os.path.join('experiment_results', timestamp)
+        
     print 'Using %s optimization algorithm' % algorithm.upper()
     
     # categories and objects 
@@ -141,50 +164,91 @@ if __name__ == '__main__':
                     'chalkboard_eraser',    # 9
                    ]
                    
-    # save off experiment parameters for each run
-    def pickle_metadata(filename, timestamp, netparams):
-        f = open(filename, 'w')
-        
-        pickle.dump(timestamp,f)                # timestamp
-        pickle.dump(num_categories,f)           # number of categories
-        pickle.dump(object_names,f)             # object name and category
-        pickle.dump(action_names,f)             # action names
-        
-        pickle.dump(num_experiments,f)          # number of experiments
-        pickle.dump(num_batches,f)              # number of learning batches per experiment
-        pickle.dump(num_learning_episodes,f)    # number of episodes per num_learning_episodes
-        pickle.dump(num_testing_episodes,f)     # number of testing episodes per num_learning_episodes
-        pickle.dump(num_best_test_runs,f)       # number of episodes to run the best agent
-        pickle.dump(max_steps,f)                # number of steps per episode 
-        
-        pickle.dump(netparams,f)                # parameters of trained policy
-        
-        f.close()
+    # everything that shapes the results, a run only resumes from
+    # checkpoints and series written with exactly the same parameters
+    run_params = dict(algorithm=algorithm,
+                      num_categories=num_categories,
+                      object_names=object_names,
+                      action_names=action_names,
+                      num_objects=num_objects,
+                      num_experiments=num_experiments,
+                      num_batches=num_batches,
+                      num_learning_episodes=num_learning_episodes,
+                      num_testing_episodes=num_testing_episodes,
+                      num_best_test_runs=num_best_test_runs,
+                      max_steps=max_steps,
+                      simulated_envs=simulated_envs)
+                      
+    # every series is written as the experiments go, so a crashed sweep
+    # keeps everything up to its last checkpoint and resumes from there
+    store = ResultsStore(results_dir)
+    meta = store.meta()
+    
+    if not meta:
+        store.set_meta(timestamp=timestamp, **run_params)
+    else:
+        mismatched = [name for name in sorted(run_params) if meta.get(name) != run_params[name]]
+        if mismatched:
+            parser.error('%s holds a run with different %s, not resuming it (use another --results-dir)'
+                         % (results_dir, ', '.join(mismatched)))
+        print 'Resuming run started at %s from %s' % (meta['timestamp'], results_dir)
         
+    learning_dtype = [('batch', np.int64),
+                      ('reward', np.float64),
+                      ('test_rewards', np.float64, (num_testing_episodes,))]
+                      
+    trained_dtype = [('run', np.int64),
+                     ('rewards', np.float64, (max_steps,)),
+                     ('accuracy', np.float64, (num_objects,max_steps)),
+                     ('joint_probs', np.float64, (num_objects,max_steps,num_categories)),
+                     ('actions', np.int64, (max_steps,)),
+                     ('true_objects', np.int64, (num_objects,))]
+                     
     rospy.init_node('experiment_graphing_node', anonymous=True)
     
-    def run_experiment(exp_desc):
+    def build_experiment():
         """
-        run [num_experiments] experiments, each with [num_batches] batches
-        each num_learning_episodes has [num_learning_episodes] episodes with [max_steps] per episode
+        set up environment, task, neural net, agent, and experiment
         """
-        exp_id = exp_desc[0]
-        agent = exp_desc[1]
-        experiment = exp_desc[2]
-        task = exp_desc[3]
+        if simulated_envs > 0:
+            prior_alphas = read_prior_alphas(action_names, object_names)
+            simulator = InfoMaxSimulator(object_names, action_names, num_objects, simulated_envs, prior_alphas, max_steps=max_steps)
+            task = BatchInfoMaxTask(simulator)
+        else:
+            env = InfoMaxEnv(object_names, action_names, num_objects, False)
+            task = InfoMaxTask(env, max_steps=max_steps)
+            
+        net = buildNetwork(task.outdim, task.indim, bias=True, outclass=SoftmaxLayer)
         
-        print '\n*********** STARTING EXPERIMENT %d ***********' % exp_id
+        if algorithm == 'pgpe':
+            agent = OptimizationAgent(net, PGPE(storeAllEvaluations=True,minimize=False,verbose=False))
+        elif algorithm == 'cmaes':
+            agent = OptimizationAgent(net, CMAES(minimize=False,verbose=False))
+            
+        experiment = EpisodicExperiment(task, agent)
         
-        exp_best_reward = -1000
-        exp_best_counter = 0
-        exp_agent_rewards = []
-        exp_ep_rewards = []
-        exp_best_params = []
+        return agent, experiment, task
         
-        # Learn in batches
-        exp_agent_rewards.append(0)
+    def run_experiment(exp_id):
+        """
+        run [num_batches] batches of experiment exp_id, every batch has
+        [num_learning_episodes] episodes with [max_steps] per episode
+        """
+        checkpoint_name = 'experiment_%d' % exp_id
+        checkpoint = store.load_checkpoint(checkpoint_name)
         
-        for i in range(num_batches):
+        if checkpoint is None:
+            print '\n*********** STARTING EXPERIMENT %d ***********' % exp_id
+            agent, experiment, task = build_experiment()
+            first_batch = 0
+            exp_best_reward = -1000
+            exp_best_params = None
+        else:
+            first_batch, exp_best_reward, exp_best_params, agent, experiment, task = checkpoint
+            print '\n*********** RESUMING EXPERIMENT %d AT BATCH %d ***********' % (exp_id, first_batch)
+            
+        # Learn in batches
+        for i in range(first_batch, num_batches):
             if i % 30 == 0: print '[%d] processing batch %d [best = %f]' % (exp_id, i, exp_best_reward)
             
             experiment.doEpisodes(num_learning_episodes)
@@ -192,131 +256,71 @@ if __name__ == '__main__':
             # test learned policy
             # When a num_learning_episodes is done, evaluate so we can see progress and show learning curves
             best_network, best_score = agent.learner._bestFound()
-            best_params = best_network.params
-            
-#            print '****SCORES****', i
-#            print best_score_f, best_score
-            
-#            curparams = agent.learner.bestEvaluable
-            
-#            print 'batch', i, best_score
-            #agent.learner._setInitEvaluable(curparams)
-            #curparams = agent.learner.current
-            #agent.learner.wrappingEvaluable._setParameters(curparams);
             
             # Evaluate the current learned policy for num_testing_episodes episodes
             rewards = []
             
             for test_ep in range(num_testing_episodes):
-#                    print "\t\tTESTING EP", test_ep
                 agent.newEpisode()
                 # Execute the agent in the environment without learning for one episode.
                 # This uses the current set of parameters
-                #r = agent.learner._BlackBoxOptimizer__evaluator(agent.learner.wrappingEvaluable)
-                r = task(best_network) #agent.learner._bestFound()[0])
-                #print 'bef', test_ep, r
-                #r = agent.learner._oneEvaluation(curparams)
-                #r = agent.learner._bestFound()[1]
-                #print 'aft', test_ep, r
-#                    print "\t\t\treward testing episode", test_ep, r
+                r = task(best_network)
                 rewards.append(r)
-                #testingJointProbs.append(task.objects[0].jointProb)
                 
             # average of all rewards earned by the current policy running num_testing_episodes episodes
             avg_testing_reward = np.mean(rewards)
             
-            #rospy.loginfo('\t[%d] average testing reward for batch %d is [%.5f]', exp_id, i, avg_testing_reward)
-            
-            # list of average rewards per num_learning_episodes 
-            exp_agent_rewards.append(avg_testing_reward)
-            
-            # list of reward per episode in this num_learning_episodes
-            exp_ep_rewards.append(rewards)
-            
             # compare the average reward for this evaluation of the learned policy. If it is better on average than
             # a previous one, then save off the parameters that make up the neural network so we can use it to 
             # perform a single episode
             if avg_testing_reward > exp_best_reward:
                 print '[%d] New best reward %f (change from previous is %f)' % (exp_id, avg_testing_reward, avg_testing_reward - exp_best_reward)
                 exp_best_reward = avg_testing_reward
-                exp_best_params = best_network #agent.learner.bestEvaluable
-#                exp_best_params = agent.learner.current.copy()
+                exp_best_params = best_network
                 
+            # stream the batch results, then checkpoint everything needed to
+            # continue with the next batch
+            record = np.zeros(1, dtype=learning_dtype)
+            record['batch'] = i
+            record['reward'] = avg_testing_reward
+            record['test_rewards'] = rewards
+            store.append('learning_rewards', record, shard=exp_id)
+            
+            store.save_checkpoint(checkpoint_name, (i+1, exp_best_reward, exp_best_params, agent, experiment, task))
+            
         # return parameters of the best policy in this experiment
         print '[%d] experiment best reward is %f' % (exp_id, exp_best_reward)
-        return exp_agent_rewards, exp_best_reward, exp_best_params
+        return exp_id, exp_best_reward, exp_best_params
         
     # init structures for rewards and network parameters
-    lrn_rewards = []
     best_params = []
     best_reward = -1000
     
-    num_cpus = cpu_count()
-    rospy.loginfo('Using %d CPUs for experiments', num_cpus)
-    
-    exp_desciptions = []
-    
-    for i in range(num_experiments):
-        # set up environment, task, neural net, agent, and experiment
-        env = InfoMaxEnv(object_names, action_names, num_objects, False)
-        task = InfoMaxTask(env, max_steps=max_steps)
-        net = buildNetwork(task.outdim, task.indim, bias=True, outclass=SoftmaxLayer)
-        
-        if algorithm == 'pgpe':
-            agent = OptimizationAgent(net, PGPE(storeAllEvaluations=True,minimize=False,verbose=False))
-        elif algorithm == 'cmaes':
-            agent = OptimizationAgent(net, CMAES(minimize=False,verbose=False))
-            
-        experiment = EpisodicExperiment(task, agent)
-        
-        exp_desciptions.append([i, agent, experiment, task])
-        
-    pool = Pool(processes=num_cpus)
+    rospy.loginfo('Using %d worker processes for experiments', num_workers)
     
-    res = []
-    if algorithm == 'pgpe':
-        res = pool.map(run_experiment, exp_desciptions)
-    elif algorithm == 'cmaes':
-        for desc in exp_desciptions:
-            res.append(run_experiment(desc))
+    if algorithm == 'pgpe' and num_workers > 1:
+        pool = Pool(processes=num_workers)
+        res = pool.imap_unordered(run_experiment, range(num_experiments), chunk_size)
     else:
-        for desc in exp_desciptions:
-            res.append(run_experiment(desc))
-            
-    for exp_res in res:
-        exp_agent_rewards, exp_best_reward, exp_best_params = exp_res
-        lrn_rewards.append(exp_agent_rewards)
+        pool = None
+        res = (run_experiment(exp_id) for exp_id in range(num_experiments))
         
+    for exp_id, exp_best_reward, exp_best_params in res:
         if exp_best_reward > best_reward:
             best_reward = exp_best_reward
             best_params = exp_best_params
             
+    if pool is not None:
+        pool.close()
+        pool.join()
+        
     rospy.loginfo('Global best reward is %f', best_reward)
     best_params2 = best_params.copy()
+    store.set_meta(best_reward=best_reward, best_params=best_params2)
     rospy.loginfo('Learning DONE')
-    ###################### set path to save experiment files and metadata
-    path = ""
-    #path = "data"
-    #os.system("cd .."); os.system("chmod -R 777 data")    # brute-force method to ensure we have the right permissions
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
-    #path = "./" + path + "/" + timestamp + "/"
-    #os.mkdir(path)
-    filename = "experiment.desc"
-    # save metadata, including trained policy parameters
-    pickle_metadata(path+filename, timestamp, best_params2)
-    
-    ###################### save rewards per num_learning_episodes during learning
-    outfile = path+"RewardsPerEpisode-learning.pkl"
-    f = open(outfile, 'w')
-    pickle.dump(lrn_rewards,f)
-    f.close()
     
     ###################### now run the best agent
     # need to save action trace, also a good place to insert hand-coded policy for running
-    Ep_rewards = []
-    probCorrect = []
-    Ep_rewardsHand = []
-    probCorrectHand = []
     
     # set up environment, task, neural net, agent, and experiment
     env = InfoMaxEnv(object_names, action_names, num_objects, False)
@@ -334,47 +338,38 @@ if __name__ == '__main__':
     #agent.learner.wrappingEvaluable._setParameters(best_params2)
     agent.learner._setInitEvaluable(best_params2)
     
-    joint_probs_learned = np.zeros((num_best_test_runs,num_objects,max_steps,num_categories))
-    joint_probs_handcoded = np.zeros((num_best_test_runs,num_objects,max_steps,num_categories))
-    learned_steps = []
-    handcoded_steps = []
-    
-    learned_true = []
-    handcoded_true = []
-    
-    avg_prob_learned = np.zeros((num_best_test_runs,num_objects,max_steps))
-    avg_prob_handcoded = np.zeros((num_best_test_runs,num_objects,max_steps))
-    
-    for test_run in range(num_best_test_runs):
+    # test runs finished before a crash are kept
+    first_run = 0
+    if store.exists('trained_learned') and store.exists('trained_handcoded'):
+        first_run = min(len(last_per_key(store.load(name), 'run')) for name in ('trained_learned', 'trained_handcoded'))
+        
+    for test_run in range(first_run, num_best_test_runs):
         #print "RUNNING EP", test_run
         
         # perform one episode with trained policy
         agent.newEpisode()
         task.reset()
         task.env.verbose = False
-        rewards = []
+        
+        learned = np.zeros(1, dtype=trained_dtype)[0]
+        learned['run'] = test_run
         step_counter = 0
-        steps = []
         
         #print 'executing learned policy...'
         
         while not task.isFinished():
             actionIdx = drawGibbs(agent.learner.wrappingEvaluable.activate(task.getObservation()), temperature=0)
             task.performAction(actionIdx)
-            rewards.append(task.getReward())
+            learned['rewards'][step_counter] = task.getReward()
             
             for cur_loc in range(len(task.objects)):
-                joint_probs_learned[test_run,cur_loc,step_counter] = task.objects[cur_loc].joint_alphas
-                avg_prob_learned[test_run,cur_loc,step_counter] = (np.argmax(task.objects[cur_loc].joint_prob) == task.env.objects[cur_loc])
-                #print 'l', test_run, cur_loc, step_counter, action_names[actionIdx], object_names[task.env.objects[cur_loc]], avg_prob_learned[test_run,cur_loc,step_counter], avg_prob_learned[test_run,cur_loc]
-                #print 'l', test_run, cur_loc, step_counter, action_names[actionIdx], object_names[task.env.objects[cur_loc]], joint_probs_learned[test_run,cur_loc]
+                learned['joint_probs'][cur_loc,step_counter] = task.objects[cur_loc].joint_alphas
+                learned['accuracy'][cur_loc,step_counter] = (np.argmax(task.objects[cur_loc].joint_prob) == task.env.objects[cur_loc])
                 
-            steps.append(action_names[actionIdx])
+            learned['actions'][step_counter] = actionIdx
             step_counter += 1
             
-        learned_true.append(task.env.objects)
-        learned_steps.append(steps)
-        Ep_rewards.append(rewards)
+        learned['true_objects'] = task.env.objects
         
         #print 'done\n\n'
         
@@ -382,9 +377,10 @@ if __name__ == '__main__':
         agent.newEpisode()
         task.reset(randomize=False)
         task.env.verbose = False
-        rewardsHand = []
+        
+        handcoded = np.zeros(1, dtype=trained_dtype)[0]
+        handcoded['run'] = test_run
         step_counter = 0
-        steps = []
         
         actionIdx = 0
         actions = [InfomaxAction.GRASP, InfomaxAction.LIFT, InfomaxAction.SHAKE_ROLL, InfomaxAction.SHAKE_PITCH, InfomaxAction.DROP, InfomaxAction.MOVE_LEFT]
@@ -393,64 +389,25 @@ if __name__ == '__main__':
         
         while not task.isFinished():
             task.performAction(actions[actionIdx])
-            rewardsHand.append(task.getReward())
+            handcoded['rewards'][step_counter] = task.getReward()
             
             for cur_loc in range(len(task.objects)):
-                joint_probs_handcoded[test_run,cur_loc,step_counter] = task.objects[cur_loc].joint_alphas
-                avg_prob_handcoded[test_run,cur_loc,step_counter] = (np.argmax(task.objects[cur_loc].joint_prob) == task.env.objects[cur_loc])
-                #print 'h', test_run, cur_loc, step_counter, action_names[actionIdx], object_names[task.env.objects[cur_loc]], avg_prob_handcoded[test_run,cur_loc,step_counter], avg_prob_handcoded[test_run,cur_loc]
-                #print 'h', test_run, cur_loc, step_counter, action_names[actionIdx], object_names[task.env.objects[cur_loc]], joint_probs_handcoded[test_run,cur_loc]
+                handcoded['joint_probs'][cur_loc,step_counter] = task.objects[cur_loc].joint_alphas
+                handcoded['accuracy'][cur_loc,step_counter] = (np.argmax(task.objects[cur_loc].joint_prob) == task.env.objects[cur_loc])
                 
-            steps.append(action_names[actions[actionIdx]])
+            handcoded['actions'][step_counter] = actions[actionIdx]
             actionIdx += 1
             if actionIdx >= len(actions): actionIdx = 0
             
             step_counter += 1
             
-        handcoded_true.append(task.env.objects)
-        handcoded_steps.append(steps)
-        Ep_rewardsHand.append(rewardsHand)
+        handcoded['true_objects'] = task.env.objects
+        
+        store.append('trained_learned', learned)
+        store.append('trained_handcoded', handcoded)
         
-    probCorrect = avg_prob_learned
-    probCorrectHand = avg_prob_handcoded
-    #print probCorrect
-    #print probCorrectHand
-    
-    #print joint_probs_learned
-    #print joint_probs_handcoded
-    
-    ###################### save rewards per step with the best agent
-    outfile = path+"RewardsPerStep-trained.pkl"
-    f = open(outfile, 'w')
-    pickle.dump(Ep_rewards,f)
-    pickle.dump(Ep_rewardsHand, f)
-    f.close()
-    
-    ###################### save accuracy per step with the best agent and hand-coded policy
-    outfile = path+"AccuracyPerStep.pkl"
-    f = open(outfile, 'w')
-    pickle.dump(probCorrect,f)
-    pickle.dump(probCorrectHand,f)
-    f.close()
-    
-    ###################### save joint probs per step with the best agent
-    outfile = path+"JointProbsPerStep-learned.pkl"
-    f = open(outfile, 'w')
-    
-    pickle.dump(learned_steps, f)
-    pickle.dump(joint_probs_learned, f)
-    
-    pickle.dump(handcoded_steps, f)
-    pickle.dump(joint_probs_handcoded, f)
-    
-    pickle.dump(learned_true, f)
-    pickle.dump(handcoded_true, f)
-    
-    f.close()
-    
     ###################### print metadata and plot figures
-    grapher = graph(path)
+    grapher = graph(results_dir)
     grapher.print_data()
     grapher.plot_all()
     print 'EVERYTHING IS DONE, should exit now'
-
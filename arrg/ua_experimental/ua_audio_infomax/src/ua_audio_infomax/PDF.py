@@ -30,8 +30,12 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 
+import os
 import pickle
-from numpy.random import randint
+
+import numpy as np
+
+from ua_audio_infomax.results import atomic_write
 
 
 __author__ = 'Daniel Ford, Antons Rebguns'
@@ -43,6 +47,183 @@ __maintainer__ = 'Daniel Ford'
 __email__ = 'dford@email.arizona.edu'
 
 
+def read_pdf_database(pdf_file='/tmp/obj_pdf.pkl'):
+    """
+    Loads the pdf_database from obj_pdf.pkl or (the first element of)
+    proportions.pkl.
+    """
+    pdfs_in = open(pdf_file, 'rb')
+    pdf_database = pickle.load(pdfs_in)
+    pdfs_in.close()
+    
+    # proportions.pkl holds [probs_by_action, object_names, action_names]
+    if isinstance(pdf_database, (list, tuple)): pdf_database = pdf_database[0]
+    return pdf_database
+
+
+def dense_pdf_samples(pdf_database, action_names, category_names):
+    """
+    Flattens pdf_database[action_name][category_name] (lists of
+    {category_name: p} dicts like in obj_pdf.pkl or arrays like in
+    proportions.pkl) into one (samples x categories) array. The samples of
+    (action_id, category_id) are rows offsets[action_id,category_id] to
+    offsets[action_id,category_id] + counts[action_id,category_id].
+    """
+    num_actions = len(action_names)
+    num_categories = len(category_names)
+    
+    counts = np.zeros((num_actions,num_categories), dtype=np.int64)
+    blocks = []
+    
+    for action_id, action_name in enumerate(action_names):
+        if action_name not in pdf_database: continue
+        
+        for category_id, category_name in enumerate(category_names):
+            if category_name not in pdf_database[action_name]: continue
+            pdf_samples = pdf_database[action_name][category_name]
+            
+            if isinstance(pdf_samples, np.ndarray):
+                block = np.asarray(pdf_samples, dtype=float)
+            else:
+                block = np.asarray([[pdf[obj] for obj in category_names] for pdf in pdf_samples], dtype=float)
+                
+            block = block.reshape(-1, num_categories)
+            counts[action_id,category_id] = len(block)
+            blocks.append(block)
+            
+    offsets = np.concatenate(([0], np.cumsum(counts.ravel())[:-1])).reshape(counts.shape)
+    
+    if blocks: samples = np.vstack(blocks)
+    else: samples = np.zeros((0,num_categories))
+    
+    return samples, offsets, counts
+
+
+class PDFStore():
+    """
+    Read-only dense copy of a pdf database. All sensor readings are rows of
+    one (samples x categories) array, offsets/counts say which rows belong
+    to each (action_id, category_id) pair.
+    
+    Pickles only say which pdf database the store came from, unpickling
+    reopens it through get_pdf_store instead of copying the samples.
+    """
+    def __init__(self, pdf_file, samples, offsets, counts, action_names, category_names):
+        self.pdf_file = pdf_file
+        self.samples = samples
+        self.offsets = offsets
+        self.counts = counts
+        self.action_names = list(action_names)
+        self.category_names = list(category_names)
+
+
+    def rows(self, action_id, category_id):
+        start = self.offsets[action_id,category_id]
+        return self.samples[start:start+self.counts[action_id,category_id]]
+
+
+    def __getstate__(self):
+        return (self.pdf_file, self.action_names, self.category_names)
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(get_pdf_store(*state).__dict__)
+
+
+    def sample_batch(self, action_ids, category_ids, rng=np.random):
+        """
+        draws one reading uniformly at random for every (action_id,
+        category_id) pair, returns them as rows of an array
+        """
+        action_ids = np.asarray(action_ids, dtype=np.intp)
+        category_ids = np.asarray(category_ids, dtype=np.intp)
+        counts = self.counts[action_ids,category_ids]
+        
+        if not counts.all():
+            missing = np.flatnonzero(counts == 0)[0]
+            raise ValueError('no pdf samples for action %s on %s' %
+                             (self.action_names[action_ids[missing]], self.category_names[category_ids[missing]]))
+                             
+        rows = self.offsets[action_ids,category_ids] + (rng.random_sample(counts.shape) * counts).astype(np.int64)
+        return self.samples[rows]
+
+
+def store_file_names(pdf_file):
+    base = os.path.splitext(pdf_file)[0]
+    return base + '.npy', base + '.index.npz'
+
+
+def build_pdf_store(pdf_file, action_names, category_names):
+    """
+    Converts a pickled pdf database into a store next to it: the samples go
+    to <name>.npy and the index to <name>.index.npz.
+    """
+    samples_file, index_file = store_file_names(pdf_file)
+    samples, offsets, counts = dense_pdf_samples(read_pdf_database(pdf_file), action_names, category_names)
+    source = os.stat(pdf_file)
+    
+    atomic_write(samples_file, lambda f: np.save(f, samples))
+    atomic_write(index_file, lambda f: np.savez(f, offsets=offsets, counts=counts,
+                                                action_names=np.asarray(action_names),
+                                                category_names=np.asarray(category_names),
+                                                source_mtime=source.st_mtime, source_size=source.st_size))
+
+
+def open_pdf_store(pdf_file, action_names, category_names):
+    """
+    Opens the store of pdf_file, (re)building it first if it is missing,
+    older than pdf_file or was built for different action/category names.
+    The samples are memory mapped read-only so processes forked after this
+    share the same pages.
+    """
+    samples_file, index_file = store_file_names(pdf_file)
+    
+    def load_index():
+        if not os.path.exists(samples_file) or not os.path.exists(index_file): return None
+        
+        data = np.load(index_file)
+        index = dict((name, data[name]) for name in data.files)
+        data.close()
+        
+        if index['action_names'].tolist() != list(action_names): return None
+        if index['category_names'].tolist() != list(category_names): return None
+        
+        if os.path.exists(pdf_file):
+            source = os.stat(pdf_file)
+            if index['source_mtime'] != source.st_mtime or index['source_size'] != source.st_size: return None
+            
+        return index
+        
+    index = load_index()
+    
+    if index is None:
+        build_pdf_store(pdf_file, action_names, category_names)
+        index = load_index()
+        
+    # most likely a database of another format or for other names, every
+    # sample call would fail later on
+    if not index['counts'].any():
+        raise ValueError('%s has no pdf samples for any of actions %s and categories %s' %
+                         (pdf_file, ', '.join(action_names), ', '.join(category_names)))
+                         
+    samples = np.load(samples_file, mmap_mode='r')
+    return PDFStore(pdf_file, samples, index['offsets'], index['counts'], action_names, category_names)
+
+
+_stores = {}
+
+def get_pdf_store(pdf_file, action_names, category_names):
+    """
+    Returns a shared PDFStore, every pdf database is opened once per process.
+    """
+    key = (pdf_file, tuple(action_names), tuple(category_names))
+    
+    if key not in _stores:
+        _stores[key] = open_pdf_store(pdf_file, action_names, category_names)
+        
+    return _stores[key]
+
+
 class PDF_library():
     def __init__(self, action_names, object_names):
         self.action_names = action_names
@@ -52,41 +233,27 @@ class PDF_library():
         self.read_pdf_database()
 
 
-    def read_pdf_database(self):
-        pdfs_in = open('/tmp/obj_pdf.pkl', 'rb')
-        self.pdf_database = pickle.load(pdfs_in)
-        pdfs_in.close()
+    def read_pdf_database(self, pdf_file='/tmp/obj_pdf.pkl'):
+        self.store = get_pdf_store(pdf_file, self.action_names, self.object_names)
 
 
     def sample(self, action_id, category_id):
         """
         sample randomly from PDFs for given object and action
         """
-        # select a PDF at random from the correct category
-        action_name = self.action_names[action_id]
-        category_name = self.object_names[category_id]
-        
-        pdf_samples = self.pdf_database[action_name][category_name]
-        pdf = pdf_samples[randint(len(pdf_samples))]
-        
-        # translate from map to list representation
-        return [pdf[obj] for obj in self.object_names]
+        return self.store.sample_batch([action_id], [category_id])[0].tolist()
+
+
+    def sample_batch(self, action_ids, category_ids, rng=np.random):
+        return self.store.sample_batch(action_ids, category_ids, rng)
 
 
     def read_pdf_database_new(self):
-        pdfs_in = open('/tmp/proportions.pkl', 'rb')
-        self.pdf_database, _, _ = pickle.load(pdfs_in)
-        pdfs_in.close()
+        self.read_pdf_database('/tmp/proportions.pkl')
 
 
     def sample_new(self, action_id, category_id):
         """
         sample randomly from PDFs for given object and action
         """
-        # select a PDF at random from the correct category
-        action_name = self.action_names[action_id]
-        category_name = self.object_names[category_id]
-        
-        pdf_samples = self.pdf_database[action_name][category_name]
-        return pdf_samples[randint(pdf_samples.shape[0])].tolist()
-
+        return self.sample(action_id, category_id)
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2011, Daniel Ford, Antons Rebguns
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 
+# Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 
+# Neither the name of the <ORGANIZATION> nor the names of its contributors may
+# be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+maximum likelihood estimation of the Dirichlet sensor model priors
+"""
+
+
+import os
+import pickle
+import hashlib
+
+import numpy as np
+
+from scipy.special import psi
+from scipy.special import polygamma
+from scipy.special import gammaln
+
+from ua_audio_infomax.results import atomic_pickle
+
+
+__author__ = 'Daniel Ford, Antons Rebguns'
+__copyright__ = 'Copyright (c) 2011 Daniel Ford, Antons Rebguns'
+__credits__ = 'Ian Fasel'
+
+__license__ = 'BSD'
+__maintainer__ = 'Daniel Ford'
+__email__ = 'dford@email.arizona.edu'
+
+
+def invert_psi(y):
+    """
+    x such that psi(x) = y, elementwise
+    """
+    y_greater = np.exp(y) + 0.5
+    y_less = -1.0 / (y-psi(1))
+    
+    x = np.where(y >= -2.22, y_greater, y_less)
+    
+    for i in range(5):
+        x = x - (psi(x) - y) / polygamma(1, x)
+        
+    return x
+
+
+def fit_dirichlet(log_p_bar, N, alphas=None, tol=1e-9):
+    """
+    Runs Minka's fixed-point iteration for many Dirichlets at once. Row i of
+    log_p_bar is the mean log proportion of N[i] training samples, alphas
+    (ones by default) are the starting points. Every row stops as soon as
+    its log likelihood improves by no more than tol, exactly like iterating
+    each of them on its own would.
+    """
+    log_p_bar = np.atleast_2d(np.asarray(log_p_bar, dtype=float))
+    N = np.asarray(N, dtype=float).reshape(-1)
+    
+    if alphas is None: alphas = np.ones(log_p_bar.shape, dtype=float)
+    else: alphas = np.array(alphas, dtype=float).reshape(log_p_bar.shape)
+    
+    last_log_like = np.empty(len(log_p_bar))
+    last_log_like.fill(-np.inf)
+    active = np.arange(len(log_p_bar))
+    
+    while len(active):
+        lpb = log_p_bar[active]
+        
+        psi_alpha_new = psi(alphas[active].sum(axis=1))[:,np.newaxis] + lpb
+        new_alphas = invert_psi(psi_alpha_new)
+        
+        term1 = N[active] * gammaln(new_alphas.sum(axis=1))
+        term2 = N[active] * gammaln(new_alphas).sum(axis=1)
+        term3 = N[active] * ((new_alphas-1.0)*lpb).sum(axis=1)
+        log_like = term1 - term2 + term3
+        diff = log_like - last_log_like[active]
+        
+        alphas[active] = new_alphas
+        last_log_like[active] = log_like
+        active = active[diff > tol]
+        
+    return alphas
+
+
+def data_digest(D):
+    return hashlib.sha1(np.ascontiguousarray(D, dtype=float).tostring()).hexdigest()
+
+
+class DirichletEstimator():
+    """
+    Fits the priors of all (action, category) pairs as one stacked
+    fixed-point solve and keeps them in alphas_file (the
+    alphas[action_name][category_name] map InfoMaxTask reads) together with
+    a digest of the data every pair was fitted on, stored in
+    <alphas_file>.digests. Pairs whose data did not change since the last
+    run are not refitted, pairs whose data did change are warm-started
+    from their previous estimate.
+    """
+    def __init__(self, alphas_file='/tmp/alphas.pkl', tol=1e-9):
+        self.alphas_file = alphas_file
+        self.digests_file = alphas_file + '.digests'
+        self.tol = tol
+
+
+    def load(self):
+        """
+        Returns the previously saved alphas and data digests (empty maps if
+        there are none).
+        """
+        alphas = {}
+        digests = {}
+        
+        if os.path.exists(self.alphas_file):
+            f = open(self.alphas_file, 'rb')
+            alphas = pickle.load(f)
+            f.close()
+            
+        if os.path.exists(self.digests_file):
+            f = open(self.digests_file, 'rb')
+            digests = pickle.load(f)
+            f.close()
+            
+        return alphas, digests
+
+
+    def save(self, alphas, digests):
+        atomic_pickle(self.alphas_file, alphas)
+        atomic_pickle(self.digests_file, digests)
+
+
+    def fit(self, datasets):
+        """
+        datasets maps (action_name, category_name) to an (N x categories)
+        array of observed proportions. Returns (and saves) the complete
+        alphas[action_name][category_name] map and the list of pairs that
+        had to be refitted.
+        """
+        alphas, digests = self.load()
+        
+        pairs = []
+        starts = []
+        new_digests = dict(digests)
+        
+        for pair in sorted(datasets):
+            action_name, category_name = pair
+            
+            # log of no proportions averages to nan, never save nan priors
+            if not len(datasets[pair]):
+                raise ValueError('no proportions for action %s on %s' % pair)
+                
+            digest = data_digest(datasets[pair])
+            previous = alphas.get(action_name, {}).get(category_name)
+            new_digests[pair] = digest
+            
+            if previous is not None and digests.get(pair) == digest: continue
+            
+            pairs.append(pair)
+            starts.append(previous)
+            
+        if pairs:
+            log_p_bar = np.array([np.log(datasets[pair]).mean(axis=0) for pair in pairs])
+            N = np.array([len(datasets[pair]) for pair in pairs])
+            
+            initial = np.ones(log_p_bar.shape, dtype=float)
+            for idx, start in enumerate(starts):
+                if start is not None and np.shape(start) == initial[idx].shape: initial[idx] = start
+                
+            fitted = fit_dirichlet(log_p_bar, N, initial, self.tol)
+            
+            for (action_name, category_name), pair_alphas in zip(pairs, fitted):
+                alphas.setdefault(action_name, {})[category_name] = pair_alphas
+                
+        self.save(alphas, new_digests)
+        
+        return alphas, pairs
@@ -46,6 +46,9 @@ import numpy as np
 
 from scipy import stats
 
+from ua_audio_infomax.results import ResultsStore
+from ua_audio_infomax.results import last_per_key
+
 
 __author__ = 'Daniel Ford, Antons Rebguns'
 __copyright__ = 'Copyright (c) 2011 Daniel Ford, Antons Rebguns'
@@ -59,22 +62,120 @@ __email__ = 'dford@email.arizona.edu'
 class graph():
     def __init__(self, path):
         self.path = path
-        pkl_path = os.path.join(self.path, 'experiment.desc')
-        
-        pkl = open(pkl_path)
         
-        self.timestamp = pickle.load(pkl)
-        self.numCategories = pickle.load(pkl)
-        self.object_names = pickle.load(pkl)
-        self.action_names = pickle.load(pkl)
-        self.numbExp = pickle.load(pkl)
-        self.prnts = pickle.load(pkl)
-        self.batch = pickle.load(pkl)
-        self.numTestingEps = pickle.load(pkl)
-        self.numTestRunEps = pickle.load(pkl)
-        self.maxSteps = pickle.load(pkl)
+        # results of experimentGraphingWrapper live in a ResultsStore, older
+        # runs left a set of pickles behind
+        if os.path.exists(os.path.join(self.path, 'meta.pkl')):
+            self.store = ResultsStore(self.path)
+            meta = self.store.meta()
+            
+            self.timestamp = meta['timestamp']
+            self.numCategories = meta['num_categories']
+            self.object_names = meta['object_names']
+            self.action_names = meta['action_names']
+            self.numbExp = meta['num_experiments']
+            self.prnts = meta['num_batches']
+            self.batch = meta['num_learning_episodes']
+            self.numTestingEps = meta['num_testing_episodes']
+            self.numTestRunEps = meta['num_best_test_runs']
+            self.maxSteps = meta['max_steps']
+        else:
+            self.store = None
+            pkl_path = os.path.join(self.path, 'experiment.desc')
+            
+            pkl = open(pkl_path)
+            
+            self.timestamp = pickle.load(pkl)
+            self.numCategories = pickle.load(pkl)
+            self.object_names = pickle.load(pkl)
+            self.action_names = pickle.load(pkl)
+            self.numbExp = pickle.load(pkl)
+            self.prnts = pickle.load(pkl)
+            self.batch = pickle.load(pkl)
+            self.numTestingEps = pickle.load(pkl)
+            self.numTestRunEps = pickle.load(pkl)
+            self.maxSteps = pickle.load(pkl)
+            
+            #self.params = pickle.load(pkl)
+
+
+    def load_learning_rewards(self):
+        """
+        average testing reward after every batch, one row per experiment
+        (starting with 0 before the first batch)
+        """
+        if self.store is None:
+            pkl = open(os.path.join(self.path, 'RewardsPerEpisode-learning.pkl'))
+            lrn_rewards = pickle.load(pkl)
+            pkl.close()
+            return lrn_rewards
+            
+        lrn_rewards = []
         
-        #self.params = pickle.load(pkl)
+        for exp_id, records in sorted(self.store.load_all('learning_rewards').items()):
+            records = last_per_key(records, 'batch')
+            lrn_rewards.append(np.concatenate(([0], records['reward'])))
+            
+        return lrn_rewards
+
+
+    def load_trained(self, field):
+        """
+        field of every run with the best agent, (learned, handcoded)
+        """
+        records = [last_per_key(self.store.load(series), 'run') for series in ('trained_learned', 'trained_handcoded')]
+        num_runs = min(len(r) for r in records)
+        return [r[field][:num_runs] for r in records]
+
+
+    def load_trained_rewards(self):
+        if self.store is None:
+            pkl = open(os.path.join(self.path, 'RewardsPerStep-trained.pkl'))
+            learned_rewards = np.array(pickle.load(pkl))
+            handcoded_rewards = np.array(pickle.load(pkl))
+            pkl.close()
+            return learned_rewards, handcoded_rewards
+            
+        return self.load_trained('rewards')
+
+
+    def load_accuracy(self):
+        if self.store is None:
+            pkl = open(os.path.join(self.path, 'AccuracyPerStep.pkl'))
+            probCorrect = np.array(pickle.load(pkl), dtype='float64')
+            probCorrectHand = np.array(pickle.load(pkl), dtype='float64')
+            pkl.close()
+            return probCorrect, probCorrectHand
+            
+        return self.load_trained('accuracy')
+
+
+    def load_joint_probs(self):
+        """
+        action names, joint probabilities and true objects of every run,
+        learned and handcoded
+        """
+        if self.store is None:
+            pkl = open(os.path.join(self.path, 'JointProbsPerStep-learned.pkl'))
+            
+            learned_steps = np.array(pickle.load(pkl))
+            joint_probs_learned = np.array(pickle.load(pkl))
+            
+            handcoded_steps = pickle.load(pkl)
+            joint_probs_handcoded = np.array(pickle.load(pkl))
+            
+            learned_true = np.array(pickle.load(pkl))
+            handcoded_true = np.array(pickle.load(pkl))
+            
+            pkl.close()
+        else:
+            names = np.array(self.action_names)
+            learned_actions, handcoded_actions = self.load_trained('actions')
+            learned_steps, handcoded_steps = names[learned_actions], names[handcoded_actions]
+            joint_probs_learned, joint_probs_handcoded = self.load_trained('joint_probs')
+            learned_true, handcoded_true = self.load_trained('true_objects')
+            
+        return learned_steps, joint_probs_learned, handcoded_steps, joint_probs_handcoded, learned_true, handcoded_true
 
 
     def print_data(self):
@@ -96,16 +197,8 @@ class graph():
 
 
     def plot_rewards_per_learning_episode(self, fig_path):
-        pkl_path = os.path.join(self.path, 'RewardsPerEpisode-learning.pkl')
-        pkl = open(pkl_path)
-        lrn_rewards = pickle.load(pkl)
-        pkl.close()
-        
-        pkl_path = os.path.join(self.path, 'RewardsPerStep-trained.pkl')
-        pkl = open(pkl_path)
-        learned_rewards = np.array(pickle.load(pkl))
-        handcoded_rewards = np.array(pickle.load(pkl))
-        pkl.close()
+        lrn_rewards = self.load_learning_rewards()
+        learned_rewards, handcoded_rewards = self.load_trained_rewards()
         
         hand_reward = handcoded_rewards.sum(axis=1).mean()
         
@@ -125,11 +218,7 @@ class graph():
 
 
     def plot_rewards_per_trained_step(self, fig_path):
-        pkl_path = os.path.join(self.path, 'RewardsPerStep-trained.pkl')
-        pkl = open(pkl_path)
-        learned_rewards = np.array(pickle.load(pkl))
-        handcoded_rewards = np.array(pickle.load(pkl))
-        pkl.close()
+        learned_rewards, handcoded_rewards = self.load_trained_rewards()
         
         pad = np.zeros((learned_rewards.shape[0],1))
         learned_rewards = np.hstack((pad,learned_rewards))
@@ -191,11 +280,7 @@ class graph():
 
 
     def plot_accuracy_per_step(self, fig_path):
-        pkl_path = os.path.join(self.path, 'AccuracyPerStep.pkl')
-        pkl = open(pkl_path)
-        probCorrect = np.array(pickle.load(pkl), dtype='float64')
-        probCorrectHand = np.array(pickle.load(pkl), dtype='float64')
-        pkl.close()
+        probCorrect, probCorrectHand = self.load_accuracy()
         
         pad = np.zeros((probCorrect.shape[0],probCorrect.shape[1],1))
         probCorrect = np.dstack((pad,probCorrect))
@@ -273,19 +358,7 @@ Handcoded \%% %(handcoded_row)s\\
         f.close()
 
     def plot_joint_probs_per_step(self, fig_path):
-        pkl_path = os.path.join(self.path, 'JointProbsPerStep-learned.pkl')
-        pkl = open(pkl_path)
-        
-        learned_steps = np.array(pickle.load(pkl))
-        joint_probs_learned = np.array(pickle.load(pkl))
-        
-        handcoded_steps = pickle.load(pkl)
-        joint_probs_handcoded = np.array(pickle.load(pkl))
-        
-        learned_true = np.array(pickle.load(pkl))
-        handcoded_true = np.array(pickle.load(pkl))
-        
-        pkl.close()
+        learned_steps, joint_probs_learned, handcoded_steps, joint_probs_handcoded, learned_true, handcoded_true = self.load_joint_probs()
         
         p = np.array(['']*learned_steps.shape[0])
         pad = np.reshape(p, (p.shape[0],-1))
@@ -296,11 +369,7 @@ Handcoded \%% %(handcoded_row)s\\
         joint_probs_learned = np.dstack((pad,joint_probs_learned))
         joint_probs_handcoded = np.dstack((pad,joint_probs_handcoded))
         
-        pkl_path = os.path.join(self.path, 'RewardsPerStep-trained.pkl')
-        pkl = open(pkl_path)
-        learned_rewards = np.array(pickle.load(pkl))
-        handcoded_rewards = np.array(pickle.load(pkl))
-        pkl.close()
+        learned_rewards, handcoded_rewards = self.load_trained_rewards()
         
         pad = np.zeros((learned_rewards.shape[0],1))
         learned_rewards = np.hstack((pad,learned_rewards))
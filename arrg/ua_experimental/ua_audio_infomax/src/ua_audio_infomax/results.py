@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2011, Daniel Ford, Antons Rebguns
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 
+# Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 
+# Neither the name of the <ORGANIZATION> nor the names of its contributors may
+# be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+append-only storage for experiment results and checkpoints
+"""
+
+
+import os
+import pickle
+
+import numpy as np
+
+
+__author__ = 'Daniel Ford, Antons Rebguns'
+__copyright__ = 'Copyright (c) 2011 Daniel Ford, Antons Rebguns'
+__credits__ = 'Ian Fasel'
+
+__license__ = 'BSD'
+__maintainer__ = 'Daniel Ford'
+__email__ = 'dford@email.arizona.edu'
+
+
+def atomic_write(fname, write):
+    """
+    Calls write with a file object open for writing and moves what it wrote
+    to fname in one rename, so readers and crashes never see fname half
+    written.
+    """
+    tmp_fname = '%s.%d.tmp' % (fname, os.getpid())
+    f = open(tmp_fname, 'wb')
+    write(f)
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    os.rename(tmp_fname, fname)
+
+
+def atomic_pickle(fname, obj):
+    atomic_write(fname, lambda f: pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL))
+
+
+def read_pickle(fname):
+    f = open(fname, 'rb')
+    obj = pickle.load(f)
+    f.close()
+    return obj
+
+
+class ResultsStore():
+    """
+    Directory of named series of fixed size records (numpy structured
+    arrays). Every series is split into shards, one raw append-only file
+    per shard (<series>.<shard>.dat, its dtype in <series>.<shard>.dtype),
+    so every worker process can stream the results of its own experiment
+    without locking. Records are written with a single write call and
+    flushed, a record cut short by a crash is ignored when reading and
+    cut off before the next append, so later records stay aligned.
+    
+    Series are only read when asked for, metadata and checkpoints are
+    pickles replaced atomically.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.checkpoint_path = os.path.join(path, 'checkpoints')
+        
+        if not os.path.exists(self.checkpoint_path):
+            os.makedirs(self.checkpoint_path)
+
+
+    def shard_file(self, series, shard):
+        return os.path.join(self.path, '%s.%d.dat' % (series, shard))
+
+
+    def append(self, series, records, shard=0):
+        records = np.ascontiguousarray(records)
+        fname = self.shard_file(series, shard)
+        dtype_fname = fname[:-4] + '.dtype'
+        
+        if not os.path.exists(dtype_fname):
+            atomic_pickle(dtype_fname, records.dtype.descr)
+            
+        if os.path.exists(fname):
+            size = os.path.getsize(fname)
+            whole = size // records.dtype.itemsize * records.dtype.itemsize
+            
+            if size != whole:
+                f = open(fname, 'r+b')
+                f.truncate(whole)
+                f.close()
+                
+        f = open(fname, 'ab')
+        f.write(records.tostring())
+        f.flush()
+        f.close()
+
+
+    def shards(self, series):
+        """
+        ids of all shards of series, in increasing order
+        """
+        prefix = series + '.'
+        shards = []
+        
+        for fname in os.listdir(self.path):
+            if fname.startswith(prefix) and fname.endswith('.dat'):
+                shard = fname[len(prefix):-4]
+                if shard.isdigit(): shards.append(int(shard))
+                
+        return sorted(shards)
+
+
+    def load(self, series, shard=0):
+        """
+        all complete records of one shard of series
+        """
+        fname = self.shard_file(series, shard)
+        dtype = np.dtype(read_pickle(fname[:-4] + '.dtype'))
+        
+        f = open(fname, 'rb')
+        data = f.read()
+        f.close()
+        
+        num_records = len(data) // dtype.itemsize
+        return np.frombuffer(data[:num_records*dtype.itemsize], dtype=dtype)
+
+
+    def load_all(self, series):
+        """
+        {shard: records} for every shard of series
+        """
+        return dict((shard, self.load(series, shard)) for shard in self.shards(series))
+
+
+    def exists(self, series):
+        return len(self.shards(series)) > 0
+
+
+    def set_meta(self, **meta):
+        current = self.meta()
+        current.update(meta)
+        atomic_pickle(os.path.join(self.path, 'meta.pkl'), current)
+
+
+    def meta(self):
+        fname = os.path.join(self.path, 'meta.pkl')
+        if not os.path.exists(fname): return {}
+        return read_pickle(fname)
+
+
+    def save_checkpoint(self, name, obj):
+        atomic_pickle(os.path.join(self.checkpoint_path, name + '.pkl'), obj)
+
+
+    def load_checkpoint(self, name):
+        """
+        the last checkpoint saved under name or None
+        """
+        fname = os.path.join(self.checkpoint_path, name + '.pkl')
+        if not os.path.exists(fname): return None
+        return read_pickle(fname)
+
+
+def last_per_key(records, key):
+    """
+    Keeps only the last record for every value of the key field (a series
+    resumed from a checkpoint may repeat the records written after it),
+    ordered by key.
+    """
+    if not len(records): return records
+    
+    # np.unique returns the first occurrence, so look at the records backwards
+    _, idx = np.unique(records[key][::-1], return_index=True)
+    return records[len(records) - 1 - idx]
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2011, Daniel Ford, Antons Rebguns
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 
+# Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 
+# Neither the name of the <ORGANIZATION> nor the names of its contributors may
+# be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+in-process stand-in for robotTestServer that steps many environments at once
+"""
+
+
+import numpy as np
+
+import roslib; roslib.load_manifest('ua_audio_infomax')
+
+from pybrain.utilities import Named
+
+from ua_audio_infomax.PDF import get_pdf_store
+from ua_audio_infomax.tasks import DirichletBeliefs
+from ua_audio_infomax.msg import Action as InfomaxAction
+
+
+__author__ = 'Daniel Ford, Antons Rebguns'
+__copyright__ = 'Copyright (c) 2011 Daniel Ford, Antons Rebguns'
+__credits__ = 'Ian Fasel'
+
+__license__ = 'BSD'
+__maintainer__ = 'Daniel Ford'
+__email__ = 'dford@email.arizona.edu'
+
+
+STATE_NAMES = ['init', 'grasped', 'lifted', 'placed']
+
+# same arm state machine as robotTestServer
+NEXT_STATE = {InfomaxAction.GRASP:          'grasped',
+              InfomaxAction.LIFT:           'lifted',
+              InfomaxAction.DROP:           'init',
+              InfomaxAction.SHAKE_ROLL:     'lifted',
+              InfomaxAction.PLACE:          'placed',
+              InfomaxAction.PUSH:           'init',
+              InfomaxAction.SHAKE_PITCH:    'lifted',
+              InfomaxAction.MOVE_LEFT:      'init',
+              InfomaxAction.MOVE_RIGHT:     'init',
+             }
+             
+ALLOWED_ACTIONS = {'init':     [InfomaxAction.GRASP, InfomaxAction.MOVE_LEFT, InfomaxAction.MOVE_RIGHT],
+                   'grasped':  [InfomaxAction.GRASP, InfomaxAction.LIFT, InfomaxAction.MOVE_LEFT, InfomaxAction.MOVE_RIGHT],
+                   'lifted':   [InfomaxAction.DROP, InfomaxAction.SHAKE_ROLL, InfomaxAction.PLACE, InfomaxAction.SHAKE_PITCH],
+                   'placed':   [InfomaxAction.GRASP, InfomaxAction.PUSH, InfomaxAction.MOVE_LEFT, InfomaxAction.MOVE_RIGHT],
+                  }
+                  
+LOCATION_CHANGE = {InfomaxAction.MOVE_LEFT: 1, InfomaxAction.MOVE_RIGHT: -1}
+
+
+class InfoMaxSimulator(Named):
+    """
+    Runs num_envs independent copies of the InfoMaxEnv/robotTestServer/
+    InfoMaxTask loop in lockstep on plain arrays. The arm state machine is
+    kept as (states x actions) lookup tables, sensor readings are drawn from
+    a shared PDFStore and the beliefs of all objects of all environments
+    live in a single DirichletBeliefs engine (object o of environment e is
+    row e * num_objects + o).
+    
+    Rewards and observations are the ones InfoMaxTask computes, one row per
+    environment.
+    """
+    def __init__(self, category_names, action_names, num_objects, num_envs, prior_alphas,
+                       max_steps=30, pdf_file='/tmp/obj_pdf.pkl'):
+        self.category_names = category_names
+        self.action_names = action_names
+        self.num_categories = len(category_names)
+        self.num_actions = len(action_names)
+        self.num_objects = num_objects
+        self.num_envs = num_envs
+        self.max_steps = max_steps
+        
+        self.state_ids = dict((name, idx) for idx, name in enumerate(STATE_NAMES))
+        self.allowed = np.zeros((len(STATE_NAMES),self.num_actions), dtype=bool)
+        self.next_state = np.zeros((len(STATE_NAMES),self.num_actions), dtype=np.intp)
+        self.location_change = np.zeros(self.num_actions, dtype=np.intp)
+        
+        for state_name, state_id in self.state_ids.items():
+            for action_id in range(self.num_actions):
+                self.allowed[state_id,action_id] = action_id in ALLOWED_ACTIONS[state_name]
+                self.next_state[state_id,action_id] = self.state_ids[NEXT_STATE.get(action_id, state_name)]
+                
+        for action_id, change in LOCATION_CHANGE.items():
+            if action_id < self.num_actions: self.location_change[action_id] = change
+            
+        # every allowed action that does not move the robot senses the object
+        self.senses = self.location_change == 0
+        
+        self.store = get_pdf_store(pdf_file, action_names, category_names)
+        
+        self.beliefs = DirichletBeliefs(num_envs * num_objects, self.num_categories, self.num_actions, prior_alphas)
+        self.env_ids = np.arange(num_envs)
+        
+        # same RBF encoding of time to completion as InfoMaxTask
+        self.numRBFs = 6
+        self.sigma = self.max_steps / self.numRBFs
+        self.RBFcenters = np.linspace(0, self.max_steps, self.numRBFs).astype(int)
+        
+        self.objects = None
+        self.reset()
+
+
+    def reset(self, randomize=True):
+        """
+        Shuffles objects at all locations of every environment and resets
+        robots and beliefs.
+        """
+        if randomize or self.objects is None:
+            self.objects = np.random.randint(0, self.num_categories, (self.num_envs,self.num_objects))
+            
+        self.current_location = np.zeros(self.num_envs, dtype=np.intp)
+        self.current_state = np.zeros(self.num_envs, dtype=np.intp)
+        self.steps = 0
+        
+        self.beliefs.reset()
+        self.maxentropy = self.calculate_entropy()
+        self.prev_entropy = np.zeros(self.num_envs)
+        self.reward = np.zeros(self.num_envs)
+        self.cumreward = np.zeros(self.num_envs)
+
+
+    def calculate_entropy(self):
+        """
+        summed joint entropy of all objects, per environment
+        """
+        return self.beliefs.joint_entropies().reshape(self.num_envs, self.num_objects).sum(axis=1)
+
+
+    def step(self, actions):
+        """
+        Performs actions[e] in environment e, updates beliefs and returns the
+        rewards.
+        """
+        actions = np.asarray(actions, dtype=np.intp)
+        allowed = self.allowed[self.current_state,actions]
+        
+        # sense the object at the current location, actions the arm is not
+        # in a state to perform are ignored like robotTestServer does
+        sensing = np.flatnonzero(allowed & self.senses[actions])
+        locations = self.current_location[sensing]
+        readings = self.store.sample_batch(actions[sensing], self.objects[sensing,locations])
+        self.beliefs.update_alphas_batch(sensing * self.num_objects + locations, actions[sensing], readings)
+        
+        self.current_location = np.where(allowed, (self.current_location + self.location_change[actions]) % self.num_objects, self.current_location)
+        self.current_state = np.where(allowed, self.next_state[self.current_state,actions], self.current_state)
+        self.steps += 1
+        
+        self.update_reward()
+        self.cumreward += self.reward
+        
+        return self.reward
+
+
+    def update_reward(self):
+        entropy = self.calculate_entropy()
+        norm_ent = (self.maxentropy - entropy) / self.maxentropy
+        norm_change = norm_ent - self.prev_entropy
+        
+        self.prev_entropy = norm_ent
+        self.reward = norm_ent * 2 + norm_change
+
+
+    def percent_correct(self):
+        joint_prob = self.beliefs.joint_prob.reshape(self.num_envs, self.num_objects, self.num_categories)
+        return joint_prob[self.env_ids[:,np.newaxis],np.arange(self.num_objects),self.objects].sum(axis=1) / self.num_objects
+
+
+    def getObservations(self):
+        """
+        InfoMaxTask.getObservation of every environment, one per row
+        """
+        # objects starting at the current location
+        order = (self.current_location[:,np.newaxis] + np.arange(self.num_objects)) % self.num_objects
+        rows = (self.env_ids[:,np.newaxis] * self.num_objects + order).ravel()
+        
+        curj = self.beliefs.joint_prob[rows].reshape(self.num_envs, -1)
+        act_count = self.beliefs.action_count[rows].reshape(self.num_envs, -1)
+        
+        RBFs = np.exp(-((self.steps - self.RBFcenters)**2) / self.sigma)
+        RBFs = np.tile(RBFs, (self.num_envs,1))
+        
+        return np.hstack((curj,act_count,RBFs))
+
+
+    def isFinished(self):
+        return self.steps >= self.max_steps
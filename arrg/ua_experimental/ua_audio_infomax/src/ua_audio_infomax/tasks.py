@@ -54,6 +54,27 @@ __maintainer__ = 'Daniel Ford'
 __email__ = 'dford@email.arizona.edu'
 
 
+def read_prior_alphas(action_names, category_names, alphas_file='/tmp/alphas.pkl'):
+    """
+    Returns an (actions x categories x categories) array of sensor model
+    Dirichlet parameters, actions missing from alphas_file get all ones.
+    """
+    alphas_pkl = open(alphas_file, 'rb')
+    alphas_map = pickle.load(alphas_pkl)
+    alphas_pkl.close()
+    
+    num_categories = len(category_names)
+    prior_alphas = np.ones((len(alphas_map),num_categories,num_categories), dtype=float)
+    
+    for action_id, action_name in enumerate(action_names):
+        if action_name not in alphas_map: continue
+        
+        for category_id, category_name in enumerate(category_names):
+            prior_alphas[action_id,category_id] = alphas_map[action_name][category_name]
+            
+    return prior_alphas
+
+
 class InfoMaxTask(EpisodicTask, Named):
     def __init__(self, environment,
                        sort_beliefs=True,
@@ -72,31 +93,36 @@ class InfoMaxTask(EpisodicTask, Named):
         
         self.state_ids = {'init': 0, 'grasped': 1, 'lifted': 2, 'placed': 3}
         
+        self.beliefs = None
+        self.load_prior_alphas()
         self.initialize()
 
 
+    def load_prior_alphas(self, alphas_file='/tmp/alphas.pkl'):
+        """
+        Loads the per action Dirichlet parameters of the sensor model, the
+        belief engine (and its log-Beta normalizers) is rebuilt from them on
+        the next initialize.
+        """
+        self.prior_alphas = read_prior_alphas(self.env.action_names, self.env.category_names, alphas_file)
+        self.beliefs = None
+
+
     def initialize(self, randomize=True):
         self.steps = 0
         self.current_location = 0
         
-        alphas_pkl = open('/tmp/alphas.pkl', 'rb')
-        alphas_map = pickle.load(alphas_pkl)
-        alphas_pkl.close()
-        
-        self.prior_alphas = np.ones((len(alphas_map),self.env.num_categories,self.env.num_categories), dtype=float)
-        
-        for action_name in self.env.action_names:
-            action_id = self.env.action_names.index(action_name)
-            
-            if action_name not in alphas_map: continue
-            
-            for category_name in self.env.category_names:
-                category_id = self.env.category_names.index(category_name)
-                self.prior_alphas[action_id,category_id] = alphas_map[action_name][category_name]
-                
         self.env.reset(randomize)
         #print 'true objects', self.env.objects
-        self.objects = [BeliefObjectDirichlet(self.env.num_categories, len(self.env.action_names), self.prior_alphas) for _ in self.env.objects]
+        
+        # beliefs about all objects live in one DirichletBeliefs engine,
+        # self.objects are per object views into it
+        if self.beliefs is None or self.beliefs.num_objects != len(self.env.objects):
+            self.beliefs = DirichletBeliefs(len(self.env.objects), self.env.num_categories, len(self.env.action_names), self.prior_alphas)
+        else:
+            self.beliefs.reset()
+            
+        self.objects = self.beliefs.objects
         self.action_counts = np.zeros((len(self.objects),len(self.env.action_names)))
         self.state_counts = np.zeros((len(self.objects),len(self.state_ids.keys())))
         
@@ -130,17 +156,12 @@ class InfoMaxTask(EpisodicTask, Named):
         self.current_location = sensors.location
         
         # send PDF from sensor to update object PDF
-        self.objects[sensors.location].update_alphas(action, sensors.beliefs)
+        self.beliefs.update_alphas(sensors.location, action, sensors.beliefs)
 
 
     # calculate entropy of beliefs
     def calculate_entropy(self):
-        ent = 0
-        
-        for obj in self.objects:
-            ent += obj.compute_joint_entropy()
-            
-        return ent
+        return self.beliefs.joint_entropies().sum()
 
 
     def reset(self, randomize=True):
@@ -154,20 +175,9 @@ class InfoMaxTask(EpisodicTask, Named):
         """
         returns current belief vector
         """
-        beliefs = [self.objects[self.current_location].category_alphas]
-        beliefs.extend([obj.category_alphas for obj in self.objects[self.current_location+1:]])
-        beliefs.extend([obj.category_alphas for obj in self.objects[0:self.current_location]])
-        beliefs = np.asarray(beliefs)
-        
-        curj = [self.objects[self.current_location].joint_prob]
-        curj.extend([obj.joint_prob for obj in self.objects[self.current_location+1:]])
-        curj.extend([obj.joint_prob for obj in self.objects[0:self.current_location]])
-        curj = np.asarray(curj)
-        
-        act_count = [self.objects[self.current_location].action_count]
-        act_count.extend([obj.action_count for obj in self.objects[self.current_location+1:]])
-        act_count.extend([obj.action_count for obj in self.objects[0:self.current_location]])
-        act_count = np.asarray(act_count)
+        # objects starting at the current location
+        curj = np.roll(self.beliefs.joint_prob, -self.current_location, axis=0)
+        act_count = np.roll(self.beliefs.action_count, -self.current_location, axis=0)
         
         # update RBF activations
         self.update_RBFs()
@@ -206,7 +216,7 @@ class InfoMaxTask(EpisodicTask, Named):
         #pred_correct = (predictions == self.env.objects)
         #self.percent_correct = pred_correct.sum() / float(pred_correct.size)
         #self.percent_correct /= (self.samples+1)
-        self.percent_correct = np.array([self.objects[idx].joint_prob[obj_id] for idx,obj_id in enumerate(self.env.objects)]).sum() / len(self.objects)
+        self.percent_correct = self.beliefs.joint_prob[np.arange(len(self.objects)),self.env.objects].sum() / len(self.objects)
         
         # Below two lines were cut and pasted from EpisodicTask.performAction()
         self.updateReward()
@@ -274,6 +284,186 @@ class InfoMaxTask(EpisodicTask, Named):
         return len(self.getObservation())     # belief vector
 
 
+class BatchInfoMaxTask(EpisodicTask, Named):
+    """
+    Evaluates a policy network on an InfoMaxSimulator: every call runs one
+    episode in each of the simulator's environments at the same time and
+    returns the average total reward, so a single evaluation costs no ROS
+    messages and has a lot less variance than one InfoMaxTask episode.
+    """
+    def __init__(self, simulator):
+        EpisodicTask.__init__(self, simulator)
+        self.env = simulator
+        self.max_steps = simulator.max_steps
+
+
+    def reset(self, randomize=True):
+        self.cumreward = 0
+        self.samples = 0
+        self.env.reset(randomize)
+
+
+    def f(self, x):
+        x.reset()
+        self.reset()
+        
+        while not self.isFinished():
+            # Take the max, or random among them if there are several equal maxima
+            actions = [drawGibbs(x.activate(obs), temperature=0) for obs in self.env.getObservations()]
+            self.env.step(actions)
+            self.samples += 1
+            
+        self.cumreward = self.env.cumreward.mean()
+        return self.cumreward
+
+
+    def isFinished(self):
+        return self.env.isFinished()
+
+
+    @property
+    def indim(self):
+        return len(self.env.action_names)
+
+
+    @property
+    def outdim(self):
+        return self.env.getObservations().shape[1]
+
+
+class DirichletBeliefs(Named):
+    """
+    Category beliefs of all objects in an episode, kept in contiguous arrays:
+    category_alphas (objects x actions x categories), action_count
+    (objects x actions) and the joint_alphas/joint_prob (objects x
+    categories) derived from them.
+    
+    Updates compute the same posterior as BeliefObjectDirichlet.update_alphas
+    but in log space, with the log-Beta normalizers of the sensor model
+    computed once per prior instead of on every reading.
+    """
+    def __init__(self, num_objects, num_categories, num_actions, prior_alphas):
+        self.num_objects = num_objects
+        self.num_categories = num_categories
+        self.num_actions = num_actions
+        self.prior_alphas = prior_alphas
+        
+        # log B(alpha) for every (action, category) Dirichlet
+        self.log_B = gammaln(prior_alphas).sum(axis=2) - gammaln(prior_alphas.sum(axis=2))
+        self.exponents = prior_alphas - 1.0
+        
+        self.category_alphas = np.empty((num_objects,num_actions,num_categories), dtype=float)
+        self.action_count = np.empty((num_objects,num_actions))
+        self.joint_alphas = np.empty((num_objects,num_categories))
+        self.joint_prob = np.empty((num_objects,num_categories))
+        
+        self.objects = [BeliefObjectView(self, idx) for idx in range(num_objects)]
+        self.reset()
+
+
+    def reset(self):
+        """
+        resets all object probabilities
+        """
+        self.action_count.fill(0)
+        self.category_alphas.fill(1.0/self.num_categories)
+        self.update_joint_alphas()
+
+
+    def update_joint_alphas(self, objects=slice(None)):
+        alphas = self.category_alphas[objects]
+        self.joint_alphas[objects] = (alphas / alphas.sum(axis=-1)[...,np.newaxis]).mean(axis=-2)
+        self.joint_prob[objects] = self.joint_alphas[objects] / self.joint_alphas[objects].sum(axis=-1)[...,np.newaxis]
+
+
+    def log_likelihoods(self, action_id, current_pdf):
+        """
+        log Dir(current_pdf; prior_alphas[action_id,c]) for every category c
+        """
+        return np.dot(self.exponents[action_id], np.log(current_pdf)) - self.log_B[action_id]
+
+
+    def update_alphas(self, obj, action_id, current_pdf):
+        # after moving current pdf is [] (None if the action was not allowed)
+        if current_pdf is None or not len(current_pdf): return
+        
+        log_r = self.log_likelihoods(action_id, np.asarray(current_pdf))
+        
+        # categories ruled out earlier stay at exactly zero
+        with np.errstate(divide='ignore'):
+            log_ps = np.log(self.category_alphas[obj,action_id]) + log_r
+        ps = np.exp(log_ps - log_ps.max())
+        self.category_alphas[obj,action_id] = ps / ps.sum()
+        
+        self.action_count[obj,action_id] += 1
+        self.update_joint_alphas(obj)
+
+
+    def update_alphas_batch(self, objs, action_ids, current_pdfs):
+        """
+        update_alphas for several distinct objects at once, row i of
+        current_pdfs is the reading of action_ids[i] on objs[i]
+        """
+        if not len(objs): return
+        
+        log_r = (self.exponents[action_ids] * np.log(current_pdfs)[:,np.newaxis,:]).sum(axis=2) - self.log_B[action_ids]
+        
+        with np.errstate(divide='ignore'):
+            log_ps = np.log(self.category_alphas[objs,action_ids]) + log_r
+        ps = np.exp(log_ps - log_ps.max(axis=1)[:,np.newaxis])
+        self.category_alphas[objs,action_ids] = ps / ps.sum(axis=1)[:,np.newaxis]
+        
+        self.action_count[objs,action_ids] += 1
+        self.update_joint_alphas(objs)
+
+
+    def joint_entropies(self):
+        """
+        entropy of the joint category distribution of every object
+        """
+        p = self.joint_prob
+        return -(p * np.log(p)).sum(axis=1)
+
+
+class BeliefObjectView(Named):
+    """
+    Per object view of a DirichletBeliefs engine with the attributes of
+    BeliefObjectDirichlet.
+    """
+    def __init__(self, beliefs, idx):
+        self.beliefs = beliefs
+        self.idx = idx
+
+
+    @property
+    def category_alphas(self):
+        return self.beliefs.category_alphas[self.idx]
+
+
+    @property
+    def action_count(self):
+        return self.beliefs.action_count[self.idx]
+
+
+    @property
+    def joint_alphas(self):
+        return self.beliefs.joint_alphas[self.idx]
+
+
+    @property
+    def joint_prob(self):
+        return self.beliefs.joint_prob[self.idx]
+
+
+    def update_alphas(self, action_id, current_pdf):
+        self.beliefs.update_alphas(self.idx, action_id, current_pdf)
+
+
+    def compute_joint_entropy(self):
+        p = self.joint_prob
+        return -(p * np.log(p)).sum()
+
+
 class BeliefObjectDirichlet(Named):
     def __init__(self, num_categories, num_actions, prior_alphas):
         self.num_categories = num_categories    # number of object categories
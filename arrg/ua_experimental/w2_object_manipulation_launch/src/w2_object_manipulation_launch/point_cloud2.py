@@ -8,9 +8,9 @@ Author: Tim Field
 
 import roslib; roslib.load_manifest('sensor_msgs')
 
-import ctypes
-import math
-import struct
+import sys
+
+import numpy as np
 
 from sensor_msgs.msg import PointCloud2, PointField
 
@@ -24,6 +24,68 @@ _DATATYPES[PointField.UINT32]  = ('I', 4)
 _DATATYPES[PointField.FLOAT32] = ('f', 4)
 _DATATYPES[PointField.FLOAT64] = ('d', 8)
 
+def get_point_dtype(is_bigendian, fields, field_names=None, point_step=None):
+    """
+    Get the numpy structured dtype of one point, laid out exactly like the
+    struct format of the same fields (fields ordered by offset).
+
+    @param is_bigendian: Byte order of the point data.
+    @type  is_bigendian: bool
+    @param fields: The point cloud fields.
+    @type  fields: iterable of L{sensor_msgs.msg.PointField}
+    @param field_names: The names of fields to include. If None, include all fields. [default: None]
+    @type  field_names: iterable
+    @param point_step: Size of one point in bytes. If None, the point ends with its last field. [default: None]
+    @type  point_step: int
+    @return: The point dtype.
+    @rtype:  numpy.dtype
+    """
+    byte_order = '>' if is_bigendian else '<'
+    names, formats, offsets = [], [], []
+
+    end = 0
+    for field in (f for f in sorted(fields, key=lambda f: f.offset) if field_names is None or f.name in field_names):
+        if field.datatype not in _DATATYPES:
+            print >> sys.stderr, 'Skipping unknown PointField datatype [%d]' % field.datatype
+            continue
+        datatype_fmt, datatype_length = _DATATYPES[field.datatype]
+        fmt = byte_order + datatype_fmt
+        names.append(field.name)
+        formats.append(fmt if field.count == 1 else (fmt, field.count))
+        offsets.append(field.offset)
+        end = field.offset + field.count * datatype_length
+
+    itemsize = end if point_step is None else point_step
+    return np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': itemsize})
+
+def cloud_to_array(cloud, field_names=None):
+    """
+    View the data of a L{sensor_msgs.PointCloud2} message as a (height x width)
+    numpy record array, without copying it.
+
+    @param cloud: The point cloud to read from.
+    @type  cloud: L{sensor_msgs.PointCloud2}
+    @param field_names: The names of fields to read. If None, read all fields. [default: None]
+    @type  field_names: iterable
+    @return: Read-only record array with one record per point.
+    @rtype:  numpy.ndarray
+    """
+    dtype = get_point_dtype(cloud.is_bigendian, cloud.fields, field_names, cloud.point_step)
+    return np.ndarray(shape=(cloud.height, cloud.width), dtype=dtype, buffer=cloud.data,
+                      strides=(cloud.row_step, cloud.point_step))
+
+def nan_mask(points):
+    """
+    @return: True for every point of a record array without a NaN value.
+    @rtype:  numpy.ndarray of bool
+    """
+    valid = np.ones(points.shape, dtype=bool)
+    for name in points.dtype.names:
+        values = points[name]
+        if values.dtype.kind == 'f':
+            valid &= ~np.isnan(values).reshape(points.shape + (-1,)).any(axis=-1)
+    return valid
+
 def read_points(cloud, field_names=None, skip_nans=False, uvs=[]):
     """
     Read points from a L{sensor_msgs.PointCloud2} message.
@@ -39,45 +101,46 @@ def read_points(cloud, field_names=None, skip_nans=False, uvs=[]):
     @return: Generator which yields a list of values for each point.
     @rtype:  generator
     """
+    points = read_points_array(cloud, field_names, skip_nans, uvs)
+    view_dtype, value_dtype = _get_value_dtypes(points.dtype)
+
+    for p in np.ascontiguousarray(points).view(view_dtype).astype(value_dtype).tolist():
+        yield p
+
+def read_points_array(cloud, field_names=None, skip_nans=False, uvs=[]):
+    """
+    Read points from a L{sensor_msgs.PointCloud2} message into a record array,
+    in the same order read_points yields them.
+
+    @param cloud: The point cloud to read from.
+    @type  cloud: L{sensor_msgs.PointCloud2}
+    @param field_names: The names of fields to read. If None, read all fields. [default: None]
+    @type  field_names: iterable
+    @param skip_nans: If True, then don't return any point with a NaN value.
+    @type  skip_nans: bool [default: False]
+    @param uvs: If specified, then only return the points at the given coordinates. [default: empty list]
+    @type  uvs: iterable
+    @return: One-dimensional record array of points, a view of cloud.data if
+             no points had to be selected.
+    @rtype:  numpy.ndarray
+    """
     assert isinstance(cloud, roslib.message.Message) and cloud._type == 'sensor_msgs/PointCloud2', 'cloud is not a sensor_msgs.msg.PointCloud2'
-    fmt = _get_struct_fmt(cloud.is_bigendian, cloud.fields, field_names)
-    width, height, point_step, row_step, data, isnan = cloud.width, cloud.height, cloud.point_step, cloud.row_step, cloud.data, math.isnan
-    unpack_from = struct.Struct(fmt).unpack_from
+    points = cloud_to_array(cloud, field_names)
+
+    uvs = list(uvs)
+    if uvs:
+        uvs = np.asarray(uvs, dtype=np.intp).reshape(-1, 2)
+        points = points[uvs[:,1], uvs[:,0]]
+    elif points.flags.c_contiguous or points.shape[0] <= 1:
+        points = points.reshape(-1)
+    else:
+        # rows are padded, every row is still a view
+        points = np.concatenate(list(points))
 
     if skip_nans:
-        if uvs:
-            for u, v in uvs:
-                p = unpack_from(data, (row_step * v) + (point_step * u))
-                has_nan = False
-                for pv in p:
-                    if isnan(pv):
-                        has_nan = True
-                        break
-                if not has_nan:
-                    yield p
-        else:
-            for v in xrange(height):
-                offset = row_step * v
-                for u in xrange(width):
-                    p = unpack_from(data, offset)
-                    has_nan = False
-                    for pv in p:
-                        if isnan(pv):
-                            has_nan = True
-                            break
-                    if not has_nan:
-                        yield p
-                    offset += point_step
-    else:
-        if uvs:
-            for u, v in uvs:
-                yield unpack_from(data, (row_step * v) + (point_step * u))
-        else:
-            for v in xrange(height):
-                offset = row_step * v
-                for u in xrange(width):
-                    yield unpack_from(data, offset)
-                    offset += point_step
+        points = points[nan_mask(points)]
+
+    return points
 
 def create_cloud(header, fields, points):
     """
@@ -90,30 +153,54 @@ def create_cloud(header, fields, points):
     @param points: The point cloud points.
     @type  points: list of iterables, i.e. one iterable for each point, with the
                    elements of each iterable being the values of the fields for 
-                   that point (in the same order as the fields parameter)
+                   that point (in the same order as the fields parameter), a
+                   (number of points x number of values) array or a record array
+                   like the ones read_points_array returns
     @return: The point cloud.
     @rtype:  L{sensor_msgs.msg.PointCloud2}
     """
+    if not isinstance(points, np.ndarray) or points.dtype.names is None:
+        points = points_to_array(fields, points)
 
-    cloud_struct = struct.Struct(_get_struct_fmt(False, fields))
-
-    buff = ctypes.create_string_buffer(cloud_struct.size * len(points))
-
-    point_step, pack_into = cloud_struct.size, cloud_struct.pack_into
-    offset = 0
-    for p in points:
-        pack_into(buff, offset, *p)
-        offset += point_step
+    data = np.ascontiguousarray(points, dtype=get_point_dtype(False, fields))
 
     return PointCloud2(header=header,
                        height=1,
-                       width=len(points),
+                       width=len(data),
                        is_dense=False,
                        is_bigendian=False,
                        fields=fields,
-                       point_step=cloud_struct.size,
-                       row_step=cloud_struct.size * len(points),
-                       data=buff.raw)
+                       point_step=data.dtype.itemsize,
+                       row_step=data.dtype.itemsize * len(data),
+                       data=data.tostring())
+
+def points_to_array(fields, points):
+    """
+    Pack points into a record array laid out like the given fields.
+
+    @param fields: The point cloud fields.
+    @type  fields: iterable of L{sensor_msgs.msg.PointField}
+    @param points: The point cloud points, a (number of points x number of values)
+                   array or a list of iterables with the values of the fields for
+                   each point (in the same order as the fields parameter)
+    @return: Record array with one record per point.
+    @rtype:  numpy.ndarray
+    """
+    dtype = get_point_dtype(False, fields)
+    values = np.asarray(points)
+    records = np.zeros(len(values), dtype=dtype)
+    if not len(values):
+        return records
+
+    values = values.reshape(len(values), -1)
+    column = 0
+    for name in dtype.names:
+        shape = dtype[name].shape
+        count = int(np.prod(shape))
+        records[name] = values[:,column:column+count].reshape((len(values),) + shape)
+        column += count
+
+    return records
 
 def create_cloud_xyz32(header, points):
     """
@@ -131,19 +218,23 @@ def create_cloud_xyz32(header, points):
               PointField('z', 8, PointField.FLOAT32, 1)]
     return create_cloud(header, fields, points)
 
-def _get_struct_fmt(is_bigendian, fields, field_names=None):
-    fmt = '>' if is_bigendian else '<'
-
-    offset = 0
-    for field in (f for f in sorted(fields, key=lambda f: f.offset) if field_names is None or f.name in field_names):
-        if offset < field.offset:
-            fmt += 'x' * (field.offset - offset)
-            offset = field.offset
-        if field.datatype not in _DATATYPES:
-            print >> sys.stderr, 'Skipping unknown PointField datatype [%d]' % field.datatype
-        else:
-            datatype_fmt, datatype_length = _DATATYPES[field.datatype]
-            fmt    += field.count * datatype_fmt
-            offset += field.count * datatype_length
-
-    return fmt
+def _get_value_dtypes(dtype):
+    """
+    Get a dtype viewing every value of a point (fields with count > 1
+    included) as a separate scalar field, and the dtype to convert that view to
+    so tolist() returns the same tuples struct.unpack does (uint32 values
+    become int instead of long).
+    """
+    names, formats, offsets, value_formats = [], [], [], []
+
+    for name in dtype.names:
+        field_dtype, offset = dtype.fields[name][:2]
+        base, count = field_dtype.base, int(np.prod(field_dtype.shape))
+        for idx in xrange(count):
+            names.append('f%d' % len(names))
+            formats.append(base)
+            offsets.append(offset + idx * base.itemsize)
+            value_formats.append(np.int64 if base.kind == 'u' and base.itemsize == 4 else base.newbyteorder('='))
+
+    view_dtype = np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': dtype.itemsize})
+    return view_dtype, np.dtype({'names': names, 'formats': value_formats})
@@ -8,29 +8,46 @@ import cv_bridge
 
 from sensor_msgs.msg import Image
 from background_filters.srv import GetBgStats
+from background_filters.srv import GetBgStatsResponse
+from background_filters.pixel_stats import RunningPixelStats
+from background_filters.pixel_stats import background_stats
 
 import numpy
-import math
+import threading
 
 class BackgroundAverager:
     def __init__(self):
         rospy.init_node('background_averager', anonymous=True)
-        rospy.Subscriber('image', Image, self.handle_image)
-        rospy.Service('get_background_stats', GetBgStats, self.get_bg_stats)
         self.bg_num = rospy.get_param('~bg_num', 10)
 
+        # running mode updates the statistics with every frame instead of
+        # keeping bg_num frames around, with adapt_window > 0 it keeps
+        # following the background after the first bg_num frames
+        self.running = rospy.get_param('~running', False)
+        self.adapt_window = rospy.get_param('~adapt_window', 0)
+
         self.bridge = cv_bridge.CvBridge()
         #self.win1 = cv.NamedWindow('win1')
         #self.win2 = cv.NamedWindow('win2')
+        self.lock = threading.Lock()
         self.counter = 0
         self.have_ave_bg = False
         self.numpy_bgs = []
+        self.running_stats = RunningPixelStats(self.adapt_window)
+        self.stats_dirty = False
         self.covariances = []
         self.averages = []
         self.determinants = []
         self.std_devs = []
 
+        rospy.Subscriber('image', Image, self.handle_image)
+        rospy.Service('get_background_stats', GetBgStats, self.get_bg_stats)
+
     def handle_image(self, msg):
+        if self.running:
+            self.handle_image_running(msg)
+            return
+
         if self.counter < self.bg_num:
             cv_image = self.bridge.imgmsg_to_cv(msg, "bgr8")
             self.numpy_bgs.append(numpy.asarray(cv_image))
@@ -38,45 +55,17 @@ class BackgroundAverager:
             return
 
         if not self.have_ave_bg:
-            self.have_ave_bg = True
             rospy.loginfo('Collected samples for background image averaging')
 
-            height = self.numpy_bgs[0].shape[0]
-            width = self.numpy_bgs[0].shape[1]
-            n_channels = self.numpy_bgs[0].shape[2]
-            depth = cv.IPL_DEPTH_8U
-            size = self.numpy_bgs[0].size
-            rospy.loginfo('height = %d, width = %d, n_channels = %d, depth = %d, size = %d' % (height, width, n_channels, depth, size))
-
-            cov_mat = cv.CreateMat(3, 3, cv.CV_32FC1)
-            ave_arr = cv.CreateMat(1, 3, cv.CV_32FC1)
-
-            # for each pixel in the image
-            for i in xrange(0, size, 3):
-                vects = []
-                # for each image that we sampled
-                for img in self.numpy_bgs:
-                    mat = cv.CreateMatHeader(1, 3, cv.CV_8UC1)
-                    cv.SetData(mat, img.take([i, i+1, i+2]), 3)
-                    vects.append(mat)
-                cv.CalcCovarMatrix(vects, cov_mat, ave_arr, cv.CV_COVAR_NORMAL)
-                self.determinants.append(cv.Det(cov_mat))
-                self.covariances.extend(numpy.asarray(cov_mat, dtype=numpy.uint8).ravel())
-                ave_np = numpy.asarray(ave_arr, dtype=numpy.uint8).ravel()
-                self.averages.extend(ave_np)
-                sdb = sdg = sdr = 0.0
-                for img in self.numpy_bgs:
-                    (b, g, r) = img.take([i, i+1, i+2])
-                    sdb += pow(b - ave_np[0], 2.0)
-                    sdg += pow(g - ave_np[1], 2.0)
-                    sdr += pow(r - ave_np[2], 2.0)
-                self.std_devs.append(math.sqrt(sdb / (self.bg_num - 1.0)))
-                self.std_devs.append(math.sqrt(sdg / (self.bg_num - 1.0)))
-                self.std_devs.append(math.sqrt(sdr / (self.bg_num - 1.0)))
-
-            ave_numpy = numpy.array(self.averages, dtype=numpy.uint8)
-            self.ave_img = cv.CreateImageHeader((width, height), cv.IPL_DEPTH_8U, 3)
-            cv.SetData(self.ave_img, ave_numpy, width * 3)
+            samples = numpy.array(self.numpy_bgs)
+            (height, width, n_channels) = samples.shape[1:]
+            rospy.loginfo('height = %d, width = %d, n_channels = %d, size = %d' % (height, width, n_channels, samples[0].size))
+
+            with self.lock:
+                self.set_stats(background_stats(samples), width, height)
+                self.have_ave_bg = True
+
+            self.numpy_bgs = []
 
             #cv.ShowImage('win1', self.ave_img)
             #cv.ShowImage('win1', self.numpy_bgs[0])
@@ -85,13 +74,45 @@ class BackgroundAverager:
 
             rospy.loginfo('Computed average background image from samples')
 
+    def handle_image_running(self, msg):
+        if self.counter >= self.bg_num and self.adapt_window <= 0:
+            return
+
+        cv_image = self.bridge.imgmsg_to_cv(msg, "bgr8")
+
+        with self.lock:
+            self.running_stats.update(numpy.asarray(cv_image))
+            self.counter += 1
+            self.stats_dirty = True
+
+            if self.counter == self.bg_num:
+                rospy.loginfo('Collected samples for background image averaging')
+                self.have_ave_bg = True
+
+    def set_stats(self, stats, width, height):
+        (self.averages, self.covariances, self.determinants, self.std_devs) = stats
+        self.ave_img = cv.CreateImageHeader((width, height), cv.IPL_DEPTH_8U, 3)
+        cv.SetData(self.ave_img, self.averages, width * 3)
+
     def get_bg_stats(self, req):
-        res = GetBgStats()
-        res.average_background = self.bridge.cv_toimgmsg(self.ave_img)
-        res.covariance_matrix = self.covariances
-        res.covariance_matrix_dets = self.determinants
-        res.standard_deviations = self.std_devs
-        return res
+        with self.lock:
+            if not self.have_ave_bg:
+                rospy.logerr('Background statistics requested before %d samples were collected' % self.bg_num)
+                return None
+
+            # running statistics are only turned into the response arrays
+            # when somebody asks for them
+            if self.running and self.stats_dirty:
+                (height, width) = self.running_stats.mean.shape[:2]
+                self.set_stats(self.running_stats.stats(), width, height)
+                self.stats_dirty = False
+
+            res = GetBgStatsResponse()
+            res.average_background = self.bridge.cv_to_imgmsg(self.ave_img)
+            res.covariance_matrix = self.covariances
+            res.covariance_matrix_dets = self.determinants
+            res.standard_deviations = self.std_devs
+            return res
 
 if __name__ == '__main__':
     b = BackgroundAverager()
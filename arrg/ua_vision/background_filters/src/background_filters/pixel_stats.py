@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+import numpy
+
+
+def covariance_stats(mean, scatter, count):
+    """
+    Turns per-pixel mean and scatter matrices (sum of outer products of the
+    deviations from the mean, what cv.CalcCovarMatrix computes with
+    CV_COVAR_NORMAL) of count samples into the arrays GetBgStats returns:
+    average image, scatter matrices, their determinants and per-channel
+    standard deviations, all flattened in pixel order.
+    """
+    # truncated like before, the epsilon keeps running means that land a few
+    # ulps below an integer from dropping a whole intensity level
+    averages = numpy.asarray(numpy.asarray(mean) + 1e-6, dtype=numpy.uint8).ravel()
+    covariances = numpy.asarray(scatter, dtype=numpy.float32).ravel()
+    determinants = numpy.linalg.det(scatter).astype(numpy.float32).ravel()
+
+    variances = numpy.diagonal(scatter, axis1=-2, axis2=-1) / max(count - 1.0, 1.0)
+    std_devs = numpy.sqrt(variances).astype(numpy.float32).ravel()
+
+    return averages, covariances, determinants, std_devs
+
+
+def background_stats(samples):
+    """
+    Per-pixel statistics of a stack of bg_num images of shape
+    (bg_num, height, width, channels), see covariance_stats.
+    """
+    samples = numpy.asarray(samples, dtype=numpy.float64)
+    mean = samples.mean(axis=0)
+    deviations = samples - mean
+    scatter = numpy.einsum('nhwi,nhwj->hwij', deviations, deviations)
+
+    return covariance_stats(mean, scatter, len(samples))
+
+
+class RunningPixelStats:
+    """
+    Per-pixel mean and covariance updated one frame at a time with
+    Welford's method, so no samples have to be kept around.
+
+    With a window of 0 every frame counts the same and the result equals
+    background_stats over all frames seen so far. With a window of N the
+    first N frames are averaged the same way and every later frame is
+    blended in with weight 1/N, i.e. the statistics keep following a slowly
+    changing background with an effective memory of N frames.
+    """
+    def __init__(self, window=0):
+        self.window = window
+        self.count = 0
+        self.mean = None
+        self.covariance = None
+
+    def update(self, frame):
+        frame = numpy.asarray(frame, dtype=numpy.float64)
+
+        if self.mean is None:
+            self.mean = numpy.zeros(frame.shape)
+            self.covariance = numpy.zeros(frame.shape + frame.shape[-1:])
+
+        self.count += 1
+        weight = 1.0 / self.effective_count()
+
+        # population covariance C after n samples satisfies
+        # C_n = (1 - w) * (C_n-1 + w * d d^T) with d = x - mean_n-1, w = 1/n
+        delta = frame - self.mean
+        self.mean += weight * delta
+        self.covariance += weight * delta[..., :, numpy.newaxis] * delta[..., numpy.newaxis, :]
+        self.covariance *= 1.0 - weight
+
+    def effective_count(self):
+        if self.window > 0: return min(self.count, self.window)
+        return self.count
+
+    def stats(self):
+        count = self.effective_count()
+        return covariance_stats(self.mean, self.covariance * count, count)
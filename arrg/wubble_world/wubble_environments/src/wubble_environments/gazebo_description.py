@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2010, Arizona Robotics Research Group, University of Arizona
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions and the following disclaimer.  * Redistributions
+#     in binary form must reproduce the above copyright notice, this list of
+#     conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution. # Neither the name of
+#     the Willow Garage, Inc. nor the names of its contributors may be used to
+#     endorse or promote products derived from this software without specific
+#     prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 'AS IS'
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import re
+import math
+import hashlib
+import cPickle as pickle
+
+import xml.sax
+from xml.sax.handler import ContentHandler
+from xml.sax.handler import feature_external_ges
+from xml.sax.handler import feature_external_pes
+
+
+# bump whenever parsing changes what ends up in a catalog, so stale cache
+# files are not used
+CATALOG_VERSION = 1
+
+
+class Vector3f():
+    def __init__(self, x, y, z):
+        self.x = x
+        self.y = y
+        self.z = z
+
+class GazeboWorldObject():
+    def __init__(self, sizex, sizey, sizez):
+        self.size = Vector3f(sizex, sizey, sizez)
+        self.s_radius = math.sqrt(sizex * sizex + sizey * sizey + sizez * sizez) / 2
+
+
+def parse_size(text):
+    size = text.strip().split()
+    while len(size) < 3:
+        size.append('0')
+    return (float(size[0]), float(size[1]), float(size[2]))
+
+
+class WorldHandler(ContentHandler):
+    """
+    Collects the visualsize of every named body:* element of a Gazebo world.
+    Nested bodies each get their own visualsize, the first one that is not
+    inside a more deeply nested body.
+    """
+    def __init__(self):
+        ContentHandler.__init__(self)
+        self.sizes = {}
+        self.bodies = []    # stack of [name, size text or None]
+        self.text = None
+
+    def startElement(self, tag, attrs):
+        if tag.startswith('body:'):
+            self.bodies.append([attrs.get('name', '').strip(), None])
+        elif tag == 'visualsize' and self.bodies and self.bodies[-1][1] is None:
+            self.text = []
+
+    def characters(self, content):
+        if self.text is not None: self.text.append(content)
+
+    def endElement(self, tag):
+        if tag == 'visualsize' and self.text is not None:
+            self.bodies[-1][1] = ''.join(self.text)
+            self.text = None
+        elif tag.startswith('body:'):
+            name, size = self.bodies.pop()
+            if name and size is not None: self.sizes[name] = parse_size(size)
+
+
+class RobotHandler(ContentHandler):
+    """
+    Collects the first size attribute inside the base_link of a URDF, the
+    base_link stands for the entire robot.
+    """
+    def __init__(self):
+        ContentHandler.__init__(self)
+        self.sizes = {}
+        self.in_base_link = False
+        self.done = False
+
+    def startElement(self, tag, attrs):
+        if self.done: return
+
+        if tag == 'link' and attrs.get('name', '').strip() == 'base_link':
+            self.in_base_link = True
+        elif self.in_base_link and 'size' in attrs:
+            self.sizes['base_link'] = parse_size(attrs['size'])
+            self.done = True
+
+    def endElement(self, tag):
+        if tag == 'link' and self.in_base_link:
+            self.in_base_link = False
+            self.done = True
+
+
+def parse_sax(description, handler):
+    if not description.strip(): return {}
+    if isinstance(description, unicode): description = description.encode('utf-8')
+
+    # world files pull in models with xi:include, neither those nor any
+    # external entities are followed
+    parser = xml.sax.make_parser()
+    parser.setFeature(feature_external_ges, False)
+    parser.setFeature(feature_external_pes, False)
+    parser.setContentHandler(handler)
+    parser.feed(description)
+    parser.close()
+
+    return handler.sizes
+
+
+def parse_world_regex(world_description):
+    world = dict()
+    regexbody = re.compile(r"<(?P<tag>body:.*?) .*?name *?= *?['\"](.*?)['|\"] *?>(.*?)< *?/(?P=tag) *?>", re.DOTALL)
+    regexsize = re.compile(r"< *?visualsize *?>(.*?)< *?/visualsize *?>", re.DOTALL)
+    for matchbody in re.finditer(regexbody, world_description):
+        matchsize = re.search(regexsize, matchbody.group(3))
+        if (matchsize):
+            world[matchbody.group(2).strip()] = parse_size(matchsize.group(1))
+    return world
+
+def parse_robot_regex(robot_description):
+    robot = dict()
+    regexlink = re.compile(r"<link .*?name *?= *?['\"](.*?)['|\"] *?>(.*?)< *?/link *?>", re.DOTALL)
+    regexsize = re.compile(r"size= *?['\"](.*?)['|\"] *?/>", re.DOTALL)
+    for matchlink in re.finditer(regexlink, robot_description):
+        # Publish only the base_link as the representation for the entire robot
+        if matchlink.group(1).strip() == 'base_link':
+            matchsize = re.search(regexsize, matchlink.group(2))
+            if matchsize:
+                robot[matchlink.group(1).strip()] = parse_size(matchsize.group(1))
+            break;
+    return robot
+
+
+def parse_catalog(world_description, robot_description):
+    """
+    Returns a dict from body name to (sizex, sizey, sizez) for the world
+    bodies and the robot's base_link. Descriptions that are not well formed
+    XML fall back to the old regular expression scan.
+    """
+    catalog = dict()
+
+    for description, handler, fallback in ((world_description, WorldHandler(), parse_world_regex),
+                                           (robot_description, RobotHandler(), parse_robot_regex)):
+        try:
+            catalog.update(parse_sax(description, handler))
+        except xml.sax.SAXException:
+            catalog.update(fallback(description))
+
+    return catalog
+
+
+def catalog_key(world_description, robot_description):
+    sha = hashlib.sha1()
+    for part in (str(CATALOG_VERSION), world_description, robot_description):
+        if isinstance(part, unicode): part = part.encode('utf-8')
+        sha.update(str(len(part)) + ':')
+        sha.update(part)
+    return sha.hexdigest()
+
+
+def default_cache_dir():
+    ros_home = os.environ.get('ROS_HOME', os.path.join(os.path.expanduser('~'), '.ros'))
+    return os.path.join(ros_home, 'wubble_environments')
+
+
+def load_catalog(world_description, robot_description, cache_dir=None):
+    """
+    Same as parse_catalog but the result is kept in cache_dir under the hash
+    of both descriptions, so restarting with the same world skips parsing.
+    """
+    if not cache_dir: return parse_catalog(world_description, robot_description)
+
+    fname = os.path.join(cache_dir, 'catalog_%s.pkl' % catalog_key(world_description, robot_description))
+
+    try:
+        f = open(fname, 'rb')
+        try:
+            return pickle.load(f)
+        finally:
+            f.close()
+    except (IOError, EOFError, ValueError, pickle.UnpicklingError):
+        pass
+
+    catalog = parse_catalog(world_description, robot_description)
+
+    # another node may be loading the same world, only rename a complete
+    # pickle into place
+    try:
+        if not os.path.exists(cache_dir): os.makedirs(cache_dir)
+        tmp_fname = '%s.%d.tmp' % (fname, os.getpid())
+        f = open(tmp_fname, 'wb')
+        pickle.dump(catalog, f, pickle.HIGHEST_PROTOCOL)
+        f.close()
+        os.rename(tmp_fname, fname)
+    except (IOError, OSError):
+        pass
+
+    return catalog
+
+
+class GazeboDescriptionParser():
+    def __init__(self, world_description, robot_description, cache_dir=None):
+        catalog = load_catalog(world_description, robot_description, cache_dir)
+        self.gazebo_world = dict((name, GazeboWorldObject(*size)) for name, size in catalog.items())
+
+    def has_object(self, name):
+        return name in self.gazebo_world
+
+    def get_object(self, name):
+        return self.gazebo_world.get(name, None)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2010, Arizona Robotics Research Group, University of Arizona
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions and the following disclaimer.  * Redistributions
+#     in binary form must reproduce the above copyright notice, this list of
+#     conditions and the following disclaimer in the documentation and/or
+#     other materials provided with the distribution. # Neither the name of
+#     the Willow Garage, Inc. nor the names of its contributors may be used to
+#     endorse or promote products derived from this software without specific
+#     prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 'AS IS'
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import re
+
+import numpy as np
+
+
+BODY_REGEX = re.compile('(env|obj)_(.*?)_(.*?)_(.*?)_body')
+
+# position, orientation, linear and angular velocity and torque of a body,
+# in the order they appear in the icarus state
+STATE_FIELDS = ('xpos', 'ypos', 'zpos',
+                'xori', 'yori', 'zori', 'wori',
+                'xlin', 'ylin', 'zlin',
+                'xang', 'yang', 'zang',
+                'xtrq', 'ytrq', 'ztrq')
+
+
+def body_values(pose, twist, wrench):
+    pos = pose.position
+    ori = pose.orientation
+    lin = twist.linear
+    ang = twist.angular
+    trq = wrench.torque
+
+    return (pos.x, pos.y, pos.z,
+            ori.x, ori.y, ori.z, ori.w,
+            lin.x, lin.y, lin.z,
+            ang.x, ang.y, ang.z,
+            trq.x, trq.y, trq.z)
+
+
+class IcarusStateSerializer():
+    """
+    Turns gazebo_plugins/WorldState messages into the Lisp-style icarus
+    world state.
+
+    Everything that only depends on a body's name (whether it is published
+    at all, its type, color and size) is worked out once per name. Body
+    states are copied into a preallocated array and only bodies whose state
+    differs from the last message are formatted again, the rest reuse their
+    cached text, so an unchanged world costs one comparison per body.
+
+    With a delta_threshold, delta() returns the state of only those bodies
+    that moved by more than the threshold in any value since they were last
+    included in a delta.
+    """
+    def __init__(self, gazebo_world, precision=None, delta_threshold=None):
+        self.gazebo_world = gazebo_world
+        self.delta_threshold = delta_threshold
+
+        # plain %s matches what str() gives for a python float
+        if precision is None: number_format = '%s'
+        else: number_format = '%%.%df' % precision
+        self.state_format = ''.join(' %s %s' % (field, number_format) for field in STATE_FIELDS)
+
+        # name -> (prefix, suffix) of its text or None if it is not published
+        self.bodies = {}
+
+        self.names = None
+        self.layout = []
+        self.values = np.zeros((0, len(STATE_FIELDS)))
+        self.formatted = self.values.copy()
+        self.unformatted = np.zeros(0, dtype=bool)
+        self.pieces = []
+        self.state = '(list)'
+
+        self.delta_values = self.values.copy()
+        self.delta_sent = np.zeros(0, dtype=bool)
+        self.moved = np.zeros(0, dtype=bool)
+
+    def describe(self, name):
+        stripped = name.strip()
+        if not self.gazebo_world.has_object(stripped): return None
+
+        match = BODY_REGEX.search(name)
+
+        if match:
+            kind = 'environment' if match.group(1) == 'env' else 'object'
+            prefix = ' \'(%s %s type %s color %s' % (kind, name, match.group(2), match.group(4))
+        else:
+            body_type = 'self' if stripped == 'base_link' else 'empty'
+            prefix = ' \'(object %s type %s color empty' % (name, body_type)
+
+        prefix += ' role empty status empty'
+
+        obj = self.gazebo_world.get_object(stripped)
+        suffix = ' xsiz %s ysiz %s zsiz %s srad %s)' % (obj.size.x, obj.size.y, obj.size.z, obj.s_radius)
+
+        return prefix, suffix
+
+    def set_names(self, names):
+        self.names = list(names)
+        self.layout = []
+
+        for idx, name in enumerate(self.names):
+            if name not in self.bodies: self.bodies[name] = self.describe(name)
+            if self.bodies[name] is not None: self.layout.append((idx,) + self.bodies[name])
+
+        num_bodies = len(self.layout)
+
+        # every body is formatted on the next update and included in the
+        # next delta
+        self.values = np.zeros((num_bodies, len(STATE_FIELDS)))
+        self.formatted = np.zeros_like(self.values)
+        self.unformatted = np.ones(num_bodies, dtype=bool)
+        self.pieces = [None] * num_bodies
+        self.state = None
+
+        self.delta_values = np.zeros_like(self.values)
+        self.delta_sent = np.zeros(num_bodies, dtype=bool)
+        self.moved = np.zeros(num_bodies, dtype=bool)
+
+    def update(self, data):
+        """
+        Takes a gazebo_plugins/WorldState message and returns the full icarus
+        state string.
+        """
+        names = list(data.name)
+        if self.names != names: self.set_names(names)
+
+        values = self.values
+        pose = data.pose
+        twist = data.twist
+        wrench = data.wrench
+
+        for row, (idx, prefix, suffix) in enumerate(self.layout):
+            values[row] = body_values(pose[idx], twist[idx], wrench[idx])
+
+        # compared bit for bit, -0.0 and 0.0 print differently
+        changed = (values.view(np.int64) != self.formatted.view(np.int64)).any(axis=1)
+        changed |= self.unformatted
+
+        if changed.any() or self.state is None:
+            state_format = self.state_format
+
+            for row in np.flatnonzero(changed):
+                idx, prefix, suffix = self.layout[row]
+                self.pieces[row] = prefix + state_format % tuple(values[row].tolist()) + suffix
+
+            self.formatted[changed] = values[changed]
+            self.unformatted[:] = False
+            self.state = '(list' + ''.join(self.pieces) + ')'
+
+        if self.delta_threshold is not None:
+            moved = ~self.delta_sent
+            moved |= (np.abs(values - self.delta_values) > self.delta_threshold).any(axis=1)
+
+            self.delta_values[moved] = values[moved]
+            self.delta_sent[moved] = True
+            self.moved = moved
+
+        return self.state
+
+    def delta(self):
+        """
+        Returns the icarus state of the bodies that moved in the last update
+        or None if none did.
+        """
+        if not self.moved.any(): return None
+        return '(list' + ''.join(self.pieces[row] for row in np.flatnonzero(self.moved)) + ')'